@@ -1,7 +1,90 @@
+import hmac
+import threading
+import time
+from collections import OrderedDict
 from rest_framework import authentication, exceptions
 from django.conf import settings
 import jwt
 from shipments.models import Shop
+from boloo.global_constants import JWT_AUTH_CACHE_TTL, JWT_AUTH_CACHE_MAX_SIZE
+
+
+class ShopAuthCache:
+
+    """
+    In-process cache of the tokens already authenticated: token signature: (token, shop, expires_at).
+
+    An entry lives until the token expires, at most `ttl` seconds as other processes cannot invalidate it.
+    The entries of a shop are removed when the shop is updated or deactivated through the api (invalidate).
+    """
+
+    def __init__(self, ttl=JWT_AUTH_CACHE_TTL, max_size=JWT_AUTH_CACHE_MAX_SIZE):
+
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_signature(token):
+
+        return token.rsplit('.', 1)[-1]
+
+    def get(self, token):
+
+        """
+        :param token:
+        :return: shop, None if the token is not cached or has expired
+        """
+
+        signature = self.get_signature(token)
+
+        with self.lock:
+            entry = self.entries.get(signature)
+
+            if entry is None:
+                return None
+
+            if entry[2] <= time.time() or not hmac.compare_digest(entry[0], token):
+                self.entries.pop(signature, None)
+                return None
+
+            return entry[1]
+
+    def set(self, token, shop, exp):
+
+        """
+        :param token:
+        :param shop:
+        :param exp: expiry of the token (timestamp), None if it does not expire
+        :return:
+        """
+
+        expires_at = time.time() + self.ttl
+
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+
+        with self.lock:
+            self.entries[self.get_signature(token)] = token, shop, expires_at
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, shop_id):
+
+        """
+        removes the tokens of the shop
+        """
+
+        with self.lock:
+            for signature, entry in list(self.entries.items()):
+                if entry[1].id == shop_id:
+                    del self.entries[signature]
+
+
+shop_auth_cache = ShopAuthCache()
 
 
 class JWTAuthMiddlewareHTTP(authentication.BaseAuthentication):
@@ -45,7 +128,14 @@ class JWTAuthMiddlewareHTTP(authentication.BaseAuthentication):
         """
         Try to authenticate the given credentials. If authentication is
         successful, return the shop and token. If not, throw an error.
+        Tokens already authenticated are taken from shop_auth_cache (no decoding and no db query).
         """
+
+        shop = shop_auth_cache.get(token)
+
+        if shop is not None:
+            return shop, token
+
         try:
             shop_decoded_jwt_data = jwt.decode(
                 token, settings.SECRET_KEY, algorithms=["HS256"]
@@ -67,9 +157,11 @@ class JWTAuthMiddlewareHTTP(authentication.BaseAuthentication):
             msg = "No shop matching this token was found."
             raise exceptions.AuthenticationFailed(msg)
 
-        if not Shop.is_active:
+        if not shop.is_active:
             msg = "The shop matching this token has been deactivated."
             raise exceptions.AuthenticationFailed(msg)
 
+        shop_auth_cache.set(token, shop, shop_decoded_jwt_data.get("exp"))
+
         # can return 2 objects, first will be set to request.user and 2nd to request.auth
         return shop, token
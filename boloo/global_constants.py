@@ -1,8 +1,109 @@
-ACCESS_TOKEN_URL = "https://login.bol.com/token"
+import os
 
+# both can be pointed to a local bol.com simulator (./manage.py run_bol_simulator)
+ACCESS_TOKEN_URL = os.environ.get("BOL_ACCESS_TOKEN_URL", "https://login.bol.com/token")
 
-BASE_URL = "https://api.bol.com/retailer/"
+
+BASE_URL = os.environ.get("BOL_BASE_URL", "https://api.bol.com/retailer/")
 
 SHIPMENTS_LIST_END_POINT = "shipments/"
 
 SHIPMENT_DETAILS_END_POINT = "shipments/"
+
+# fields of the shipments list not used by the sync (details are fetched per shipment), not decoded
+SHIPMENTS_LIST_SKIP_FIELDS = ("shipmentItems", "transport", "shipmentReference")
+
+# max no.of bol.com requests in flight for a sync task (all shops together)
+SYNC_GLOBAL_CONCURRENCY = 20
+
+# max no.of bol.com requests in flight per shop (across all the sync tasks), also the no.of list pages fetched ahead
+SYNC_PER_SHOP_CONCURRENCY = 4
+
+# order in which a sync task sends the requests of its shops: 'round_robin' (a request of every shop in turn) or
+# 'shop_by_shop' (all the requests of a shop before the next one, its shipments are available earlier)
+SYNC_STRATEGY = 'round_robin'
+
+# seconds after which a request slot of a shop which has not been released (dead worker) is given to other requests
+SYNC_SHOP_SLOT_LEASE = 120
+
+# seconds a shop is paused when all of its request slots are held by other tasks
+SYNC_SHOP_SLOT_RETRY_INTERVAL = 0.05
+
+# bol.com rate limits per shop (client_id) and endpoint class: (requests per second, burst)
+SYNC_RATE_LIMITS = {
+    "list": (7, 7),
+    "detail": (14, 14),
+}
+
+# http connection pool of APICall (one per worker process)
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = SYNC_GLOBAL_CONCURRENCY
+
+# (connect, read) timeouts in seconds
+HTTP_TIMEOUT = (5, 30)
+
+# retries on connection errors and 5xx responses, 401 and 429 are handled by APICall itself
+HTTP_MAX_RETRIES = 3
+HTTP_RETRY_BACKOFF_FACTOR = 0.5
+HTTP_RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# access tokens are refreshed this many seconds before they expire
+SYNC_TOKEN_REFRESH_MARGIN = 30
+
+# max seconds a worker may hold the lock for refreshing the token of a shop
+SYNC_TOKEN_LOCK_TIMEOUT = 60
+
+# no.of shipment details of a shop stored (store_data_in_db) at once
+SYNC_STORE_BATCH_SIZE = 100
+
+# fetched batches waiting to be stored before fetching is paused
+SYNC_PIPELINE_MAX_PENDING_BATCHES = 4
+
+# no.of rows per INSERT ... ON DUPLICATE KEY UPDATE in store_data_in_db
+SYNC_UPSERT_BATCH_SIZE = 500
+
+# no.of shipment ids per query when looking up the already stored shipments
+SYNC_DEDUP_CHUNK_SIZE = 1000
+
+# max no.of (type, email): id of addresses cached per worker process by store_data_in_db
+SYNC_ADDRESS_CACHE_SIZE = 100000
+
+# no.of emails per query when looking up the ids of the addresses of a batch
+SYNC_ADDRESS_LOOKUP_CHUNK_SIZE = 1000
+
+# max no.of shops of a sync task, enough shops for their requests to fill the engine of the task
+SYNC_SHOPS_PER_TASK = max(1, SYNC_GLOBAL_CONCURRENCY // SYNC_PER_SHOP_CONCURRENCY)
+
+# seconds the checkpoints of a sync run are kept in redis
+SYNC_CHECKPOINT_TTL = 7 * 24 * 60 * 60
+
+# payloads of the sync tasks (syncpack serializer) are compressed from this many bytes
+SYNC_PAYLOAD_COMPRESS_MIN_SIZE = 1024
+
+# compressed payloads of this many bytes are moved out of the broker message into the blob store
+SYNC_PAYLOAD_OFFLOAD_MIN_SIZE = 64 * 1024
+
+# seconds the offloaded payloads are kept: tasks may wait in the queue for hours during an initial sync, and a run can
+# be resumed as long as its checkpoint is kept (payloads of tasks which succeeded are deleted right away)
+SYNC_PAYLOAD_BLOB_TTL = SYNC_CHECKPOINT_TTL
+
+# max seconds an authenticated api token is cached per process (it is also bounded by the expiry of the token)
+JWT_AUTH_CACHE_TTL = 60
+
+# max no.of api tokens cached per process
+JWT_AUTH_CACHE_MAX_SIZE = 10000
+
+# seconds the shipments api responses are cached (they are also dropped as soon as the shop is synced)
+SHIPMENTS_RESPONSE_CACHE_TTL = 300
+
+# max no.of shipments of a bulk retrieve request (/shipments/bulk/)
+SHIPMENTS_BULK_RETRIEVE_MAX_IDS = 500
+
+# no.of shipments read per query by the shipments export
+SHIPMENTS_EXPORT_BATCH_SIZE = 1000
+
+# upper bounds (seconds) of the buckets of the latency histograms of the sync metrics
+SYNC_METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# max seconds the sync metrics of a process are kept before being handed to the exporter
+SYNC_METRICS_FLUSH_INTERVAL = 10
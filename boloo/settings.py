@@ -130,15 +130,51 @@ REST_FRAMEWORK = {
 
 }
 
+# Redis Settings
+REDIS_URL = 'redis://localhost:6379'
+
 # Celery Settings
-CELERY_BROKER_URL = 'redis://localhost:6379'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379'
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_ACCEPT_CONTENT = ['json']
+# syncpack: compressed payloads of the sync tasks, see shipments/sync_data/serializer.py
+CELERY_ACCEPT_CONTENT = ['json', 'application/x-boloo-syncpack']
 CELERY_ENABLE_UTC = True
 CELERY_IMPORTS = ('shipments.sync_data.tasks', )
 
+# workers take one sync task at a time and acknowledge it when done, the remaining tasks stay in the queue for
+# whichever worker is idle next
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+
+# where the large payloads of the sync tasks are kept: 'redis' or 'disk' (directory shared by all the workers)
+SYNC_BLOB_STORE = 'redis'
+SYNC_BLOB_STORE_DIR = os.path.join(BASE_DIR, 'sync_blobs')
+
+# cache of the shipments api responses: 'redis' or 'locmem' (per process, only when the sync runs in the same process)
+SHIPMENTS_RESPONSE_CACHE = 'redis'
+
+# exporter of the sync metrics: 'prometheus' (added up in redis, served by /main/shipments-sync/metrics/),
+# 'log' (json lines in the log) or None
+SYNC_METRICS_EXPORTER = 'prometheus'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'shipments': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
@@ -0,0 +1,168 @@
+# core imports
+import csv
+import json
+import re
+from djangorestframework_camel_case.util import camelize, camelize_re, underscore_to_camel
+from rest_framework.serializers import BaseSerializer, ListSerializer
+from rest_framework.utils.encoders import JSONEncoder
+
+# project imports
+from boloo.global_constants import SHIPMENTS_EXPORT_BATCH_SIZE
+
+
+class EchoBuffer:
+
+    """
+    File like object handing back what is written, for csv.writer to build lines to stream
+    """
+
+    def write(self, value):
+
+        return value
+
+
+class ShipmentsExport:
+
+    """
+    Streams the shipments of a queryset as NDJSON (a json object per line) or CSV, with the fields of the serializer
+    for the action.
+
+    Shipments are read in batches of `batch_size` ordered by shipment_id (keyset: shipment_id > last id of the previous
+    batch), every batch is one query plus its prefetches and is dropped once written, so memory stays flat whatever the
+    no.of shipments. (MySQL drivers load the whole result of a query in memory, even with QuerySet.iterator)
+    """
+
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    def __init__(self, queryset, serializer_class, action, batch_size=SHIPMENTS_EXPORT_BATCH_SIZE):
+
+        """
+        :param queryset: shipments to export (with the projection / prefetches of the action)
+        :param serializer_class: ModelReadSerializerBase
+        :param action: action the serializer renders the fields of
+        :param batch_size: no.of shipments read per query
+        """
+
+        self.queryset = queryset.order_by('pk')
+        self.serializer_class = serializer_class
+        self.action = action
+        self.batch_size = batch_size
+
+        serialize = serializer_class.compile(action)
+
+        if serialize is None:
+            serialize = serializer_class(context={'action': action}).to_representation
+
+        self.serialize = serialize
+
+    def get_batches(self):
+
+        last_id = None
+
+        while True:
+
+            queryset = self.queryset if last_id is None else self.queryset.filter(pk__gt=last_id)
+
+            batch = list(queryset[:self.batch_size])
+
+            if not batch:
+                return
+
+            yield batch
+
+            if len(batch) < self.batch_size:
+                return
+
+            last_id = batch[-1].pk
+
+    def iter_ndjson(self):
+
+        for batch in self.get_batches():
+            yield ''.join(
+                json.dumps(camelize(self.serialize(shipment)), cls=JSONEncoder, separators=(',', ':')) + '\n'
+                for shipment in batch
+            )
+
+    def get_csv_columns(self):
+
+        """
+        Columns of the csv, from the fields of the serializer: nested serializers are flattened (transport.transportId),
+        the nested list (shipmentItems) gives a line per item.
+
+        :return: (list of (field_name, nested field_name or None), field_name of the nested list or None,
+                  list of the field names of its items)
+        """
+
+        columns, list_field_name, list_columns = [], None, []
+
+        for field_name, field in self.serializer_class(context={'action': self.action}).fields.items():
+
+            if field.write_only:
+                continue
+
+            if isinstance(field, ListSerializer):
+                list_field_name = field_name
+                list_columns = [name for name, child_field in field.child.fields.items()
+                                if not child_field.write_only]
+
+            elif isinstance(field, BaseSerializer):
+                columns.extend((field_name, name) for name, child_field in field.fields.items()
+                               if not child_field.write_only)
+
+            else:
+                columns.append((field_name, None))
+
+        return columns, list_field_name, list_columns
+
+    def iter_csv(self):
+
+        columns, list_field_name, list_columns = self.get_csv_columns()
+
+        writer = csv.writer(EchoBuffer())
+
+        header = [field_name if name is None else '{}.{}'.format(field_name, name) for field_name, name in columns]
+        header.extend('{}.{}'.format(list_field_name, name) for name in list_columns)
+
+        yield writer.writerow([re.sub(camelize_re, underscore_to_camel, column) for column in header])
+
+        for batch in self.get_batches():
+
+            lines = []
+
+            for shipment in batch:
+
+                data = self.serialize(shipment)
+
+                values = []
+
+                for field_name, name in columns:
+
+                    value = data[field_name]
+
+                    if name is not None:
+                        value = None if value is None else value[name]
+
+                    values.append(value)
+
+                items = data[list_field_name] if list_field_name else None
+
+                if not items:
+                    lines.append(writer.writerow(values + [None] * len(list_columns)))
+                    continue
+
+                for item in items:
+                    lines.append(writer.writerow(values + [item[name] for name in list_columns]))
+
+            yield ''.join(lines)
+
+    def stream(self, output):
+
+        """
+        :param output: ndjson / csv
+        :return: generator of the chunks of the export
+        """
+
+        return self.iter_csv() if output == 'csv' else self.iter_ndjson()
@@ -0,0 +1,49 @@
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand
+
+from shipments.sync_data.date_parser import BolDateParser, parse_datetime_slow
+
+
+class Command(BaseCommand):
+
+    help = "Compares the bol.com date parser with the strptime based one on a batch of generated date strings."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--dates', type=int, default=10000, help="no.of date strings per batch")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+
+        start_date = datetime(2020, 1, 1, tzinfo=timezone(timedelta(hours=1)))
+
+        values = [
+            (start_date + timedelta(minutes=random.randint(0, 10 ** 6))).astimezone(
+                timezone(timedelta(hours=random.choice((1, 2))))).isoformat()
+            for _ in range(options['dates'])
+        ]
+
+        parsers = [
+            ("strptime", lambda: [parse_datetime_slow(value) for value in values]),
+            ("BolDateParser", lambda: BolDateParser().parse_many(values)),
+        ]
+
+        # the slicing path is the one used on python 3.6 (no datetime.fromisoformat)
+        slicing_parser = BolDateParser()
+        slicing_parser.fromisoformat = None
+        parsers.append(("BolDateParser (slicing)", lambda: slicing_parser.parse_many(values)))
+
+        expected = parsers[0][1]()
+
+        for name, parse in parsers:
+
+            if parse() != expected:
+                self.stderr.write("{} does not give the same datetimes as strptime".format(name))
+
+            elapsed = min(timeit.repeat(parse, number=1, repeat=options['repeat']))
+
+            self.stdout.write("{}: {:.2f}ms per batch, {:.2f}µs per date".format(
+                name, elapsed * 1000, elapsed / len(values) * 10 ** 6))
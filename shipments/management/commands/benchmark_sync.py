@@ -0,0 +1,102 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from boloo.celery import app
+from shipments.management.utils import SeededDataUtils
+from shipments.models import Shop, Shipment
+from shipments.sync_data.checkpoint import SyncCheckpoint
+from shipments.sync_data.engine import SyncEngine
+from shipments.sync_data.simulator import BolSimulator
+from shipments.sync_data.tasks import fetch_shipments
+from shipments.utils import APICall
+
+
+class Command(BaseCommand):
+
+    help = "Benchmarks a full sync (listing, details and storing) of N shops x M shipments against a local bol.com " \
+           "simulator. The celery tasks are run in this process. The shops and the data created are removed at the end."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--shops', type=int, default=5)
+        parser.add_argument('--shipments', type=int, default=200, help="no.of shipments of every shop")
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--latency', type=float, default=0.05, help="seconds every request takes")
+        parser.add_argument('--token-expires-in', type=int, default=299)
+        parser.add_argument('--list-rate', type=float, default=None,
+                            help="list requests per second per shop accepted by the simulator")
+        parser.add_argument('--detail-rate', type=float, default=None,
+                            help="detail requests per second per shop accepted by the simulator")
+        parser.add_argument('--keep-data', action='store_true', help="do not remove the synced data at the end")
+
+    def handle(self, *args, **options):
+
+        rate_limits = BolSimulator.get_rate_limits(options['list_rate'], options['detail_rate'])
+
+        simulator = BolSimulator(no_of_shipments=options['shipments'], page_size=options['page_size'],
+                                 latency=options['latency'], token_expires_in=options['token_expires_in'],
+                                 rate_limits=rate_limits).start()
+
+        run_id = uuid.uuid4().hex[:8]
+
+        shops = [
+            Shop.objects.create(name='benchmark-{}-{}'.format(run_id, i),
+                                client_id=str(uuid.uuid4()),
+                                client_secret=Shop.generate_new_client_secret())
+            for i in range(options['shops'])
+        ]
+        shop_ids = [shop.id for shop in shops]
+
+        original_urls = APICall.access_token_url, SyncEngine.base_url
+        original_always_eager = app.conf.task_always_eager
+
+        APICall.access_token_url, SyncEngine.base_url = simulator.access_token_url, simulator.base_url
+        app.conf.task_always_eager = True
+
+        try:
+            connection_stats_before = APICall.get_connection_pool_stats()
+
+            sync_id = uuid.uuid4().hex
+            SyncCheckpoint(sync_id).start(shop_ids, False, False)
+
+            start = time.time()
+
+            fetch_shipments(shop_ids, False, False, sync_id)
+
+            elapsed = time.time() - start
+
+            connection_stats = APICall.get_connection_pool_stats()
+
+            self.report(shop_ids, simulator, elapsed, {
+                k: connection_stats[k] - connection_stats_before[k] for k in connection_stats
+            })
+
+        finally:
+            APICall.access_token_url, SyncEngine.base_url = original_urls
+            app.conf.task_always_eager = original_always_eager
+
+            simulator.stop()
+
+            if not options['keep_data']:
+                SeededDataUtils.remove_shops_data(shop_ids, '@benchmark.invalid')
+
+    def report(self, shop_ids, simulator, elapsed, connection_stats):
+
+        no_of_shipments = Shipment.objects.filter(shop_id__in=shop_ids).count()
+        no_of_api_calls = sum(simulator.stats.values())
+
+        self.stdout.write("shops: {}".format(len(shop_ids)))
+        self.stdout.write("shipments stored: {}".format(no_of_shipments))
+        self.stdout.write("time to complete: {:.2f}s".format(elapsed))
+        self.stdout.write("shipments/sec: {:.2f}".format(no_of_shipments / elapsed if elapsed else 0))
+        self.stdout.write("api calls: {}".format(no_of_api_calls))
+        self.stdout.write("api calls per shipment: {:.2f}".format(
+            no_of_api_calls / no_of_shipments if no_of_shipments else 0))
+
+        for (endpoint, status_code), count in sorted(simulator.stats.items()):
+            self.stdout.write("    {} {}: {}".format(endpoint, status_code, count))
+
+        self.stdout.write("connections opened: {}, reused: {}".format(connection_stats['connections'],
+                                                                      connection_stats['reused']))
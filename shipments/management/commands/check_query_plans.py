@@ -0,0 +1,282 @@
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shipments.management.utils import SeededDataUtils
+from shipments.models import Shop, Shipment, ShipmentItem, Address, Transporter
+from shipments.pagination import KeysetPagination
+from shipments.views import ShipmentViewSet
+
+
+class Command(BaseCommand):
+
+    help = "Seeds shops with shipments and checks that the query plans of the shipments list / retrieve use indexes " \
+           "(no full table scans, no sorts, keyset pages read a range of shipment_date). " \
+           "The seeded data is removed at the end."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--shops', type=int, default=5)
+        parser.add_argument('--shipments', type=int, default=20000, help="no.of shipments of every shop")
+        parser.add_argument('--keep-data', action='store_true', help="do not remove the seeded data at the end")
+
+    def handle(self, *args, **options):
+
+        run_id = uuid.uuid4().hex[:8]
+
+        self.stdout.write("seeding {} shops x {} shipments".format(options['shops'], options['shipments']))
+
+        shops = self.seed(run_id, options['shops'], options['shipments'])
+
+        try:
+            failures = self.check(shops[len(shops) // 2])
+
+        finally:
+            if not options['keep_data']:
+                SeededDataUtils.remove_shops_data([shop.id for shop in shops], '{}@query-plans.invalid'.format(run_id))
+
+        if failures:
+            raise CommandError("{} queries are not using indexes: {}".format(len(failures), ', '.join(failures)))
+
+        self.stdout.write("all the queries use indexes")
+
+    @staticmethod
+    def seed(run_id, no_of_shops, no_of_shipments):
+
+        shops = [
+            Shop.objects.create(name='query-plans-{}-{}'.format(run_id, i), client_id=str(uuid.uuid4()),
+                                client_secret=Shop.generate_new_client_secret())
+            for i in range(no_of_shops)
+        ]
+
+        # ids far away from the ones of bol.com
+        base_id = 2 * 10 ** 9 + random.randint(0, 10 ** 6) * 100
+
+        transporter = Transporter.objects.create(transport_id=base_id, transporter_code='TNT', track_and_trace='')
+
+        address = Address.objects.create(email='{}@query-plans.invalid'.format(run_id), type='Customer',
+                                         first_name='query plans')
+
+        start_date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+        shipment_id = base_id
+
+        for shop in shops:
+
+            shipments, shipment_items = [], []
+
+            for i in range(no_of_shipments):
+                shipment_id += 1
+
+                shipments.append(Shipment(
+                    shipment_id=shipment_id, shop=shop, shipment_reference='',
+                    shipment_date=start_date + timedelta(minutes=random.randint(0, 10 ** 6)),
+                    transporter=transporter, customer_details=address, billing_details=address
+                ))
+
+                shipment_items.append(ShipmentItem(shipment_id=shipment_id, order_item_id=str(shipment_id),
+                                                   order_id=str(shipment_id), title=''))
+
+            Shipment.objects.bulk_create(shipments, batch_size=500)
+            ShipmentItem.objects.bulk_create(shipment_items, batch_size=500)
+
+        return shops
+
+    def check(self, shop):
+
+        """
+        explains the queries of the shipments list / retrieve for the shop
+        :return: names of the queries with a bad plan
+        """
+
+        view = ShipmentViewSet(action='list', request=SimpleNamespace(user=shop))
+        list_queryset = view.get_queryset()
+
+        view = ShipmentViewSet(action='retrieve', request=SimpleNamespace(user=shop))
+        retrieve_queryset = view.get_queryset()
+
+        page_size = KeysetPagination.page_size
+
+        middle_shipment = list_queryset[Shipment.objects.filter(shop=shop).count() // 2]
+
+        date_seek, null_date_seek = KeysetPagination().get_after_seeks((middle_shipment.shipment_date,
+                                                                        middle_shipment.shipment_id))
+
+        page_shipment_ids = list(list_queryset.values_list('shipment_id', flat=True)[:page_size])
+
+        # name, queryset, column of the shipments the query has to read a range of
+        queries = [
+            ("list, first page", list_queryset[:page_size], None),
+            ("list, keyset page", list_queryset.filter(date_seek)[:page_size], 'shipment_date'),
+            ("list, keyset page of the shipments without a date", list_queryset.filter(null_date_seek)[:page_size],
+             None),
+            ("retrieve", retrieve_queryset.filter(shipment_id=middle_shipment.shipment_id), None),
+            ("shipment items of a page", ShipmentItem.objects.filter(shipment_id__in=page_shipment_ids), None),
+            ("addresses of a batch", Address.objects.filter(type='Customer', email__in=['a@b', 'c@d']), None),
+        ]
+
+        failures = []
+
+        for name, queryset, range_column in queries:
+
+            plan, problems = self.explain(queryset, range_column)
+
+            start = time.time()
+            list(queryset)
+            elapsed = time.time() - start
+
+            self.stdout.write("{}: {:.2f}ms {}".format(name, elapsed * 1000, "FAIL" if problems else "OK"))
+
+            for line in plan.splitlines():
+                self.stdout.write("    " + line)
+
+            for problem in problems:
+                self.stdout.write("    -> " + problem)
+
+            if problems:
+                failures.append(name)
+
+        # page numbers, for comparison
+        start = time.time()
+        list(list_queryset[page_size * 100:page_size * 101])
+        self.stdout.write("list, page 101 with page numbers: {:.2f}ms".format((time.time() - start) * 1000))
+
+        return failures
+
+    def explain(self, queryset, range_column=None):
+
+        """
+        :param queryset:
+        :param range_column: column of the shipments table the plan has to read a range of, None for no check
+        :return: (plan <str>, list of problems found in the plan)
+        """
+
+        if connection.vendor == 'mysql':
+            plan = queryset.explain(format='json')
+
+            problems = self.get_mysql_problems(json.loads(plan))
+
+            if range_column:
+                problems.extend(self.get_mysql_range_problems(json.loads(plan), range_column))
+
+            return plan, problems
+
+        plan = queryset.explain()
+
+        if connection.vendor == 'sqlite':
+
+            problems = self.get_sqlite_problems(plan)
+
+            if range_column:
+                problems.extend(self.get_sqlite_range_problems(plan, range_column))
+
+            return plan, problems
+
+        return plan, []
+
+    def get_mysql_problems(self, plan):
+
+        problems = []
+
+        if isinstance(plan, dict):
+
+            if plan.get('using_filesort'):
+                problems.append('sort (filesort)')
+
+            if plan.get('using_temporary_table'):
+                problems.append('temporary table')
+
+            if plan.get('access_type') == 'ALL':
+                problems.append('full scan of {}'.format(plan.get('table_name')))
+
+            values = plan.values()
+
+        elif isinstance(plan, list):
+            values = plan
+
+        else:
+            return problems
+
+        for value in values:
+            problems.extend(self.get_mysql_problems(value))
+
+        return problems
+
+    @classmethod
+    def get_mysql_tables(cls, plan):
+
+        """
+        :return: the "table" entries of a json plan
+        """
+
+        if isinstance(plan, dict):
+
+            if 'table_name' in plan:
+                yield plan
+
+            values = plan.values()
+
+        elif isinstance(plan, list):
+            values = plan
+
+        else:
+            return
+
+        for value in values:
+            yield from cls.get_mysql_tables(value)
+
+    def get_mysql_range_problems(self, plan, column):
+
+        """
+        :return: problems if the shipments are not read by a range (access_type range) of an index covering the column
+        """
+
+        tables = [table for table in self.get_mysql_tables(plan) if table['table_name'] == Shipment._meta.db_table]
+
+        if not tables:
+            return ['{} not found in the plan'.format(Shipment._meta.db_table)]
+
+        table = tables[0]
+
+        if table.get('access_type') != 'range' or column not in table.get('used_key_parts', []):
+            return ['no range on {} (access_type: {}, key: {}, used_key_parts: {}, key_length: {})'.format(
+                column, table.get('access_type'), table.get('key'), table.get('used_key_parts'),
+                table.get('key_length'))]
+
+        return []
+
+    @staticmethod
+    def get_sqlite_range_problems(plan, column):
+
+        """
+        :return: problems if the shipments are not searched by a range of the column (e.g "shipment_date<?")
+        """
+
+        for line in plan.splitlines():
+
+            if Shipment._meta.db_table in line and 'SEARCH' in line and \
+                    ('{}<?'.format(column) in line or '{}>?'.format(column) in line):
+                return []
+
+        return ['no range on {}'.format(column)]
+
+    @staticmethod
+    def get_sqlite_problems(plan):
+
+        problems = []
+
+        for line in plan.splitlines():
+
+            if 'TEMP B-TREE' in line:
+                problems.append('sort ({})'.format(line.strip()))
+
+            elif ' SCAN ' in ' {} '.format(line):
+                problems.append('full scan ({})'.format(line.strip()))
+
+        return problems
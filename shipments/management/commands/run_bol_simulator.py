@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from shipments.sync_data.simulator import BolSimulator
+
+
+class Command(BaseCommand):
+
+    help = "Runs a local stand-in of the bol.com apis. Start the celery workers with BOL_BASE_URL and " \
+           "BOL_ACCESS_TOKEN_URL set to the printed urls to sync against it."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--shipments', type=int, default=1000, help="no.of shipments of every shop")
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--latency', type=float, default=0.05, help="seconds every request takes")
+        parser.add_argument('--token-expires-in', type=int, default=299)
+        parser.add_argument('--list-rate', type=float, default=None,
+                            help="list requests per second per shop, over it requests get a 429")
+        parser.add_argument('--detail-rate', type=float, default=None,
+                            help="detail requests per second per shop, over it requests get a 429")
+
+    def handle(self, *args, **options):
+
+        rate_limits = BolSimulator.get_rate_limits(options['list_rate'], options['detail_rate'])
+
+        simulator = BolSimulator(no_of_shipments=options['shipments'], page_size=options['page_size'],
+                                 latency=options['latency'], token_expires_in=options['token_expires_in'],
+                                 rate_limits=rate_limits, port=options['port'])
+
+        self.stdout.write("BOL_BASE_URL={}".format(simulator.base_url))
+        self.stdout.write("BOL_ACCESS_TOKEN_URL={}".format(simulator.access_token_url))
+
+        try:
+            simulator.serve_forever()
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            simulator.stop()
@@ -0,0 +1,39 @@
+# project imports
+from shipments.models import Shop, Shipment, ShipmentItem, Address, Transporter, ShopSyncCursor
+from shipments.sync_data.address_resolver import address_resolver
+
+
+class SeededDataUtils:
+
+    """
+    Utils class for the data created by the benchmark / check management commands
+    """
+
+    @staticmethod
+    def remove_shops_data(shop_ids, address_email_suffix):
+
+        """
+        Removes the shops with their shipments, sync cursors, the transporters of their shipments and the addresses
+        created for the run, as long as no other shipment is linked to them.
+
+        :param shop_ids:
+        :param address_email_suffix: end of the emails of the addresses created for the run
+        :return:
+        """
+
+        shipments = Shipment.objects.filter(shop_id__in=shop_ids)
+
+        transport_ids = set(shipments.values_list('transporter_id', flat=True))
+
+        ShipmentItem.objects.filter(shipment__in=shipments).delete()
+        shipments.delete()
+
+        Transporter.objects.filter(transport_id__in=transport_ids, shipments__isnull=True).delete()
+        Address.objects.filter(email__endswith=address_email_suffix, customer_shipments__isnull=True,
+                               billing_address_shipments__isnull=True).delete()
+
+        # ids of the removed addresses must not be handed out anymore
+        address_resolver.clear()
+
+        ShopSyncCursor.objects.filter(shop_id__in=shop_ids).delete()
+        Shop.objects.filter(id__in=shop_ids).delete()
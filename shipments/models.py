@@ -133,6 +133,13 @@ class Shipment(models.Model):
 
     transporter = models.ForeignKey(Transporter, on_delete=models.PROTECT, related_name='shipments')
 
+    class Meta:
+        indexes = [
+            # shipments list of a shop, newest first: read backwards from this index instead of sorting.
+            # InnoDB appends the primary key (shipment_id) to it, which is the tie breaker of the list.
+            models.Index(fields=['shop', 'shipment_date'], name='shipment_shop_date_idx'),
+        ]
+
     def __str__(self):
         return str(self.shipment_id)
 
@@ -159,5 +166,56 @@ class ShipmentItem(models.Model):
     offer_reference = models.CharField(max_length=32, default='')
     fulfilment_method = models.CharField(max_length=4, choices=FULFILMENT_CHOICES, default=FULFILMENT_CHOICES[0][1])
 
+    class Meta:
+        unique_together = ('shipment', 'order_item_id')
+
     def __str__(self):
         return str(self.shipment_id)
+
+
+class ShopSyncCursor(models.Model):
+
+    """
+    Model class representing the newest shipment synced of a shop per fulfilment method (used by incremental sync)
+    """
+
+    shop = models.ForeignKey(Shop, on_delete=models.PROTECT, related_name='sync_cursors')
+    fulfilment_method = models.CharField(max_length=4, choices=ShipmentItem.FULFILMENT_CHOICES)
+
+    last_shipment_id = models.IntegerField()
+    last_shipment_date = models.DateTimeField(null=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('shop', 'fulfilment_method')
+
+    @staticmethod
+    def get_cursors(shop_ids):
+
+        """
+        cursors of the given shops in the format expected by the sync engine
+        :param shop_ids:
+        :return: dict representing (shop_id, fulfilment_method): (last_shipment_date, last_shipment_id)
+        """
+
+        return {
+            (cursor.shop_id, cursor.fulfilment_method): (cursor.last_shipment_date, cursor.last_shipment_id)
+            for cursor in ShopSyncCursor.objects.filter(shop_id__in=shop_ids)
+        }
+
+    @staticmethod
+    def save_cursors(cursors):
+
+        """
+        saves the cursors returned by the sync engine
+        :param cursors: dict representing (shop_id, fulfilment_method): (last_shipment_date, last_shipment_id)
+        :return:
+        """
+
+        for (shop_id, fulfilment_method), (last_shipment_date, last_shipment_id) in cursors.items():
+            ShopSyncCursor.objects.update_or_create(
+                shop_id=shop_id,
+                fulfilment_method=fulfilment_method,
+                defaults={'last_shipment_id': last_shipment_id, 'last_shipment_date': last_shipment_date}
+            )
@@ -0,0 +1,206 @@
+# core imports
+import base64
+import json
+from collections import OrderedDict
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+
+    """
+    Keyset (seek) pagination on (date_field, id_field), newest first.
+
+    Pages are fetched with `WHERE (date, id) < (cursor date, cursor id) LIMIT page_size`, so they cost the same
+    however deep they are and no count is run. The cursors are opaque strings holding the position of the first / last
+    row of the page. Rows without a date come last (MySQL sorts NULLs last on descending order), they are read by a seek
+    of their own once the dated rows are exhausted.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+
+    date_field = 'shipment_date'
+    id_field = 'shipment_id'
+
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+
+        self.base_url = None
+        self.has_next = False
+        self.has_previous = False
+        self.page = []
+
+    @property
+    def ordering(self):
+
+        return '-' + self.date_field, '-' + self.id_field
+
+    def encode_cursor(self, position, reverse):
+
+        """
+        :param position: (date, id) of a row
+        :param reverse: True for a cursor of the page before the position
+        :return: opaque cursor <str>
+        """
+
+        date, row_id = position
+
+        value = json.dumps([date.isoformat() if date else None, row_id, int(reverse)], separators=(',', ':'))
+
+        return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+
+        """
+        :param request:
+        :return: ((date, id), reverse) or None if there is no cursor
+        """
+
+        encoded = request.query_params.get(self.cursor_query_param)
+
+        if not encoded:
+            return None
+
+        try:
+            date, row_id, reverse = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode())
+
+            if date is not None:
+                date = parse_datetime(date)
+
+                if date is None:
+                    raise ValueError
+
+            return (date, int(row_id)), bool(reverse)
+
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_date_seek(self, date, row_id, reverse):
+
+        """
+        :return: Q of the dated rows after (before if reverse) (date, row_id), a range on the date:
+                 `date <= cursor date AND NOT (date = cursor date AND id >= cursor id)`
+        """
+
+        if reverse:
+            return (Q(**{self.date_field + '__gte': date}) &
+                    ~Q(**{self.date_field: date, self.id_field + '__lte': row_id}))
+
+        return Q(**{self.date_field + '__lte': date}) & ~Q(**{self.date_field: date, self.id_field + '__gte': row_id})
+
+    def get_after_seeks(self, position):
+
+        """
+        :return: list of Q, the rows which come after the position in the order of the pages are the rows of the first
+                 Q, then of the next one... every Q is a single range of the (shop, date, id) index
+        """
+
+        date, row_id = position
+
+        if date is None:
+            return [Q(**{self.date_field + '__isnull': True, self.id_field + '__lt': row_id})]
+
+        # the rows without a date are a seek of their own, an OR with them would leave the date unbounded
+        return [self.get_date_seek(date, row_id, False), Q(**{self.date_field + '__isnull': True})]
+
+    def get_before_seeks(self, position):
+
+        """
+        :return: list of Q of the rows which come before the position, read backwards (see get_after_seeks)
+        """
+
+        date, row_id = position
+
+        if date is None:
+            return [Q(**{self.date_field + '__isnull': True, self.id_field + '__gt': row_id}),
+                    Q(**{self.date_field + '__isnull': False})]
+
+        return [self.get_date_seek(date, row_id, True)]
+
+    @staticmethod
+    def read_seeks(queryset, seeks, limit):
+
+        """
+        :return: the first `limit` rows of the seeks, a query per seek until there are enough rows
+        """
+
+        rows = []
+
+        for seek in seeks:
+
+            rows.extend(queryset.filter(seek)[:limit - len(rows)])
+
+            if len(rows) >= limit:
+                break
+
+        return rows
+
+    def get_position(self, row):
+
+        return getattr(row, self.date_field), getattr(row, self.id_field)
+
+    def paginate_queryset(self, queryset, request, view=None):
+
+        self.base_url = request.build_absolute_uri()
+
+        cursor = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.ordering)
+
+        if cursor is None:
+            rows = list(queryset[:self.page_size + 1])
+
+            self.has_next = len(rows) > self.page_size
+            self.has_previous = False
+            self.page = rows[:self.page_size]
+
+        elif not cursor[1]:
+            rows = self.read_seeks(queryset, self.get_after_seeks(cursor[0]), self.page_size + 1)
+
+            self.has_next = len(rows) > self.page_size
+            self.has_previous = True
+            self.page = rows[:self.page_size]
+
+        else:
+            # the page before the cursor is read backwards, from the cursor on
+            rows = self.read_seeks(queryset.reverse(), self.get_before_seeks(cursor[0]), self.page_size + 1)
+
+            self.has_previous = len(rows) > self.page_size
+            self.has_next = True
+            self.page = list(reversed(rows[:self.page_size]))
+
+        return self.page
+
+    def get_next_link(self):
+
+        if not self.has_next or not self.page:
+            return None
+
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   self.encode_cursor(self.get_position(self.page[-1]), False))
+
+    def get_previous_link(self):
+
+        if not self.has_previous:
+            return None
+
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   self.encode_cursor(self.get_position(self.page[0]), True))
+
+    def get_paginated_response(self, data):
+
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,149 @@
+# core imports
+import hashlib
+import json
+import threading
+import time
+from django.conf import settings
+
+# project imports
+from shipments.utils import RedisUtils
+from boloo.global_constants import SHIPMENTS_RESPONSE_CACHE_TTL
+
+
+class RedisResponseCacheBackend:
+
+    """
+    Keeps the cached responses and the versions of the shops in redis, shared by all the processes
+    """
+
+    def get(self, key):
+
+        value = RedisUtils.get_connection().get(key)
+
+        return None if value is None else json.loads(value.decode())
+
+    def set(self, key, value, ttl):
+
+        RedisUtils.get_connection().set(key, json.dumps(value), ex=ttl)
+
+    def get_counter(self, key):
+
+        return int(RedisUtils.get_connection().get(key) or 0)
+
+    def incr_counter(self, key):
+
+        return RedisUtils.get_connection().incr(key)
+
+
+class LocalMemoryResponseCacheBackend:
+
+    """
+    Stand-in for redis, for development: keeps everything in the process.
+    Only correct when the sync runs in the same process as the api (the versions are bumped by store_data_in_db).
+    """
+
+    def __init__(self):
+
+        # key: (value, expires_at)
+        self.values = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+
+        entry = self.values.get(key)
+
+        if entry is None or entry[1] <= time.time():
+            return None
+
+        return entry[0]
+
+    def set(self, key, value, ttl):
+
+        with self.lock:
+            now = time.time()
+
+            # dropping the expired entries from time to time
+            if len(self.values) > 10000:
+                self.values = {k: v for k, v in self.values.items() if v[1] > now}
+
+            self.values[key] = value, now + ttl
+
+    def get_counter(self, key):
+
+        return self.counters.get(key, 0)
+
+    def incr_counter(self, key):
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+            return self.counters[key]
+
+
+class ShipmentsResponseCache:
+
+    """
+    Cache of the data of the shipments api responses, per shop.
+
+    Shipments only change when the sync stores them: every shop has a version, bumped by store_data_in_db once its
+    transaction is committed. Cached responses and ETags belong to a version, a new version makes them all stale.
+    """
+
+    key_prefix = "shipments_response"
+    version_key_prefix = "shipments_version"
+
+    def __init__(self, ttl=SHIPMENTS_RESPONSE_CACHE_TTL):
+
+        self.ttl = ttl
+        self.backend = None
+
+    def get_backend(self):
+
+        if self.backend is None:
+
+            if settings.SHIPMENTS_RESPONSE_CACHE == 'locmem':
+                self.backend = LocalMemoryResponseCacheBackend()
+
+            else:
+                self.backend = RedisResponseCacheBackend()
+
+        return self.backend
+
+    def get_version(self, shop_id):
+
+        return self.get_backend().get_counter('{}:{}'.format(self.version_key_prefix, shop_id))
+
+    def bump_version(self, shop_id):
+
+        """
+        to be called when shipments of the shop have changed
+        """
+
+        return self.get_backend().incr_counter('{}:{}'.format(self.version_key_prefix, shop_id))
+
+    def get_key(self, shop_id, version, action, request_key):
+
+        """
+        :param request_key: what identifies the response within the action (url, media type...)
+        :return: cache key
+        """
+
+        request_hash = hashlib.sha1(request_key.encode()).hexdigest()
+
+        return '{}:{}:{}:{}:{}'.format(self.key_prefix, shop_id, version, action, request_hash)
+
+    def get_etag(self, key):
+
+        return '"{}"'.format(hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+
+        return self.get_backend().get(key)
+
+    def set(self, key, data):
+
+        self.get_backend().set(key, data, self.ttl)
+
+
+shipments_response_cache = ShipmentsResponseCache()
@@ -1,5 +1,10 @@
+from collections import OrderedDict
+from operator import attrgetter
+from django.db.models import Manager, Prefetch
 from shipments.models import ShipmentItem, Shipment, Address, Transporter, Shop
-from rest_framework.serializers import ModelSerializer, ALL_FIELDS
+from rest_framework.fields import FileField, SerializerMethodField
+from rest_framework.relations import HyperlinkedRelatedField, ManyRelatedField, PKOnlyObject, RelatedField
+from rest_framework.serializers import ModelSerializer, ListSerializer, BaseSerializer, ALL_FIELDS
 
 
 class ModelReadSerializerBase(ModelSerializer):
@@ -14,6 +19,9 @@ class ModelReadSerializerBase(ModelSerializer):
      return super class get_fields (default behaviour)
     """
 
+    # (serializer class, action): compiled serializer function, see compile
+    compiled_serializers = {}
+
     def __init__(self, *args, **kwargs):
         """over write Meta attributes depending upon view action"""
         super().__init__(*args, **kwargs)
@@ -132,6 +140,186 @@ class ModelReadSerializerBase(ModelSerializer):
 
         return fields
 
+    @classmethod
+    def get_projection(cls, action, prefix='', required_fields=()):
+
+        """
+        Model fields rendered by the serializer for the action, for loading only those.
+        Nested serializers of forward relations are joined (select_related), the ones of reverse relations are
+        prefetched, both with their own projection.
+
+        :param action: view action (list / retrieve...)
+        :param prefix: path of the relation the serializer is nested in (e.g transporter__)
+        :param required_fields: fields to load even if they are not rendered
+        :return: (only <list>, select_related <list>, prefetches <list of Prefetch>),
+                 None if all the fields of the model are needed (source='*', dotted sources)
+        """
+
+        model = cls.Meta.model
+
+        only = [prefix + field_name for field_name in (model._meta.pk.name,) + tuple(required_fields)]
+        select_related, prefetches = [], []
+
+        for field in cls(context={'action': action}).fields.values():
+
+            source = field.source
+
+            if source == '*' or '.' in source:
+                return None
+
+            if isinstance(field, ListSerializer) and isinstance(field.child, ModelReadSerializerBase):
+
+                relation = model._meta.get_field(source)
+
+                # the foreign key is needed for matching the prefetched rows with their objects
+                queryset = field.child.__class__.project_queryset(relation.related_model.objects.all(), action,
+                                                                  required_fields=(relation.field.name,))
+
+                prefetches.append(Prefetch(prefix + source, queryset=queryset))
+
+            elif isinstance(field, ModelReadSerializerBase):
+
+                projection = field.__class__.get_projection(action, prefix + source + '__')
+
+                select_related.append(prefix + source)
+
+                if projection is None:
+                    # all the fields of the related model are loaded
+                    only.append(prefix + source)
+                    continue
+
+                only.extend(projection[0])
+                select_related.extend(projection[1])
+                prefetches.extend(projection[2])
+
+            elif isinstance(field, BaseSerializer):
+                # other nested serializers (Meta.depth) get all the fields
+                return None
+
+            else:
+                only.append(prefix + source)
+
+        return only, select_related, prefetches
+
+    @classmethod
+    def project_queryset(cls, queryset, action, required_fields=()):
+
+        """
+        Restricts the queryset to the columns the serializer renders for the action, see get_projection
+        :param queryset:
+        :param action:
+        :param required_fields: fields to load even if they are not rendered
+        :return: queryset
+        """
+
+        projection = cls.get_projection(action, required_fields=required_fields)
+
+        if projection is None:
+            return queryset
+
+        only, select_related, prefetches = projection
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+
+        return queryset.only(*only)
+
+
+    @classmethod
+    def compile(cls, action):
+
+        """
+        Returns a plain function doing what to_representation of the serializer does for the action, same output
+        but without building serializer and field objects for every object serialized.
+        It is built once per (serializer, action) from the fields of the serializer.
+
+        :param action: view action (list / retrieve...)
+        :return: function(instance) -> OrderedDict, None if some fields need the request / serializer instance
+        """
+
+        key = (cls, action)
+
+        if key not in cls.compiled_serializers:
+            cls.compiled_serializers[key] = cls.build_compiled_serializer(action)
+
+        return cls.compiled_serializers[key]
+
+    @classmethod
+    def build_compiled_serializer(cls, action):
+
+        # list of (field_name, get_attribute, to_representation)
+        steps = []
+
+        for field in cls(context={'action': action}).fields.values():
+
+            if field.write_only:
+                continue
+
+            if isinstance(field, (SerializerMethodField, FileField, HyperlinkedRelatedField, ManyRelatedField)):
+                return None
+
+            if isinstance(field, ListSerializer):
+
+                if not isinstance(field.child, ModelReadSerializerBase) or '.' in field.source:
+                    return None
+
+                child = field.child.__class__.compile(action)
+
+                if child is None:
+                    return None
+
+                steps.append((field.field_name, attrgetter(field.source), cls.get_list_representation(child)))
+
+            elif isinstance(field, BaseSerializer):
+
+                if not isinstance(field, ModelReadSerializerBase) or '.' in field.source:
+                    return None
+
+                child = field.__class__.compile(action)
+
+                if child is None:
+                    return None
+
+                steps.append((field.field_name, field.get_attribute, child))
+
+            elif isinstance(field, RelatedField) or field.source == '*' or '.' in field.source:
+                # resolved by the field itself (pk only objects, nested attributes...)
+                steps.append((field.field_name, field.get_attribute, field.to_representation))
+
+            else:
+                steps.append((field.field_name, attrgetter(field.source), field.to_representation))
+
+        steps = tuple(steps)
+
+        def serialize(instance):
+
+            ret = OrderedDict()
+
+            for field_name, get_attribute, to_representation in steps:
+                attribute = get_attribute(instance)
+
+                check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+
+                ret[field_name] = None if check_for_none is None else to_representation(attribute)
+
+            return ret
+
+        return serialize
+
+    @staticmethod
+    def get_list_representation(child):
+
+        def to_representation(data):
+
+            iterable = data.all() if isinstance(data, Manager) else data
+
+            return [child(item) for item in iterable]
+
+        return to_representation
+
 
 class ShopSerializer(ModelSerializer):
 
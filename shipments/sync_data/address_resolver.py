@@ -0,0 +1,96 @@
+# core imports
+import threading
+from collections import OrderedDict
+from django.db import transaction
+
+# project imports
+from shipments.models import Address
+from shipments.utils import CommonUtils
+from boloo.global_constants import SYNC_ADDRESS_CACHE_SIZE, SYNC_ADDRESS_LOOKUP_CHUNK_SIZE
+
+
+class AddressResolver:
+
+    """
+    Finds the ids of the addresses of a batch from their (type, email), the unique key of Address.
+
+    Only the emails of the batch are looked up (chunked IN queries), the ids found are kept in an LRU cache of at most
+    `max_size` entries per process, customers come back for many shipments.
+    Ids are cached once the transaction which read them is committed, so ids of addresses whose insert has been
+    rolled back are never handed out.
+    """
+
+    def __init__(self, max_size=SYNC_ADDRESS_CACHE_SIZE, chunk_size=SYNC_ADDRESS_LOOKUP_CHUNK_SIZE):
+
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+        # (type, email): id, least recently used first
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_cached(self, address_type, emails):
+
+        """
+        :return: dict representing email: id of the emails found in the cache
+        """
+
+        found = {}
+
+        with self.lock:
+            for email in emails:
+                address_id = self.cache.get((address_type, email))
+
+                if address_id is not None:
+                    self.cache.move_to_end((address_type, email))
+                    found[email] = address_id
+
+        return found
+
+    def add_to_cache(self, address_type, email_to_id_map):
+
+        with self.lock:
+            for email, address_id in email_to_id_map.items():
+                self.cache[(address_type, email)] = address_id
+                self.cache.move_to_end((address_type, email))
+
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def resolve(self, address_type, emails):
+
+        """
+        :param address_type: Customer / Billing
+        :param emails: emails of addresses which are stored (or upserted in the current transaction)
+        :return: dict representing email: id, emails without an address are left out
+        """
+
+        emails = set(emails)
+
+        email_to_id_map = self.get_cached(address_type, emails)
+
+        missing_emails = list(emails.difference(email_to_id_map))
+
+        looked_up = {}
+
+        for chunk in CommonUtils.chunks(missing_emails, self.chunk_size):
+            looked_up.update(Address.objects.filter(type=address_type, email__in=chunk).values_list('email', 'id'))
+
+        if looked_up:
+            transaction.on_commit(lambda: self.add_to_cache(address_type, looked_up))
+
+        email_to_id_map.update(looked_up)
+
+        return email_to_id_map
+
+    def clear(self):
+
+        """
+        to be called when addresses are deleted
+        """
+
+        with self.lock:
+            self.cache.clear()
+
+
+address_resolver = AddressResolver()
@@ -1,12 +1,24 @@
-from rest_framework import viewsets
+from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from shipments.utils import CommonUtils
-from shipments.models import Shop
 from rest_framework.permissions import AllowAny
-from multiprocessing import cpu_count
-import math
-from shipments.sync_data.tasks import fetch_shipments
+from rest_framework.renderers import BaseRenderer
+from shipments.sync_data.metrics import sync_metrics
+from shipments.sync_data.checkpoint import SyncCheckpoint
+from shipments.sync_data.scheduler import SyncScheduler
+from shipments.sync_data.tasks import fetch_shipments, resume_sync
+import uuid
+
+
+class PlainTextRenderer(BaseRenderer):
+
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+
+        return data
 
 
 class ShipmentsSyncViewSet(viewsets.ViewSet):
@@ -19,6 +31,29 @@ class ShipmentsSyncViewSet(viewsets.ViewSet):
 
         return 'shop_{}_shipments'.format(shop_id)
 
+    @staticmethod
+    def start_sync(incremental=False):
+
+        """
+        Starts a fetch_shipments task for every active shop.
+        The progress of the run is checkpointed, so that it can be resumed.
+
+        :param incremental: only sync shipments newer than the ones already synced
+        :return: sync_id
+        """
+
+        sync_id = uuid.uuid4().hex
+
+        shop_ids = SyncScheduler.get_shop_ids_to_sync()
+
+        SyncCheckpoint(sync_id).start(shop_ids, incremental, refresh_stored=False)
+
+        # a few shops per task, their requests are sent concurrently by the engine of the task
+        for task_shop_ids in SyncScheduler.split_shop_ids(shop_ids):
+            fetch_shipments.delay(task_shop_ids, incremental, False, sync_id)
+
+        return sync_id
+
     @action(detail=False, methods=["get"], url_path="initial-sync")
     def initial_sync(self, request):
 
@@ -29,22 +64,62 @@ class ShipmentsSyncViewSet(viewsets.ViewSet):
         :return:
         """
 
-        all_active_shops_ids = list(Shop.objects.filter(is_active=True).values_list('id', flat=True))
+        sync_id = self.start_sync()
 
-        all_active_shops_ids_count = len(all_active_shops_ids)
+        return Response({"message": "Async Tasks have been started.", "sync_id": sync_id})
 
-        no_of_cores = cpu_count()
+    @action(detail=False, methods=["get"], url_path="incremental-sync")
+    def incremental_sync(self, request):
 
-        min_no_of_shops_per_process = 5
+        """
+        For syncing only the shipments created since the previous sync of each shop.
+        Shops which have never been synced are synced completely.
 
-        if min_no_of_shops_per_process > math.ceil(all_active_shops_ids_count / no_of_cores):
-            no_of_cores = math.ceil(all_active_shops_ids_count / min_no_of_shops_per_process)
+        :param request:
+        :return:
+        """
 
-        shop_ids_chunks = list(CommonUtils.chunks(all_active_shops_ids, math.ceil(all_active_shops_ids_count / no_of_cores)))
+        sync_id = self.start_sync(incremental=True)
 
-        for shop_ids_chunk in shop_ids_chunks:
-            fetch_shipments.delay(shop_ids_chunk)
+        return Response({"message": "Async Tasks have been started.", "sync_id": sync_id})
+
+    @action(detail=False, methods=["get"], url_path="resume-sync")
+    def resume_sync(self, request):
+
+        """
+        For continuing a sync whose tasks have been lost (e.g workers killed), from where it stopped.
+        Resumes the sync given by the `sync_id` param, the last sync started if it is not given.
+
+        :param request:
+        :return:
+        """
+
+        sync_id = request.query_params.get('sync_id')
+
+        checkpoint = SyncCheckpoint(sync_id) if sync_id else SyncCheckpoint.get_latest()
+
+        if checkpoint is None or not checkpoint.get_shop_states():
+            return Response({"message": "No sync to resume."}, status=status.HTTP_404_NOT_FOUND)
+
+        no_of_shops_resumed = resume_sync(checkpoint.sync_id)
+
+        return Response({"message": "{} shops have been resumed.".format(no_of_shops_resumed),
+                         "sync_id": checkpoint.sync_id})
+
+    @action(detail=False, methods=["get"], url_path="metrics", renderer_classes=(PlainTextRenderer, ))
+    def metrics(self, request):
+
+        """
+        Metrics of the sync (see sync_data.metrics), in the Prometheus text format.
+        Only available with settings.SYNC_METRICS_EXPORTER = 'prometheus'.
+
+        :param request:
+        :return:
+        """
 
-        return Response({"message": "Async Tasks have been started."})
+        exporter = sync_metrics.get_exporter()
 
+        if not hasattr(exporter, 'render'):
+            return Response("Sync metrics are not exported to prometheus.\n", status=status.HTTP_404_NOT_FOUND)
 
+        return Response(exporter.render(sync_metrics.buckets), content_type='text/plain; version=0.0.4; charset=utf-8')
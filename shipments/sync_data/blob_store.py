@@ -0,0 +1,153 @@
+# core imports
+import os
+import time
+import uuid
+from django.conf import settings
+
+# project imports
+from shipments.utils import RedisUtils
+from boloo.global_constants import SYNC_PAYLOAD_BLOB_TTL
+
+
+class RedisBlobStore:
+
+    """
+    Keeps the blobs in redis (keys expire after `ttl` seconds, unless deleted once the task has succeeded)
+    """
+
+    key_prefix = "sync_blob"
+
+    def __init__(self, ttl=SYNC_PAYLOAD_BLOB_TTL):
+
+        self.ttl = ttl
+
+    def get_key(self, blob_id):
+
+        return '{}:{}'.format(self.key_prefix, blob_id)
+
+    def put(self, data):
+
+        """
+        :param data: bytes
+        :return: blob_id <str>
+        """
+
+        blob_id = uuid.uuid4().hex
+
+        RedisUtils.get_connection().set(self.get_key(blob_id), data, ex=self.ttl)
+
+        return blob_id
+
+    def get(self, blob_id):
+
+        data = RedisUtils.get_connection().get(self.get_key(blob_id))
+
+        if data is None:
+            raise KeyError("blob {} is missing or has expired".format(blob_id))
+
+        return data
+
+    def delete(self, blob_id):
+
+        RedisUtils.get_connection().delete(self.get_key(blob_id))
+
+
+class DiskBlobStore:
+
+    """
+    Keeps the blobs as files of a directory, which has to be shared by all the workers.
+    Files older than `ttl` seconds are removed by the puts (at most once per `cleanup_interval` seconds per process).
+    """
+
+    def __init__(self, directory, ttl=SYNC_PAYLOAD_BLOB_TTL, cleanup_interval=3600):
+
+        self.directory = directory
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+
+        self.last_cleanup_at = 0
+
+    def get_path(self, blob_id):
+
+        return os.path.join(self.directory, blob_id)
+
+    def put(self, data):
+
+        """
+        :param data: bytes
+        :return: blob_id <str>
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        if time.time() - self.last_cleanup_at > self.cleanup_interval:
+            self.cleanup()
+
+        blob_id = uuid.uuid4().hex
+
+        # written under a temporary name, a reader never sees a partial blob
+        temp_path = self.get_path(blob_id + '.tmp')
+
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+
+        os.replace(temp_path, self.get_path(blob_id))
+
+        return blob_id
+
+    def get(self, blob_id):
+
+        try:
+            with open(self.get_path(blob_id), 'rb') as f:
+                return f.read()
+
+        except FileNotFoundError:
+            raise KeyError("blob {} is missing or has expired".format(blob_id))
+
+    def delete(self, blob_id):
+
+        try:
+            os.remove(self.get_path(blob_id))
+
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self):
+
+        """
+        removes the blobs older than ttl
+        """
+
+        self.last_cleanup_at = time.time()
+
+        for entry in os.scandir(self.directory):
+
+            try:
+                if entry.is_file() and entry.stat().st_mtime < self.last_cleanup_at - self.ttl:
+                    os.remove(entry.path)
+
+            except FileNotFoundError:
+                # removed by another worker
+                pass
+
+
+blob_store = None
+
+
+def get_blob_store():
+
+    """
+    :return: blob store of the process, as configured by settings.SYNC_BLOB_STORE ('redis' or 'disk')
+    """
+
+    global blob_store
+
+    if blob_store is None:
+
+        if settings.SYNC_BLOB_STORE == 'disk':
+            blob_store = DiskBlobStore(settings.SYNC_BLOB_STORE_DIR)
+
+        else:
+            blob_store = RedisBlobStore()
+
+    return blob_store
@@ -0,0 +1,200 @@
+# core imports
+import json
+
+# project imports
+from shipments.utils import RedisUtils
+from boloo.global_constants import SYNC_CHECKPOINT_TTL
+
+
+class SyncCheckpoint:
+
+    """
+    Progress of a sync run kept in redis, so that a sync interrupted by a dying worker can be continued.
+
+    For every shop of the run it records:
+        - its state: listing -> details -> done
+        - the list pages already fetched per fulfilment method (with their shipment ids) and the last page
+        - the shipment ids whose details are not stored yet and the cursors to save at the end
+
+    A restarted fetch_shipments task (celery redelivers the tasks of a dead worker) continues paging after the pages
+    already fetched, a restarted fetch_shipment_details task only fetches the pending ids.
+    """
+
+    LISTING = "listing"
+    DETAILS = "details"
+    DONE = "done"
+
+    key_prefix = "sync"
+
+    latest_key = "sync:latest"
+
+    def __init__(self, sync_id):
+
+        self.sync_id = sync_id
+
+    def get_key(self, *parts):
+
+        return ':'.join([self.key_prefix, self.sync_id] + [str(part) for part in parts])
+
+    @staticmethod
+    def get_latest():
+
+        """
+        :return: checkpoint of the last sync run started, None if there is none
+        """
+
+        sync_id = RedisUtils.get_connection().get(SyncCheckpoint.latest_key)
+
+        return SyncCheckpoint(sync_id.decode()) if sync_id else None
+
+    def start(self, shop_ids, incremental, refresh_stored):
+
+        """
+        registers a new sync run of the given shops
+        :param shop_ids:
+        :param incremental:
+        :param refresh_stored:
+        :return:
+        """
+
+        pipe = RedisUtils.get_connection().pipeline()
+
+        pipe.hset(self.get_key('meta'), mapping={"incremental": int(incremental), "refresh_stored": int(refresh_stored)})
+        pipe.expire(self.get_key('meta'), SYNC_CHECKPOINT_TTL)
+
+        if shop_ids:
+            pipe.hset(self.get_key('shops'), mapping={shop_id: self.LISTING for shop_id in shop_ids})
+            pipe.expire(self.get_key('shops'), SYNC_CHECKPOINT_TTL)
+
+        pipe.set(self.latest_key, self.sync_id, ex=SYNC_CHECKPOINT_TTL)
+
+        pipe.execute()
+
+    def get_meta(self):
+
+        """
+        :return: dict with the incremental and refresh_stored options the run was started with
+        """
+
+        meta = RedisUtils.get_connection().hgetall(self.get_key('meta'))
+
+        return {k.decode(): bool(int(v)) for k, v in meta.items()}
+
+    def get_shop_states(self):
+
+        """
+        :return: dict representing shop_id: state
+        """
+
+        states = RedisUtils.get_connection().hgetall(self.get_key('shops'))
+
+        return {int(k): v.decode() for k, v in states.items()}
+
+    def set_shop_state(self, shop_id, state):
+
+        RedisUtils.get_connection().hset(self.get_key('shops'), shop_id, state)
+
+    def save_listed_page(self, shop_id, fulfilment_method, page, shipment_ids, newest_shipment):
+
+        """
+        records a page of the shipments list which has been fetched
+        :param shop_id:
+        :param fulfilment_method:
+        :param page:
+        :param shipment_ids: ids of the page which have to be synced
+        :param newest_shipment: (shipment_date, shipment_id) of the newest shipment of the page
+        :return:
+        """
+
+        key = self.get_key('pages', shop_id, fulfilment_method)
+
+        newest_shipment = [newest_shipment[0].isoformat() if newest_shipment[0] else None, newest_shipment[1]]
+
+        pipe = RedisUtils.get_connection().pipeline()
+        pipe.hset(key, page, json.dumps({"ids": shipment_ids, "newest": newest_shipment}))
+        pipe.expire(key, SYNC_CHECKPOINT_TTL)
+        pipe.execute()
+
+    def save_last_page(self, shop_id, fulfilment_method, page):
+
+        """
+        records the first page which is not needed anymore (empty or older than the cursor)
+        """
+
+        key = self.get_key('pages', shop_id, fulfilment_method)
+
+        pipe = RedisUtils.get_connection().pipeline()
+        pipe.hset(key, 'last', page)
+        pipe.expire(key, SYNC_CHECKPOINT_TTL)
+        pipe.execute()
+
+    def get_listed_pages(self, shop_id, fulfilment_method):
+
+        """
+        :param shop_id:
+        :param fulfilment_method:
+        :return: (dict representing page: (shipment_ids, newest_shipment [shipment_date <iso str>, shipment_id]),
+                  last page or None)
+        """
+
+        pages = RedisUtils.get_connection().hgetall(self.get_key('pages', shop_id, fulfilment_method))
+
+        last_page = pages.pop(b'last', None)
+
+        page_map = {}
+
+        for page, value in pages.items():
+            value = json.loads(value)
+            page_map[int(page)] = value["ids"], value["newest"]
+
+        return page_map, int(last_page) if last_page else None
+
+    def save_pending(self, shop_id, shipment_ids, cursors_list):
+
+        """
+        Listing of the shop is done, records the shipment ids whose details have to be stored and
+        the cursors to save once they are.
+        :param shop_id:
+        :param shipment_ids:
+        :param cursors_list: cursors of the shop, see tasks.dump_cursors
+        :return:
+        """
+
+        pending_key = self.get_key('pending', shop_id)
+
+        pipe = RedisUtils.get_connection().pipeline()
+
+        pipe.delete(pending_key)
+
+        if shipment_ids:
+            pipe.sadd(pending_key, *shipment_ids)
+            pipe.expire(pending_key, SYNC_CHECKPOINT_TTL)
+
+        pipe.set(self.get_key('cursors', shop_id), json.dumps(cursors_list), ex=SYNC_CHECKPOINT_TTL)
+        pipe.hset(self.get_key('shops'), shop_id, self.DETAILS)
+
+        pipe.execute()
+
+    def get_pending(self, shop_id):
+
+        """
+        :param shop_id:
+        :return: (set of shipment ids not stored yet, cursors_list)
+        """
+
+        connection = RedisUtils.get_connection()
+
+        pending = {int(shipment_id) for shipment_id in connection.smembers(self.get_key('pending', shop_id))}
+
+        cursors_list = connection.get(self.get_key('cursors', shop_id))
+
+        return pending, json.loads(cursors_list) if cursors_list else []
+
+    def remove_pending(self, shop_id, shipment_ids):
+
+        """
+        to be called once the details of the shipments have been stored
+        """
+
+        if shipment_ids:
+            RedisUtils.get_connection().srem(self.get_key('pending', shop_id), *shipment_ids)
@@ -0,0 +1,90 @@
+# core imports
+from datetime import datetime, timedelta, timezone
+
+# length of the bol.com date format, e.g 2020-06-03T16:41:23+02:00
+BOL_DATETIME_LENGTH = 25
+
+
+def parse_datetime_slow(value):
+
+    """
+    Generic parser, used for the strings which are not in the fixed bol.com format (e.g ending with Z or +0200)
+    :param value:
+    :return: datetime
+    """
+
+    return datetime.strptime(value[:19] + value[19:].replace(':', ''), '%Y-%m-%dT%H:%M:%S%z')
+
+
+class BolDateParser:
+
+    """
+    Parser for the ISO-8601 dates of the bol.com api (2020-06-03T16:41:23+02:00).
+
+    Strings in that fixed format are parsed with datetime.fromisoformat where available (python 3.7+), else by
+    slicing with the timezones cached per offset, so that all the dates of a batch share a few tzinfo objects.
+    Anything else goes through strptime.
+    """
+
+    fromisoformat = getattr(datetime, 'fromisoformat', None)
+
+    def __init__(self):
+
+        # offset string (+02:00): timezone
+        self.timezones = {}
+
+    def get_timezone(self, offset):
+
+        tz = self.timezones.get(offset)
+
+        if tz is None:
+            sign = -1 if offset[0] == '-' else 1
+            tz = self.timezones[offset] = timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6])))
+
+        return tz
+
+    def is_bol_format(self, value):
+
+        return (len(value) == BOL_DATETIME_LENGTH and value[10] == 'T' and value[19] in '+-' and value[22] == ':')
+
+    def parse(self, value):
+
+        """
+        :param value: date string, can be None or empty
+        :return: aware datetime, None if value is empty
+        """
+
+        if not value:
+            return None
+
+        if not self.is_bol_format(value):
+            return parse_datetime_slow(value)
+
+        if self.fromisoformat:
+            return self.fromisoformat(value)
+
+        return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]), int(value[14:16]),
+                        int(value[17:19]), tzinfo=self.get_timezone(value[19:]))
+
+    def parse_many(self, values):
+
+        """
+        :param values: list of date strings
+        :return: list of datetimes, in the same order
+        """
+
+        parse = self.parse
+
+        return [parse(value) for value in values]
+
+
+bol_date_parser = BolDateParser()
+
+
+def parse_bol_datetime(value):
+
+    """
+    parses a single bol.com date string, see BolDateParser
+    """
+
+    return bol_date_parser.parse(value)
@@ -0,0 +1,85 @@
+# core imports
+import json
+from djangorestframework_camel_case.util import camel_to_underscore
+
+try:
+    # optional, a lot faster than the json module when installed
+    import orjson
+except ImportError:
+    orjson = None
+
+# converted key names are cached, up to this many (keys are field names of the api, not data)
+KEY_CACHE_MAX_SIZE = 4096
+
+key_cache = {}
+
+
+def camel_to_snake(key):
+
+    """
+    camelCase to snake_case, same as djangorestframework_camel_case's underscoreize, cached per key
+    :param key:
+    :return: converted key <str>
+    """
+
+    snake_key = key_cache.get(key)
+
+    if snake_key is None:
+        snake_key = camel_to_underscore(key)
+
+        if len(key_cache) < KEY_CACHE_MAX_SIZE:
+            key_cache[key] = snake_key
+
+    return snake_key
+
+
+class ResponseDecoder:
+
+    """
+    Decodes the json responses of bol.com into dicts with snake_case keys, the same data as underscoreize(r.json())
+    but built only once: the keys are converted while the json is parsed (json module) or in a single walk over
+    the parsed data (orjson, which has no hooks).
+
+    :param skip_fields: camelCase names of the fields to leave out (at any depth), for the fields the sync does not use
+    """
+
+    def __init__(self, skip_fields=()):
+
+        self.skip_fields = frozenset(skip_fields)
+
+    def convert_pairs(self, pairs):
+
+        skip_fields = self.skip_fields
+
+        return {camel_to_snake(k): v for k, v in pairs if k not in skip_fields}
+
+    def convert(self, data):
+
+        if isinstance(data, dict):
+            skip_fields = self.skip_fields
+            convert = self.convert
+
+            return {camel_to_snake(k): convert(v) for k, v in data.items() if k not in skip_fields}
+
+        if isinstance(data, list):
+            convert = self.convert
+
+            return [convert(item) for item in data]
+
+        return data
+
+    def decode(self, content):
+
+        """
+        :param content: response body <bytes>
+        :return: response_data
+        """
+
+        if orjson is not None:
+            return self.convert(orjson.loads(content))
+
+        return json.loads(content, object_pairs_hook=self.convert_pairs)
+
+
+# decoder for the responses which are used as they are
+default_decoder = ResponseDecoder()
@@ -0,0 +1,48 @@
+# project imports
+from shipments.models import Shipment
+from shipments.utils import CommonUtils
+from boloo.global_constants import SYNC_DEDUP_CHUNK_SIZE
+
+
+def get_stored_shipment_ids(shipment_ids, chunk_size=SYNC_DEDUP_CHUNK_SIZE):
+
+    """
+    Looks up which of the given shipment ids are already stored, using primary key IN queries of chunk_size ids.
+    :param shipment_ids:
+    :param chunk_size:
+    :return: set of shipment_ids
+    """
+
+    stored_shipment_ids = set()
+
+    for shipment_ids_chunk in CommonUtils.chunks(list(shipment_ids), chunk_size):
+        stored_shipment_ids.update(
+            Shipment.objects.filter(shipment_id__in=shipment_ids_chunk).values_list('shipment_id', flat=True)
+        )
+
+    return stored_shipment_ids
+
+
+def remove_stored_shipment_ids(shop_to_shipments_ids_map):
+
+    """
+    Removes the shipments which are already stored from the map, so that their details are not fetched again.
+    A shipment and its items are stored in the same transaction, a stored shipment always has its items.
+
+    :param shop_to_shipments_ids_map: dict representing shop_id: shipments_ids <list>
+    :return: dict representing shop_id: shipments_ids <list>, shops without any new shipment are left out
+    """
+
+    stored_shipment_ids = get_stored_shipment_ids(
+        shipment_id for shipment_ids in shop_to_shipments_ids_map.values() for shipment_id in shipment_ids
+    )
+
+    new_shop_to_shipments_ids_map = {}
+
+    for shop_id, shipment_ids in shop_to_shipments_ids_map.items():
+        new_shipment_ids = [shipment_id for shipment_id in shipment_ids if shipment_id not in stored_shipment_ids]
+
+        if new_shipment_ids:
+            new_shop_to_shipments_ids_map[shop_id] = new_shipment_ids
+
+    return new_shop_to_shipments_ids_map
@@ -0,0 +1,597 @@
+# core imports
+import asyncio
+import functools
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from django.utils.dateparse import parse_datetime
+
+# project imports
+from shipments.utils import APICall, CommonUtils
+from shipments.sync_data.decoder import ResponseDecoder, default_decoder
+from shipments.sync_data.metrics import sync_metrics
+from shipments.sync_data.records import ShipmentRecord
+from shipments.sync_data.rate_limiter import rate_limiter as default_rate_limiter, \
+    concurrency_limiter as default_concurrency_limiter, LIST_ENDPOINT, DETAIL_ENDPOINT
+from shipments.sync_data.token_cache import access_token_cache
+from boloo.global_constants import BASE_URL, SHIPMENT_DETAILS_END_POINT, SHIPMENTS_LIST_END_POINT, \
+    SYNC_GLOBAL_CONCURRENCY, SYNC_PER_SHOP_CONCURRENCY, SYNC_STORE_BATCH_SIZE, SYNC_PIPELINE_MAX_PENDING_BATCHES, \
+    SHIPMENTS_LIST_SKIP_FIELDS, SYNC_SHOP_SLOT_RETRY_INTERVAL, SYNC_STRATEGY
+
+FULFILMENT_METHODS = ("FBR", "FBB")
+
+# endpoint class: decoder of its responses
+DECODERS = {
+    LIST_ENDPOINT: ResponseDecoder(skip_fields=SHIPMENTS_LIST_SKIP_FIELDS),
+    DETAIL_ENDPOINT: default_decoder,
+}
+
+
+class RoundRobinStrategy:
+
+    """
+    Hands out pending jobs one shop at a time, cycling over the shops (the original behaviour of the sync tasks).
+
+    A shop which cannot take more work right now (per-shop limit reached or waiting on a retry-after) is skipped
+    and the next shop in the cycle is tried.
+    """
+
+    def __init__(self):
+        # shop_id: deque of pending jobs, ordered by the position of the shop in the cycle
+        self.shop_to_jobs_map = OrderedDict()
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self.shop_to_jobs_map.values())
+
+    def add(self, shop_id, job):
+        self.shop_to_jobs_map.setdefault(shop_id, deque()).append(job)
+
+    def pop(self, can_run):
+
+        """
+        Returns the next (shop_id, job) whose shop is accepted by `can_run`, None if there is none.
+        :param can_run: callable taking a shop_id
+        :return: (shop_id, job) or None
+        """
+
+        for shop_id in list(self.shop_to_jobs_map.keys()):
+
+            if not can_run(shop_id):
+                continue
+
+            jobs = self.shop_to_jobs_map.pop(shop_id)
+            job = jobs.popleft()
+
+            # move the shop to the end of the cycle
+            if jobs:
+                self.shop_to_jobs_map[shop_id] = jobs
+
+            return shop_id, job
+
+        return None
+
+
+class ShopByShopStrategy(RoundRobinStrategy):
+
+    """
+    Drains the jobs of a shop before moving on to the next one.
+    Useful when a few shops have to be made available as early as possible.
+    """
+
+    def pop(self, can_run):
+
+        for shop_id, jobs in list(self.shop_to_jobs_map.items()):
+
+            if not can_run(shop_id):
+                continue
+
+            job = jobs.popleft()
+
+            if not jobs:
+                del self.shop_to_jobs_map[shop_id]
+
+            return shop_id, job
+
+        return None
+
+
+# values of SYNC_STRATEGY
+STRATEGIES = {
+    'round_robin': RoundRobinStrategy,
+    'shop_by_shop': ShopByShopStrategy,
+}
+
+
+class SyncEngine:
+
+    """
+    asyncio based engine for fetching shipments from bol.com.
+
+    Keeps several requests in flight at once, across shops and across pages / shipment ids of a shop.
+    The blocking API calls of `APICall` are run on a thread pool, the event loop only does the scheduling.
+    The order of the requests of the shops is given by `strategy_class`, defaults to the one of SYNC_STRATEGY.
+
+    `global_concurrency` caps the number of requests in flight for the whole engine,
+    `per_shop_concurrency` caps them per shop (it is also the number of list pages fetched ahead of time).
+    As the shipments of a shop may be fetched by several tasks at once, every request also holds a slot of the shared
+    `concurrency_limiter` (pass None to disable it), which caps the requests of a shop across all the tasks.
+
+    Before every request a token is taken from the shared `rate_limiter` (pass None to disable it),
+    a shop without tokens left is paused instead of running into a 429.
+    """
+
+    # bol.com retailer api, can be changed for running against a simulator
+    base_url = BASE_URL
+
+    def __init__(self, shops_objs_dict, strategy_class=None,
+                 global_concurrency=SYNC_GLOBAL_CONCURRENCY, per_shop_concurrency=SYNC_PER_SHOP_CONCURRENCY,
+                 rate_limiter=default_rate_limiter, concurrency_limiter=default_concurrency_limiter):
+
+        # dict representing shop_id <pk>: Shop obj
+        self.shops_objs_dict = shops_objs_dict
+
+        self.strategy_class = strategy_class or STRATEGIES[SYNC_STRATEGY]
+        self.global_concurrency = global_concurrency
+        self.per_shop_concurrency = per_shop_concurrency
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+
+        # shop_id: loop time before which no request should be sent for that shop (retry-after)
+        self.shop_id_to_resume_at_map = {}
+
+        # (shop_id, fulfilment_method): (shipment_date, shipment_id), filled by fetch_shipment_ids
+        self.newest_shipments_map = {}
+
+        self.loop = None
+        self.executor = None
+
+    def run(self, coroutine):
+
+        """
+        Runs the given coroutine on a fresh event loop and thread pool
+        :param coroutine:
+        :return: result of the coroutine
+        """
+
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.global_concurrency)
+
+        try:
+            return self.loop.run_until_complete(coroutine)
+
+        finally:
+            self.executor.shutdown(wait=True)
+            self.loop.close()
+            self.loop = None
+            self.executor = None
+
+            sync_metrics.flush()
+
+    def fetch_shipment_ids(self, cursors=None, checkpoint=None):
+
+        """
+        Pages through the shipments list of every shop for every fulfilment method.
+
+        With `cursors` (incremental sync), paging of a shop / fulfilment method stops at the first shipment which is
+        not newer than its cursor and only the newer shipment ids are returned.
+        The newest shipment seen for every shop / fulfilment method is left in `newest_shipments_map`.
+
+        With a `checkpoint` (SyncCheckpoint), every fetched page is recorded in it and the pages it already holds
+        are not fetched again.
+
+        :param cursors: dict representing (shop_id, fulfilment_method): (last_shipment_date, last_shipment_id)
+        :param checkpoint: SyncCheckpoint
+        :return: dict representing shop_id: shipments_ids <list>
+        """
+
+        return self.run(self._fetch_shipment_ids(cursors or {}, checkpoint))
+
+    def fetch_shipment_details(self, shop_to_shipments_ids_map, on_batch=None, batch_size=SYNC_STORE_BATCH_SIZE):
+
+        """
+        Fetches the details of every shipment id.
+
+        If `on_batch` is given, the details are streamed to it instead of being returned:
+        it is called with (shop_id, shipment_details <list of records.ShipmentRecord>) as soon as batch_size details
+        of a shop are fetched
+        (and once more with the remainder of every shop). It runs on the thread pool, while it is slow
+        at most SYNC_PIPELINE_MAX_PENDING_BATCHES batches are kept waiting and fetching is paused.
+
+        :param shop_to_shipments_ids_map: dict representing shop_id: shipments_ids <list>
+        :param on_batch: callable(shop_id, shipment_details)
+        :param batch_size:
+        :return: dict representing shop_id: shipment_details <list of records.ShipmentRecord>,
+                 empty if on_batch is given
+        """
+
+        return self.run(self._fetch_shipment_details(shop_to_shipments_ids_map, on_batch, batch_size))
+
+    @staticmethod
+    def get_shipment_position(shipment):
+
+        """
+        (shipment_date, shipment_id) of a shipment of the shipments list, used for comparing it with a cursor
+        """
+
+        return CommonUtils.get_datetime_from_request(shipment.get('shipment_date')), shipment['shipment_id']
+
+    @staticmethod
+    def is_newer(position, cursor):
+
+        """
+        checks if the shipment at position comes after the cursor, shipment ids are compared if a date is missing
+        :param position: (shipment_date, shipment_id)
+        :param cursor: (shipment_date, shipment_id)
+        :return: bool
+        """
+
+        if position[0] and cursor[0] and position[0] != cursor[0]:
+            return position[0] > cursor[0]
+
+        return position[1] > cursor[1]
+
+    async def _fetch_shipment_ids(self, cursors, checkpoint):
+
+        strategy = self.strategy_class()
+
+        # (shop_id, fulfilment_method): {page: shipment_ids}
+        pages_map = defaultdict(dict)
+
+        # (shop_id, fulfilment_method): first page which is not needed anymore (came back empty or after the cursor)
+        last_page_map = {}
+
+        # (shop_id, fulfilment_method): (shipment_date, shipment_id) of the newest shipment seen
+        self.newest_shipments_map = {}
+
+        def get_pages_ahead(key):
+            # pages are fetched ahead, up to per_shop_concurrency pages per shop
+            # incremental syncs usually stop at the first page, so nothing is fetched ahead
+            return 1 if key in cursors else self.per_shop_concurrency
+
+        def update_newest_shipment(key, position):
+            if key not in self.newest_shipments_map or self.is_newer(position, self.newest_shipments_map[key]):
+                self.newest_shipments_map[key] = position
+
+        for shop_id in self.shops_objs_dict:
+            for fulfilment_method in FULFILMENT_METHODS:
+
+                key = (shop_id, fulfilment_method)
+
+                if checkpoint:
+                    # pages fetched before the sync was interrupted
+                    listed_pages, last_page = checkpoint.get_listed_pages(shop_id, fulfilment_method)
+
+                    for page, (shipment_ids, newest_shipment) in listed_pages.items():
+                        pages_map[key][page] = shipment_ids
+
+                        if newest_shipment[1] is not None:
+                            update_newest_shipment(key, (parse_datetime(newest_shipment[0]) if newest_shipment[0]
+                                                         else None, newest_shipment[1]))
+
+                    if last_page:
+                        last_page_map[key] = last_page
+
+                max_listed_page = max(pages_map[key], default=0)
+
+                # pages missing in between, then the pages ahead of the last fetched one
+                pages = [page for page in range(1, max_listed_page) if page not in pages_map[key]]
+                pages.extend(range(max_listed_page + 1, max_listed_page + get_pages_ahead(key) + 1))
+
+                for page in pages:
+                    if page < last_page_map.get(key, page + 1):
+                        strategy.add(shop_id, (fulfilment_method, page))
+
+        async def process_job(shop_id, job):
+
+            fulfilment_method, page = job
+            key = (shop_id, fulfilment_method)
+
+            # all the shipments are already obtained, page is beyond the last one (or fetched already)
+            if page >= last_page_map.get(key, page + 1) or page in pages_map[key]:
+                return
+
+            url = "{}{}?page={}&fulfilment-method={}".format(self.base_url, SHIPMENTS_LIST_END_POINT, str(page),
+                                                              fulfilment_method)
+
+            response_data = await self.get(shop_id, url, strategy, job, LIST_ENDPOINT)
+
+            if response_data is None:
+                # retry has been scheduled
+                return
+
+            # If no response is returned i.e all the shipments are obtained
+            if not response_data or not response_data.get('shipments'):
+                last_page_map[key] = min(page, last_page_map.get(key, page))
+
+                if checkpoint:
+                    await self.loop.run_in_executor(self.executor, checkpoint.save_last_page, shop_id,
+                                                    fulfilment_method, last_page_map[key])
+                return
+
+            shipments = response_data['shipments']
+
+            page_newest_shipment = None
+
+            for shipment in shipments:
+                position = self.get_shipment_position(shipment)
+
+                if page_newest_shipment is None or self.is_newer(position, page_newest_shipment):
+                    page_newest_shipment = position
+
+            update_newest_shipment(key, page_newest_shipment)
+
+            if key in cursors:
+                new_shipments = [shipment for shipment in shipments
+                                 if self.is_newer(self.get_shipment_position(shipment), cursors[key])]
+
+                # reached the known shipments, the next pages are older
+                if len(new_shipments) < len(shipments):
+                    last_page_map[key] = min(page + 1, last_page_map.get(key, page + 1))
+
+                shipments = new_shipments
+
+            pages_map[key][page] = [shipment['shipment_id'] for shipment in shipments]
+
+            if checkpoint:
+                await self.loop.run_in_executor(self.executor, checkpoint.save_listed_page, shop_id, fulfilment_method,
+                                                page, pages_map[key][page], page_newest_shipment)
+
+                if key in last_page_map:
+                    await self.loop.run_in_executor(self.executor, checkpoint.save_last_page, shop_id,
+                                                    fulfilment_method, last_page_map[key])
+
+            next_page = page + get_pages_ahead(key)
+
+            if next_page < last_page_map.get(key, next_page + 1):
+                strategy.add(shop_id, (fulfilment_method, next_page))
+
+        await self.dispatch(strategy, process_job)
+
+        # dict representing shop_id: shipments_ids <list>
+        shop_to_shipments_ids_map = defaultdict(list)
+
+        for (shop_id, fulfilment_method), page_to_ids_map in sorted(pages_map.items(), key=lambda i: (
+                i[0][0], FULFILMENT_METHODS.index(i[0][1]))):
+            for page in sorted(page_to_ids_map):
+                if page < last_page_map.get((shop_id, fulfilment_method), page + 1):
+                    shop_to_shipments_ids_map[shop_id].extend(page_to_ids_map[page])
+
+        return shop_to_shipments_ids_map
+
+    async def _fetch_shipment_details(self, shop_to_shipments_ids_map, on_batch, batch_size):
+
+        strategy = self.strategy_class()
+
+        for shop_id, shipment_ids in shop_to_shipments_ids_map.items():
+            for shipment_id in shipment_ids:
+                strategy.add(int(shop_id), shipment_id)
+
+        # dict representing shop_id: shipment_details <list>
+        shop_to_shipment_details_map = defaultdict(list)
+
+        # batches waiting for on_batch, fetchers block on put() when it is full
+        batches_queue = asyncio.Queue(maxsize=SYNC_PIPELINE_MAX_PENDING_BATCHES)
+
+        async def consume_batches():
+
+            while True:
+                batch = await batches_queue.get()
+
+                if batch is None:
+                    return
+
+                await self.loop.run_in_executor(self.executor, on_batch, *batch)
+
+        consumer = asyncio.ensure_future(consume_batches()) if on_batch else None
+
+        async def put_batch(batch):
+
+            put = asyncio.ensure_future(batches_queue.put(batch))
+
+            # stop waiting if on_batch failed, nothing would take batches out of the queue anymore
+            await asyncio.wait([put, consumer], return_when=asyncio.FIRST_COMPLETED)
+
+            if not put.done():
+                put.cancel()
+                consumer.result()
+
+        async def process_job(shop_id, shipment_id):
+
+            url = "{}{}{}".format(self.base_url, SHIPMENT_DETAILS_END_POINT, str(shipment_id))
+
+            response_data = await self.get(shop_id, url, strategy, shipment_id, DETAIL_ENDPOINT)
+
+            if response_data is None:
+                return
+
+            # kept as a record, a lot smaller than the dicts of the response
+            shop_to_shipment_details_map[shop_id].append(ShipmentRecord.from_dict(response_data))
+
+            if on_batch and len(shop_to_shipment_details_map[shop_id]) >= batch_size:
+                await put_batch((shop_id, shop_to_shipment_details_map.pop(shop_id)))
+
+        if not on_batch:
+            await self.dispatch(strategy, process_job)
+
+            return shop_to_shipment_details_map
+
+        try:
+            await self.dispatch(strategy, process_job)
+
+            # flushing what is left of every shop
+            for shop_id in list(shop_to_shipment_details_map):
+                await put_batch((shop_id, shop_to_shipment_details_map.pop(shop_id)))
+
+            await put_batch(None)
+
+            await consumer
+
+        finally:
+            consumer.cancel()
+
+        return shop_to_shipment_details_map
+
+    async def get_access_token(self, shop_id):
+
+        """
+        Returns the access_token of the shop from the shared token cache
+        :param shop_id:
+        :return: access_token <str>
+        """
+
+        shop_obj = self.shops_objs_dict[shop_id]
+
+        # in-process hit, no need to go through the thread pool
+        access_token = access_token_cache.get_cached(shop_obj.client_id)
+
+        if access_token:
+            return access_token
+
+        return await self.loop.run_in_executor(
+            self.executor, access_token_cache.get_access_token, shop_obj.client_id, shop_obj.client_secret
+        )
+
+    def pause(self, shop_id, strategy, job, wait_time):
+
+        """
+        Puts the job back into the strategy, no request is sent for the shop during the next wait_time seconds
+        """
+
+        self.shop_id_to_resume_at_map[shop_id] = max(self.shop_id_to_resume_at_map.get(shop_id, 0),
+                                                     self.loop.time() + wait_time)
+        strategy.add(shop_id, job)
+
+    async def get(self, shop_id, url, strategy, job, endpoint_class):
+
+        """
+        Makes the api call on the thread pool, holding a request slot of the shop (shared by all the tasks).
+        If all the slots of the shop are held or the shop is rate limited, the job is put back into the strategy
+        and the shop is paused until it may send again.
+        :return: response_data, None if the job has been re-queued
+        """
+
+        if not self.concurrency_limiter:
+            return await self.send(shop_id, url, strategy, job, endpoint_class)
+
+        client_id = self.shops_objs_dict[shop_id].client_id
+
+        slot_id = await self.loop.run_in_executor(self.executor, self.concurrency_limiter.acquire, client_id)
+
+        if slot_id is None:
+            sync_metrics.inc('sync_shop_slot_waits_total', shop=shop_id, endpoint=endpoint_class)
+
+            self.pause(shop_id, strategy, job, SYNC_SHOP_SLOT_RETRY_INTERVAL)
+
+            return None
+
+        try:
+            return await self.send(shop_id, url, strategy, job, endpoint_class)
+
+        finally:
+            await self.loop.run_in_executor(self.executor, self.concurrency_limiter.release, client_id, slot_id)
+
+    async def send(self, shop_id, url, strategy, job, endpoint_class):
+
+        """
+        see get
+        """
+
+        shop_obj = self.shops_objs_dict[shop_id]
+
+        if self.rate_limiter:
+
+            wait_time = await self.loop.run_in_executor(self.executor, self.rate_limiter.acquire,
+                                                        shop_obj.client_id, endpoint_class)
+
+            if wait_time:
+                sync_metrics.inc('sync_rate_limiter_waits_total', shop=shop_id, endpoint=endpoint_class)
+
+                self.pause(shop_id, strategy, job, wait_time)
+
+                return None
+
+        access_token = await self.get_access_token(shop_id)
+
+        # the request sent again with a new token after a 401 takes a token of the rate limiter too
+        rate_limit = functools.partial(self.rate_limiter.wait, shop_obj.client_id, endpoint_class) \
+            if self.rate_limiter else None
+
+        _, response_data, wait_time = await self.loop.run_in_executor(
+            self.executor, APICall.get_request, access_token, url, shop_obj.client_id, shop_obj.client_secret,
+            False, DECODERS[endpoint_class], {'shop': shop_id, 'endpoint': endpoint_class}, rate_limit
+        )
+
+        # Handling retry-logic
+        if response_data is None and wait_time:
+
+            sync_metrics.inc('sync_retry_after_sleeps_total', shop=shop_id, endpoint=endpoint_class)
+            sync_metrics.inc('sync_retry_after_seconds_total', wait_time, shop=shop_id, endpoint=endpoint_class)
+
+            # let the other workers know that the quota is used up
+            if self.rate_limiter:
+                await self.loop.run_in_executor(self.executor, self.rate_limiter.drain,
+                                                shop_obj.client_id, endpoint_class, wait_time)
+
+            self.pause(shop_id, strategy, job, wait_time)
+
+            return None
+
+        return response_data
+
+    async def dispatch(self, strategy, process_job):
+
+        """
+        Runs `process_job(shop_id, job)` for every job of the strategy (including the jobs added while running),
+        respecting global and per shop concurrency limits and the retry-after pauses of the shops.
+        :param strategy:
+        :param process_job: coroutine function
+        :return:
+        """
+
+        running = {}
+        shop_id_to_running_count_map = defaultdict(int)
+
+        def can_run(shop_id):
+            return (shop_id_to_running_count_map[shop_id] < self.per_shop_concurrency and
+                    self.shop_id_to_resume_at_map.get(shop_id, 0) <= self.loop.time())
+
+        try:
+
+            while len(strategy) or running:
+
+                while len(running) < self.global_concurrency:
+
+                    entry = strategy.pop(can_run)
+
+                    if entry is None:
+                        break
+
+                    shop_id, job = entry
+                    shop_id_to_running_count_map[shop_id] += 1
+                    running[asyncio.ensure_future(process_job(shop_id, job))] = shop_id
+
+                # wake up at the latest when the earliest paused shop can be resumed
+                timeout = None
+                paused_until = [t for t in self.shop_id_to_resume_at_map.values() if t > self.loop.time()]
+                if paused_until:
+                    timeout = min(paused_until) - self.loop.time()
+
+                if not running:
+                    await asyncio.sleep(timeout or 0)
+                    continue
+
+                done, _ = await asyncio.wait(list(running), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    shop_id_to_running_count_map[running.pop(task)] -= 1
+
+                    # re-raise errors of the api calls
+                    task.result()
+
+        finally:
+            # on errors, the requests which are still running are abandoned
+            for task in running:
+                task.cancel()
+
+            # letting them release their request slots
+            if running:
+                await asyncio.wait(list(running))
@@ -0,0 +1,288 @@
+# core imports
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from django.conf import settings
+
+# project imports
+from boloo.global_constants import SYNC_METRICS_LATENCY_BUCKETS, SYNC_METRICS_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class LogMetricsExporter:
+
+    """
+    Writes the metrics recorded since the last flush to the log, a json line per series
+    """
+
+    def export(self, counters, histograms, buckets):
+
+        for (name, labels), value in counters.items():
+            logger.info(json.dumps({"metric": name, "labels": dict(labels), "value": value}))
+
+        for (name, labels), histogram in histograms.items():
+            logger.info(json.dumps({
+                "metric": name, "labels": dict(labels), "count": sum(histogram[:-1]), "sum": round(histogram[-1], 6),
+                "buckets": dict(zip([str(bucket) for bucket in buckets] + ["+Inf"], histogram[:-1])),
+            }))
+
+
+class RedisMetricsExporter:
+
+    """
+    Adds up the metrics of all the processes (celery workers) in a redis hash,
+    rendered in the Prometheus text format by the metrics endpoint (/main/shipments-sync/metrics/).
+
+    Fields of the hash are json [name, labels, kind, le] with kind counter / bucket / sum / count, buckets are
+    stored non cumulative and added up when rendering.
+    """
+
+    key = "sync_metrics"
+
+    @staticmethod
+    def get_connection():
+
+        # imported here as shipments.utils records metrics itself
+        from shipments.utils import RedisUtils
+
+        return RedisUtils.get_connection()
+
+    def export(self, counters, histograms, buckets):
+
+        pipeline = self.get_connection().pipeline(transaction=False)
+
+        for (name, labels), value in counters.items():
+            pipeline.hincrbyfloat(self.key, json.dumps([name, labels, "counter", None]), value)
+
+        for (name, labels), histogram in histograms.items():
+
+            for le, count in zip([str(bucket) for bucket in buckets] + ["+Inf"], histogram[:-1]):
+                if count:
+                    pipeline.hincrbyfloat(self.key, json.dumps([name, labels, "bucket", le]), count)
+
+            pipeline.hincrbyfloat(self.key, json.dumps([name, labels, "sum", None]), histogram[-1])
+            pipeline.hincrbyfloat(self.key, json.dumps([name, labels, "count", None]), sum(histogram[:-1]))
+
+        pipeline.execute()
+
+    @staticmethod
+    def format_labels(labels, le=None):
+
+        labels = [list(label) for label in labels]
+
+        if le is not None:
+            labels.append(["le", le])
+
+        if not labels:
+            return ""
+
+        return "{{{}}}".format(",".join('{}="{}"'.format(
+            key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels))
+
+    @staticmethod
+    def format_value(value):
+
+        return str(int(value)) if value == int(value) else repr(value)
+
+    def render(self, buckets):
+
+        """
+        :param buckets: upper bounds of the buckets of the histograms, buckets without values are rendered too
+        :return: all the metrics in the Prometheus text exposition format <str>
+        """
+
+        # name: {labels: value} for counters
+        counters = defaultdict(dict)
+
+        # name: {labels: {"buckets": {le: count}, "sum": value, "count": value}} for histograms
+        histograms = defaultdict(lambda: defaultdict(lambda: {"buckets": {}, "sum": 0, "count": 0}))
+
+        for field, value in self.get_connection().hgetall(self.key).items():
+
+            name, labels, kind, le = json.loads(field)
+            labels = tuple(tuple(label) for label in labels)
+            value = float(value)
+
+            if kind == "counter":
+                counters[name][labels] = value
+
+            elif kind == "bucket":
+                histograms[name][labels]["buckets"][le] = value
+
+            else:
+                histograms[name][labels][kind] = value
+
+        lines = []
+
+        for name in sorted(counters):
+
+            lines.append("# TYPE {} counter".format(name))
+
+            for labels, value in sorted(counters[name].items()):
+                lines.append("{}{} {}".format(name, self.format_labels(labels), self.format_value(value)))
+
+        for name in sorted(histograms):
+
+            lines.append("# TYPE {} histogram".format(name))
+
+            for labels, histogram in sorted(histograms[name].items()):
+
+                cumulative_count = 0
+
+                les = set(histogram["buckets"]).union(str(bucket) for bucket in buckets).difference(["+Inf"])
+
+                for le in sorted(les, key=float):
+                    cumulative_count += histogram["buckets"].get(le, 0)
+                    lines.append("{}_bucket{} {}".format(name, self.format_labels(labels, le),
+                                                         self.format_value(cumulative_count)))
+
+                lines.append("{}_bucket{} {}".format(name, self.format_labels(labels, "+Inf"),
+                                                     self.format_value(histogram["count"])))
+                lines.append("{}_sum{} {}".format(name, self.format_labels(labels), repr(histogram["sum"])))
+                lines.append("{}_count{} {}".format(name, self.format_labels(labels),
+                                                    self.format_value(histogram["count"])))
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+
+        self.get_connection().delete(self.key)
+
+
+class SyncMetrics:
+
+    """
+    Counters and latency histograms of the phases of the sync, labelled (shop, endpoint, status...).
+
+    Recording only updates dicts of the process (under a lock), the values are handed to the exporter
+    (settings.SYNC_METRICS_EXPORTER: 'prometheus' for RedisMetricsExporter, 'log' for LogMetricsExporter, None to drop
+    them) by flush, called at the end of the sync tasks and every `flush_interval` seconds while recording.
+    """
+
+    def __init__(self, buckets=SYNC_METRICS_LATENCY_BUCKETS, flush_interval=SYNC_METRICS_FLUSH_INTERVAL):
+
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+
+        # (name, labels): value
+        self.counters = defaultdict(float)
+
+        # (name, labels): [count of every bucket..., count above the last bucket, sum]
+        self.histograms = {}
+
+        self.lock = threading.Lock()
+        self.last_flush_at = time.monotonic()
+        self.exporter = None
+
+    def get_exporter(self):
+
+        if self.exporter is None:
+
+            exporter = getattr(settings, 'SYNC_METRICS_EXPORTER', None)
+
+            if exporter == 'prometheus':
+                self.exporter = RedisMetricsExporter()
+
+            elif exporter == 'log':
+                self.exporter = LogMetricsExporter()
+
+        return self.exporter
+
+    @staticmethod
+    def get_series(name, labels):
+
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+
+        """
+        Adds value to a counter
+        :param name: e.g sync_http_requests_total
+        :param value:
+        :param labels:
+        :return:
+        """
+
+        series = self.get_series(name, labels)
+
+        with self.lock:
+            self.counters[series] += value
+
+        self.flush_if_due()
+
+    def observe(self, name, value, **labels):
+
+        """
+        Records a value (seconds) in a histogram
+        :param name: e.g sync_http_request_seconds
+        :param value:
+        :param labels:
+        :return:
+        """
+
+        series = self.get_series(name, labels)
+
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            histogram = self.histograms.get(series)
+
+            if histogram is None:
+                histogram = self.histograms[series] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            histogram[index] += 1
+            histogram[-1] += value
+
+        self.flush_if_due()
+
+    @contextmanager
+    def timer(self, name, **labels):
+
+        """
+        Records the time taken by the block in a histogram.
+        Yields the labels, the block can set the labels known only at its end (e.g status).
+        """
+
+        start = time.perf_counter()
+
+        try:
+            yield labels
+
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def flush_if_due(self):
+
+        if time.monotonic() - self.last_flush_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+
+        """
+        Hands the metrics recorded since the last flush to the exporter.
+        Errors of the exporter are logged, metrics must not break the sync.
+        """
+
+        with self.lock:
+            counters, self.counters = self.counters, defaultdict(float)
+            histograms, self.histograms = self.histograms, {}
+            self.last_flush_at = time.monotonic()
+
+        exporter = self.get_exporter()
+
+        if exporter is None or not (counters or histograms):
+            return
+
+        try:
+            exporter.export(counters, histograms, self.buckets)
+
+        except Exception:
+            logger.exception("exporting sync metrics failed")
+
+
+sync_metrics = SyncMetrics()
@@ -0,0 +1,34 @@
+# core imports
+from django.db import connection
+
+
+class BatchStore:
+
+    """
+    on_batch of the sync engine: stores every batch of shipment details (records.ShipmentRecord) as soon as it is
+    fetched, in the fetching task itself.
+
+    The engine calls it on its thread pool and keeps fetching in the meantime (at most
+    SYNC_PIPELINE_MAX_PENDING_BATCHES batches wait for it, then fetching is paused), so storing overlaps with
+    fetching without queueing store tasks. The fetching task never waits on tasks which need a free worker process
+    (all of them may be busy fetching) and it only succeeds once all of its shipments are stored.
+    """
+
+    def __init__(self, store, sync_id=None):
+
+        """
+        :param store: callable(shop_id, shipment_details, sync_id)
+        :param sync_id: id of the SyncCheckpoint of the run
+        """
+
+        self.store = store
+        self.sync_id = sync_id
+
+    def __call__(self, shop_id, shipment_details):
+
+        try:
+            self.store(shop_id, shipment_details, sync_id=self.sync_id)
+
+        finally:
+            # the threads of the engine are dropped after the run, their connections would be left open
+            connection.close()
@@ -0,0 +1,200 @@
+# core imports
+import time
+import uuid
+
+# project imports
+from shipments.utils import RedisUtils
+from boloo.global_constants import SYNC_RATE_LIMITS, SYNC_PER_SHOP_CONCURRENCY, SYNC_SHOP_SLOT_LEASE
+
+# endpoint classes of bol.com, each one has its own quota
+LIST_ENDPOINT = "list"
+DETAIL_ENDPOINT = "detail"
+
+
+class TokenBucketRateLimiter:
+
+    """
+    Token bucket rate limiter kept in redis, so that every celery worker syncing a shop shares the same quota.
+
+    There is one bucket per shop client_id and endpoint class (list / detail).
+    A bucket holds at most `burst` tokens and is refilled with `rate` tokens per second,
+    every request to bol.com takes one token.
+    """
+
+    key_prefix = "rate_limit"
+
+    # KEYS[1]: bucket, ARGV: rate, burst, now
+    # Takes a token if one is available and returns 0, otherwise returns the seconds to wait for the next token
+    acquire_script = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated_at = tonumber(bucket[2]) or now
+
+        tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+
+        local wait_time = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait_time = (1 - tokens) / rate
+        end
+
+        redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate + wait_time) + 1)
+
+        return tostring(wait_time)
+    """
+
+    # KEYS[1]: bucket, ARGV: rate, burst, now, retry_after
+    # Empties the bucket so that no token is available for the next retry_after seconds
+    drain_script = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local retry_after = tonumber(ARGV[4])
+
+        redis.call('HMSET', KEYS[1], 'tokens', 1 - retry_after * rate, 'updated_at', ARGV[3])
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate + retry_after) + 1)
+
+        return 1
+    """
+
+    def __init__(self, rate_limits=None):
+
+        # endpoint class: (requests per second, burst)
+        self.rate_limits = rate_limits or SYNC_RATE_LIMITS
+
+        self.acquire_lua = None
+        self.drain_lua = None
+
+    def get_key(self, client_id, endpoint_class):
+
+        return '{}:{}:{}'.format(self.key_prefix, client_id, endpoint_class)
+
+    def register_scripts(self):
+
+        if self.acquire_lua is None:
+            connection = RedisUtils.get_connection()
+
+            self.acquire_lua = connection.register_script(self.acquire_script)
+            self.drain_lua = connection.register_script(self.drain_script)
+
+    def acquire(self, client_id, endpoint_class):
+
+        """
+        Tries to take a token for a request of the shop to the endpoint class.
+        :param client_id:
+        :param endpoint_class: LIST_ENDPOINT or DETAIL_ENDPOINT
+        :return: 0 if the request can be sent now, else seconds to wait before trying again <float>
+        """
+
+        self.register_scripts()
+
+        rate, burst = self.rate_limits[endpoint_class]
+
+        return float(self.acquire_lua(keys=[self.get_key(client_id, endpoint_class)], args=[rate, burst, time.time()]))
+
+    def wait(self, client_id, endpoint_class):
+
+        """
+        Blocks until a token is taken for the shop and endpoint class
+        :param client_id:
+        :param endpoint_class:
+        :return:
+        """
+
+        wait_time = self.acquire(client_id, endpoint_class)
+
+        while wait_time:
+            time.sleep(wait_time)
+            wait_time = self.acquire(client_id, endpoint_class)
+
+    def drain(self, client_id, endpoint_class, retry_after):
+
+        """
+        To be called when bol.com still answered with 429, so that all the workers back off for retry_after seconds
+        :param client_id:
+        :param endpoint_class:
+        :param retry_after: seconds
+        :return:
+        """
+
+        self.register_scripts()
+
+        rate, burst = self.rate_limits[endpoint_class]
+
+        self.drain_lua(keys=[self.get_key(client_id, endpoint_class)], args=[rate, burst, time.time(), retry_after])
+
+
+class ShopConcurrencyLimiter:
+
+    """
+    Caps the no.of requests of a shop in flight across all the sync tasks / workers (a shop may be spread over
+    several fetch_shipment_details tasks), kept in redis.
+
+    Every request holds a slot of its shop: a member of a sorted set scored with the time its lease runs out,
+    slots of workers which died without releasing them are dropped once their lease is over.
+    """
+
+    key_prefix = "shop_slots"
+
+    # KEYS[1]: slots of the shop, ARGV: limit, now, lease expires at, slot id
+    # Takes a slot if less than limit are held and returns 1, otherwise returns 0
+    acquire_script = """
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+
+        if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+            return 0
+        end
+
+        redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+        redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3]) - tonumber(ARGV[2])) + 1)
+
+        return 1
+    """
+
+    def __init__(self, limit=SYNC_PER_SHOP_CONCURRENCY, lease=SYNC_SHOP_SLOT_LEASE):
+
+        """
+        :param limit: max no.of requests of a shop in flight
+        :param lease: seconds after which a slot which has not been released is dropped
+        """
+
+        self.limit = limit
+        self.lease = lease
+
+        self.acquire_lua = None
+
+    def get_key(self, client_id):
+
+        return '{}:{}'.format(self.key_prefix, client_id)
+
+    def acquire(self, client_id):
+
+        """
+        :param client_id:
+        :return: id of the slot taken, None if all the slots of the shop are held
+        """
+
+        if self.acquire_lua is None:
+            self.acquire_lua = RedisUtils.get_connection().register_script(self.acquire_script)
+
+        slot_id = uuid.uuid4().hex
+        now = time.time()
+
+        if int(self.acquire_lua(keys=[self.get_key(client_id)], args=[self.limit, now, now + self.lease, slot_id])):
+            return slot_id
+
+        return None
+
+    def release(self, client_id, slot_id):
+
+        RedisUtils.get_connection().zrem(self.get_key(client_id), slot_id)
+
+
+rate_limiter = TokenBucketRateLimiter()
+
+concurrency_limiter = ShopConcurrencyLimiter()
@@ -0,0 +1,221 @@
+# core imports
+import sys
+
+# project imports
+from shipments.models import Transporter, Address, Shipment, ShipmentItem
+
+
+class Record:
+
+    """
+    Compact in-memory form of the shipment data between fetching and storing, instead of the dicts of the api.
+
+    The values are kept in __slots__ (no per object dict). Queued store tasks carry them as plain lists in the order
+    of `fields` (no keys), see to_wire / from_wire.
+
+    fields: names of the values, same as the model fields (attname) unless it is a nested record
+    nested_fields: field: record class, for nested records
+    nested_list_fields: field: record class, for lists of nested records
+    date_fields: fields holding a bol.com date string until parse_dates is called
+    interned_fields: fields with few distinct values (codes, cities...), their strings are shared by all the records
+    """
+
+    __slots__ = ()
+
+    model = None
+
+    fields = ()
+    nested_fields = {}
+    nested_list_fields = {}
+    date_fields = ()
+    interned_fields = ()
+
+    def __init__(self, **values):
+
+        for field in self.fields:
+            setattr(self, field, values.get(field))
+
+    def __repr__(self):
+
+        return '{}({})'.format(self.__class__.__name__,
+                               ', '.join('{}={!r}'.format(field, getattr(self, field)) for field in self.fields))
+
+    def __eq__(self, other):
+
+        return type(self) is type(other) and self.to_wire() == other.to_wire()
+
+    @classmethod
+    def from_dict(cls, data):
+
+        """
+        :param data: response data of the api (snake_case keys), the keys which are not fields are left out
+        :return: record
+        """
+
+        record = cls.__new__(cls)
+
+        for field in cls.fields:
+            value = data.get(field)
+
+            if value is not None:
+                if field in cls.nested_fields:
+                    value = cls.nested_fields[field].from_dict(value)
+
+                elif field in cls.nested_list_fields:
+                    value = [cls.nested_list_fields[field].from_dict(item) for item in value]
+
+                elif field in cls.interned_fields and isinstance(value, str):
+                    value = sys.intern(value)
+
+            setattr(record, field, value)
+
+        return record
+
+    def to_wire(self):
+
+        """
+        :return: list of the values in the order of fields, nested records as their wire values
+        """
+
+        values = []
+
+        for field in self.fields:
+            value = getattr(self, field)
+
+            if value is not None:
+                if field in self.nested_fields:
+                    value = value.to_wire()
+
+                elif field in self.nested_list_fields:
+                    value = [item.to_wire() for item in value]
+
+            values.append(value)
+
+        return values
+
+    @classmethod
+    def from_wire(cls, values):
+
+        """
+        :param values: see to_wire
+        :return: record
+        """
+
+        record = cls.__new__(cls)
+
+        for field, value in zip(cls.fields, values):
+
+            if value is not None:
+                if field in cls.nested_fields:
+                    value = cls.nested_fields[field].from_wire(value)
+
+                elif field in cls.nested_list_fields:
+                    value = [cls.nested_list_fields[field].from_wire(item) for item in value]
+
+            setattr(record, field, value)
+
+        return record
+
+    @classmethod
+    def load(cls, value):
+
+        """
+        :param value: record, wire values or a dict of the api (store tasks queued before the records were used)
+        :return: record
+        """
+
+        if isinstance(value, cls):
+            return value
+
+        return cls.from_dict(value) if isinstance(value, dict) else cls.from_wire(value)
+
+    def parse_dates(self, date_parser):
+
+        """
+        replaces the date strings of the record by datetimes
+        :param date_parser: date_parser.BolDateParser
+        :return:
+        """
+
+        for field in self.date_fields:
+            setattr(self, field, date_parser.parse(getattr(self, field)))
+
+    def to_model(self, **extra):
+
+        """
+        :param extra: values of the model fields which are not part of the record (foreign keys...)
+        :return: unsaved model instance, the fields which are None get their default
+        """
+
+        values = {}
+
+        for field in self.fields:
+            value = getattr(self, field)
+
+            if value is not None and field not in self.nested_fields and field not in self.nested_list_fields:
+                values[field] = value
+
+        values.update(extra)
+
+        return self.model(**values)
+
+
+class TransporterRecord(Record):
+
+    model = Transporter
+
+    fields = ('transport_id', 'transporter_code', 'track_and_trace', 'shipping_label_id', 'shipping_label_code')
+
+    interned_fields = ('transporter_code', 'shipping_label_code')
+
+    __slots__ = fields
+
+
+class AddressRecord(Record):
+
+    model = Address
+
+    fields = ('pick_up_point_name', 'salutation_code', 'first_name', 'surname', 'street_name', 'house_number',
+              'house_number_extended', 'address_supplement', 'extra_address_information', 'zip_code', 'city',
+              'country_code', 'email', 'company', 'vat_number', 'chamber_of_commerce_number', 'order_reference',
+              'delivery_phone_number')
+
+    interned_fields = ('salutation_code', 'city', 'country_code')
+
+    __slots__ = fields
+
+
+class ShipmentItemRecord(Record):
+
+    model = ShipmentItem
+
+    fields = ('order_item_id', 'order_id', 'order_date', 'latest_delivery_date', 'ean', 'title', 'quantity',
+              'offer_price', 'offer_condition', 'offer_reference', 'fulfilment_method')
+
+    date_fields = ('order_date', 'latest_delivery_date')
+
+    interned_fields = ('ean', 'offer_condition', 'fulfilment_method')
+
+    __slots__ = fields
+
+
+class ShipmentRecord(Record):
+
+    model = Shipment
+
+    fields = ('shipment_id', 'pick_up_point', 'shipment_date', 'shipment_reference', 'transport', 'customer_details',
+              'billing_details', 'shipment_items')
+
+    nested_fields = {
+        'transport': TransporterRecord,
+        'customer_details': AddressRecord,
+        'billing_details': AddressRecord,
+    }
+
+    nested_list_fields = {
+        'shipment_items': ShipmentItemRecord,
+    }
+
+    date_fields = ('shipment_date',)
+
+    __slots__ = fields
@@ -0,0 +1,68 @@
+# core imports
+import math
+from django.db.models import Count
+
+# project imports
+from shipments.models import Shop
+from boloo.global_constants import SYNC_SHOPS_PER_TASK
+
+
+class SyncScheduler:
+
+    """
+    Splits a sync into celery tasks of a few shops each (list tasks, then detail tasks), so that the engine of a task
+    has requests of several shops in flight while the workers which are done pick up the remaining tasks.
+    Workers take one task at a time (see CELERY_WORKER_PREFETCH_MULTIPLIER), tasks are not assigned upfront.
+    """
+
+    @staticmethod
+    def get_shop_ids_to_sync():
+
+        """
+        ids of all the active shops, the shops with the most shipments first so that they don't finish last
+        :return: list of shop_ids
+        """
+
+        return list(
+            Shop.objects.filter(is_active=True).annotate(
+                no_of_shipments=Count('shipment')
+            ).order_by('-no_of_shipments', 'id').values_list('id', flat=True)
+        )
+
+    @staticmethod
+    def split_shop_ids(shop_ids, shops_per_task=SYNC_SHOPS_PER_TASK):
+
+        """
+        Packs the shops into groups of at most shops_per_task shops, one sync task each: the engine of a task runs the
+        requests of its shops concurrently. The shops are dealt out in turn, so the first (biggest) shops end up in
+        different tasks.
+
+        :param shop_ids: list of shop_ids, biggest first
+        :param shops_per_task:
+        :return: list of lists of shop_ids
+        """
+
+        no_of_tasks = math.ceil(len(shop_ids) / shops_per_task)
+
+        return [shop_ids[i::no_of_tasks] for i in range(no_of_tasks)]
+
+    @staticmethod
+    def split_shipment_ids(shop_to_shipments_ids_map, shops_per_task=SYNC_SHOPS_PER_TASK):
+
+        """
+        Splits the shipment ids of the shops into fetch_shipment_details tasks: all the ids of a shop go to one task
+        (one engine already uses all the request slots of a shop, see rate_limiter.ShopConcurrencyLimiter) and a task
+        gets up to shops_per_task shops.
+
+        :param shop_to_shipments_ids_map: dict representing shop_id: shipments_ids <list>
+        :param shops_per_task:
+        :return: list of dicts representing shop_id: shipments_ids <list>
+        """
+
+        shop_ids = sorted((shop_id for shop_id, shipment_ids in shop_to_shipments_ids_map.items() if shipment_ids),
+                          key=lambda shop_id: len(shop_to_shipments_ids_map[shop_id]), reverse=True)
+
+        return [
+            {shop_id: shop_to_shipments_ids_map[shop_id] for shop_id in task_shop_ids}
+            for task_shop_ids in SyncScheduler.split_shop_ids(shop_ids, shops_per_task)
+        ]
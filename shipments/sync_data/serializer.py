@@ -0,0 +1,129 @@
+# core imports
+import json
+import logging
+import threading
+import zlib
+import msgpack
+import zstandard
+from celery.signals import task_postrun
+from kombu.serialization import register
+
+# project imports
+from shipments.sync_data.blob_store import get_blob_store
+from boloo.global_constants import SYNC_PAYLOAD_COMPRESS_MIN_SIZE, SYNC_PAYLOAD_OFFLOAD_MIN_SIZE
+
+logger = logging.getLogger(__name__)
+
+SERIALIZER_NAME = "syncpack"
+CONTENT_TYPE = "application/x-boloo-syncpack"
+
+# header of a payload: location + encoding + compression
+# (json and zlib are only decoded, for the payloads of producers which did not have msgpack / zstandard)
+INLINE, OFFLOADED = b"i", b"o"
+MSGPACK, JSON = b"m", b"j"
+UNCOMPRESSED, ZLIB, ZSTD = b"-", b"z", b"s"
+
+# ids of the blobs loaded for the task being run by the thread, deleted once it has succeeded
+loaded_blobs = threading.local()
+
+
+def encode(obj):
+
+    return MSGPACK, msgpack.packb(obj, use_bin_type=True)
+
+
+def decode(encoding, data):
+
+    if encoding == MSGPACK:
+        # the shop ids are int keys
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    return json.loads(data.decode())
+
+
+def compress(data):
+
+    if len(data) < SYNC_PAYLOAD_COMPRESS_MIN_SIZE:
+        return UNCOMPRESSED, data
+
+    return ZSTD, zstandard.ZstdCompressor().compress(data)
+
+
+def decompress(compression, data):
+
+    if compression == ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    if compression == ZLIB:
+        return zlib.decompress(data)
+
+    return data
+
+
+def dumps(obj):
+
+    """
+    Serializes the arguments of a sync task: msgpack, compressed (zstd) if at least SYNC_PAYLOAD_COMPRESS_MIN_SIZE
+    bytes and moved to the blob store if still at least SYNC_PAYLOAD_OFFLOAD_MIN_SIZE bytes, the message then only
+    carries the id of the blob.
+    :param obj:
+    :return: bytes
+    """
+
+    encoding, data = encode(obj)
+    compression, data = compress(data)
+
+    if len(data) >= SYNC_PAYLOAD_OFFLOAD_MIN_SIZE:
+        return OFFLOADED + encoding + compression + get_blob_store().put(data).encode()
+
+    return INLINE + encoding + compression + data
+
+
+def loads(payload):
+
+    """
+    Offloaded payloads are read from the blob store, the blob is deleted by delete_loaded_blobs once the task has
+    succeeded (a failed / redelivered task still finds it).
+    :param payload: see dumps
+    :return: obj
+    """
+
+    payload = bytes(payload)
+
+    location, encoding, compression, data = payload[:1], payload[1:2], payload[2:3], payload[3:]
+
+    if location == OFFLOADED:
+        blob_id = data.decode()
+        data = get_blob_store().get(blob_id)
+
+        if not hasattr(loaded_blobs, 'ids'):
+            loaded_blobs.ids = []
+
+        loaded_blobs.ids.append(blob_id)
+
+    return decode(encoding, decompress(compression, data))
+
+
+@task_postrun.connect
+def delete_loaded_blobs(sender=None, state=None, **kwargs):
+
+    """
+    Deletes the blobs of the arguments of the task once it has succeeded (celery loads the arguments in the process
+    and thread running the task), blobs of failed tasks are left to expire.
+    """
+
+    blob_ids, loaded_blobs.ids = getattr(loaded_blobs, 'ids', []), []
+
+    if state != 'SUCCESS':
+        return
+
+    for blob_id in blob_ids:
+
+        try:
+            get_blob_store().delete(blob_id)
+
+        except Exception:
+            logger.exception("deleting the blob {} failed".format(blob_id))
+
+
+register(SERIALIZER_NAME, dumps, loads, content_type=CONTENT_TYPE, content_encoding='binary')
@@ -0,0 +1,333 @@
+# core imports
+import json
+import math
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class BolSimulator:
+
+    """
+    Local stand-in for the bol.com token, shipments list and shipment details apis, for benchmarking the sync.
+
+    Any client_id / client_secret gets a token. Every client has `no_of_shipments` shipments, generated from its
+    client_id, so the same client always sees the same data.
+
+    :param no_of_shipments: no.of shipments of every client
+    :param page_size: no.of shipments per page of the shipments list
+    :param latency: seconds every request takes
+    :param token_expires_in: lifetime of the tokens in seconds, requests with an expired token get a 401
+    :param rate_limits: dict representing endpoint class (list / detail): (requests per second, burst) per client,
+                        requests over it get a 429 with a retry-after header. None for no limits.
+    """
+
+    base_path = "/retailer/"
+    token_path = "/token"
+
+    shipments_start_date = datetime(2020, 1, 1, tzinfo=timezone(timedelta(hours=2)))
+
+    def __init__(self, no_of_shipments=100, page_size=50, latency=0.05, token_expires_in=299, rate_limits=None,
+                 host="127.0.0.1", port=0):
+
+        self.no_of_shipments = no_of_shipments
+        self.page_size = page_size
+        self.latency = latency
+        self.token_expires_in = token_expires_in
+        self.rate_limits = rate_limits
+
+        # access_token: (client_id, expires_at)
+        self.tokens = {}
+
+        # (client_id, endpoint class): [tokens, updated_at]
+        self.buckets = {}
+
+        # (endpoint, status_code): no.of requests
+        self.stats = Counter()
+
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer((host, port), self.get_handler_class())
+        self.thread = None
+
+    @staticmethod
+    def get_rate_limits(list_rate=None, detail_rate=None):
+
+        """
+        :param list_rate: list requests per second per client, None for no limit
+        :param detail_rate: detail requests per second per client, None for no limit
+        :return: rate_limits (bursts of a second of requests), None if there is no limit
+        """
+
+        if not list_rate and not detail_rate:
+            return None
+
+        return {
+            "list": (list_rate or 1000, max(1, int(list_rate or 1000))),
+            "detail": (detail_rate or 1000, max(1, int(detail_rate or 1000))),
+        }
+
+    @property
+    def url(self):
+
+        return "http://{}:{}".format(*self.server.server_address[:2])
+
+    @property
+    def base_url(self):
+
+        return self.url + self.base_path
+
+    @property
+    def access_token_url(self):
+
+        return self.url + self.token_path
+
+    def start(self):
+
+        """
+        serves the requests from a background thread
+        :return: self
+        """
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def serve_forever(self):
+
+        self.server.serve_forever()
+
+    def stop(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_client_base_id(self, client_id):
+
+        # shipment ids of the clients do not overlap as long as they have less than 10^6 shipments
+        return (zlib.crc32(client_id.encode()) % 1000 + 1) * 10 ** 6
+
+    def get_shipment_summary(self, client_id, index):
+
+        shipment_id = self.get_client_base_id(client_id) + index
+
+        return {
+            "shipmentId": shipment_id,
+            "shipmentDate": (self.shipments_start_date + timedelta(minutes=index)).isoformat(),
+            "shipmentReference": "BENCH-{}".format(shipment_id),
+            "shipmentItems": [
+                {"orderItemId": str(shipment_id * 10 + i), "orderId": str(shipment_id)} for i in range(2)
+            ],
+            "transport": {"transportId": self.get_client_base_id(client_id) + index % 10},
+        }
+
+    def get_fulfilment_method(self, index):
+
+        # every 4th shipment is fulfilled by bol.com
+        return "FBB" if index % 4 == 3 else "FBR"
+
+    def get_address(self, client_id, index, address_type):
+
+        return {
+            "salutationCode": "02",
+            "firstName": "Jane",
+            "surname": "Doe {}".format(index % 100),
+            "streetName": "Papendorpseweg",
+            "houseNumber": str(index % 200),
+            "zipCode": "3528BJ",
+            "city": "UTRECHT",
+            "countryCode": "NL",
+            # customers come back for a few shipments
+            "email": "{}-{}-{}@benchmark.invalid".format(address_type, client_id[:8], index // 3),
+            "deliveryPhoneNumber": "0612345678",
+        }
+
+    def get_shipment_details(self, client_id, index):
+
+        shipment = self.get_shipment_summary(client_id, index)
+
+        for item in shipment["shipmentItems"]:
+            item.update({
+                "orderDate": shipment["shipmentDate"],
+                "latestDeliveryDate": (self.shipments_start_date + timedelta(minutes=index, days=2)).isoformat(),
+                "ean": "8720299036802",
+                "title": "Benchmark product {}".format(item["orderItemId"]),
+                "quantity": 1,
+                "offerPrice": 19.99,
+                "offerCondition": "NEW",
+                "offerReference": "",
+                "fulfilmentMethod": self.get_fulfilment_method(index),
+            })
+
+        shipment["transport"].update({
+            "transporterCode": "TNT",
+            "trackAndTrace": "3SKABA{}".format(shipment["transport"]["transportId"]),
+            "shippingLabelId": shipment["transport"]["transportId"],
+            "shippingLabelCode": "PLR00000{}".format(index % 10),
+        })
+
+        shipment["pickUpPoint"] = False
+        shipment["customerDetails"] = self.get_address(client_id, index, "customer")
+        shipment["billingDetails"] = self.get_address(client_id, index, "billing")
+
+        return shipment
+
+    def create_token(self, client_id):
+
+        access_token = uuid.uuid4().hex
+
+        with self.lock:
+            self.tokens[access_token] = client_id, time.time() + self.token_expires_in
+
+        return {"access_token": access_token, "token_type": "Bearer", "expires_in": self.token_expires_in,
+                "scope": "RETAILER"}
+
+    def get_client_id(self, authorization):
+
+        """
+        :param authorization: Authorization header
+        :return: client_id of the token, None if the token is unknown or expired
+        """
+
+        access_token = (authorization or "")[len("Bearer "):]
+
+        token = self.tokens.get(access_token)
+
+        if token is None or token[1] < time.time():
+            return None
+
+        return token[0]
+
+    def get_retry_after(self, client_id, endpoint_class):
+
+        """
+        takes a token of the bucket of the client
+        :return: 0 if the request is allowed, else seconds to wait <int>
+        """
+
+        if not self.rate_limits:
+            return 0
+
+        rate, burst = self.rate_limits[endpoint_class]
+
+        now = time.time()
+
+        with self.lock:
+            bucket = self.buckets.setdefault((client_id, endpoint_class), [burst, now])
+
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+
+            return max(1, math.ceil((1 - bucket[0]) / rate))
+
+    def handle(self, method, path, headers, body):
+
+        """
+        :return: (status_code, headers <dict>, response data <dict>)
+        """
+
+        time.sleep(self.latency)
+
+        url = urlparse(path)
+
+        if method == "POST" and url.path == self.token_path:
+            client_id = parse_qs(body.decode()).get("client_id", [""])[0]
+
+            return "token", 200, {}, self.create_token(client_id)
+
+        if method != "GET" or not url.path.startswith(self.base_path + "shipments"):
+            return "unknown", 404, {}, {}
+
+        shipment_path = url.path[len(self.base_path + "shipments"):].strip("/")
+
+        endpoint_class = "detail" if shipment_path else "list"
+
+        client_id = self.get_client_id(headers.get("Authorization"))
+
+        if client_id is None:
+            return endpoint_class, 401, {}, {}
+
+        retry_after = self.get_retry_after(client_id, endpoint_class)
+
+        if retry_after:
+            return endpoint_class, 429, {"Retry-After": str(retry_after)}, {}
+
+        if shipment_path:
+            index = int(shipment_path) - self.get_client_base_id(client_id)
+
+            if not 0 <= index < self.no_of_shipments:
+                return endpoint_class, 404, {}, {}
+
+            return endpoint_class, 200, {}, self.get_shipment_details(client_id, index)
+
+        params = parse_qs(url.query)
+        page = int(params.get("page", ["1"])[0])
+        fulfilment_method = params.get("fulfilment-method", ["FBR"])[0]
+
+        # newest first, like bol.com
+        indexes = [i for i in range(self.no_of_shipments - 1, -1, -1)
+                   if self.get_fulfilment_method(i) == fulfilment_method]
+        indexes = indexes[(page - 1) * self.page_size:page * self.page_size]
+
+        if not indexes:
+            # bol.com returns an empty object after the last page
+            return endpoint_class, 200, {}, {}
+
+        return endpoint_class, 200, {}, {"shipments": [self.get_shipment_summary(client_id, i) for i in indexes]}
+
+    def get_handler_class(self):
+
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            # keep-alive, so that connection reuse can be measured
+            protocol_version = "HTTP/1.1"
+
+            def respond(self, method):
+
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+                endpoint, status_code, headers, response_data = simulator.handle(method, self.path, self.headers, body)
+
+                with simulator.lock:
+                    simulator.stats[(endpoint, status_code)] += 1
+
+                content = json.dumps(response_data).encode()
+
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+
+                for k, v in headers.items():
+                    self.send_header(k, v)
+
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.respond("GET")
+
+            def do_POST(self):
+                self.respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
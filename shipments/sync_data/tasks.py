@@ -1,289 +1,340 @@
 # core imports
-from celery import shared_task
+import logging
+from celery import shared_task, chain
 from django.db import transaction
-from itertools import cycle
-from collections import defaultdict
+from django.utils.dateparse import parse_datetime
 
 # project imports
-from shipments.utils import APICall
-from boloo.global_constants import BASE_URL, SHIPMENT_DETAILS_END_POINT, SHIPMENTS_LIST_END_POINT
-from shipments.models import Transporter, Shipment, ShipmentItem, Address, Shop
-from shipments.utils import CommonUtils
+from shipments.sync_data.address_resolver import address_resolver
+from shipments.sync_data.checkpoint import SyncCheckpoint
+from shipments.sync_data.date_parser import BolDateParser
+from shipments.sync_data.dedup import remove_stored_shipment_ids
+from shipments.sync_data.engine import SyncEngine
+from shipments.sync_data.metrics import sync_metrics
+from shipments.sync_data.pipeline import BatchStore
+from shipments.sync_data.records import ShipmentRecord
+from shipments.sync_data.scheduler import SyncScheduler
+from shipments.sync_data.serializer import SERIALIZER_NAME
+from shipments.sync_data.upsert import BulkUpsert
+from shipments.response_cache import shipments_response_cache
+from shipments.models import Transporter, Shipment, ShipmentItem, Address, Shop, ShopSyncCursor
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def store_data_in_db(shop_id, shipment_details_list):
 
-    # Since many shipments can be linked to same transport/customer_details/billing_details
-    transporters_map = {}
+@shared_task(serializer=SERIALIZER_NAME)
+def store_data_in_db(shop_id, shipment_details_list, sync_id=None):
 
-    customer_details_map = {}
+    """
+    Stores a batch of shipment details of a shop.
+    Called by fetch_shipment_details itself (pipeline.BatchStore), it is still a task for the store tasks queued
+    before that.
 
-    billing_details_map = {}
+    :param shop_id:
+    :param shipment_details_list: list of records.ShipmentRecord (or their wire values, or dicts of the details api)
+    :param sync_id: id of the SyncCheckpoint of the run
+    :return:
+    """
 
-    # saving shipments for further processing
-    shipments_map = {}
+    with sync_metrics.timer('sync_store_seconds', phase='parse'):
 
-    # dict representing shipment_id: email for updating shipment_details with Address pks
-    shipments_to_customer_details_map = {}
-    shipments_to_billing_details_map = {}
+        shipments = [ShipmentRecord.load(shipment_details) for shipment_details in shipment_details_list]
 
-    shipment_items_to_save = []
+        # Since many shipments can be linked to same transport/customer_details/billing_details
+        # dict representing transport_id: Transporter obj
+        transporters_map = {}
 
-    for shipment_details in shipment_details_list:
+        # dicts representing email: Address obj
+        customer_details_map = {}
+        billing_details_map = {}
 
-        transporter_details = shipment_details.pop("transport")
+        # one parser per batch, the dates of a batch share a handful of timezones
+        date_parser = BolDateParser()
 
-        transporters_map[transporter_details["transport_id"]] = transporter_details
+        for shipment in shipments:
 
-        shipment_details["transporter_id"] = transporter_details["transport_id"]
+            shipment.parse_dates(date_parser)
 
-        # check if the customer_details is present a create a db record
-        if 'customer_details' in shipment_details:
-            customer_address = shipment_details.pop('customer_details')
+            for shipment_item in shipment.shipment_items or []:
+                shipment_item.parse_dates(date_parser)
 
-            customer_address['type'] = 'Customer'
+            transporters_map[shipment.transport.transport_id] = shipment.transport.to_model()
 
             # email (unique identifier) is not present in few records
-            if customer_address.get('email'):
-                customer_details_map[customer_address['email']] = customer_address
-                shipments_to_customer_details_map[shipment_details['shipment_id']] = customer_address['email']
+            if shipment.customer_details and shipment.customer_details.email:
+                customer_details_map[shipment.customer_details.email] = \
+                    shipment.customer_details.to_model(type='Customer')
 
-        # check if the billing_details is present a create a db record
-        if 'billing_details' in shipment_details:
-            billing_address = shipment_details.pop('billing_details')
+            if shipment.billing_details and shipment.billing_details.email:
+                billing_details_map[shipment.billing_details.email] = shipment.billing_details.to_model(type='Billing')
 
-            billing_address['type'] = 'Billing'
+    try:
 
-            # email (unique identifier) is not present in few records
-            if billing_details_map.get('email'):
-                billing_details_map[billing_address['email']] = billing_address
-                shipments_to_billing_details_map[shipment_details['shipment_id']] = billing_address['email']
+        with transaction.atomic():
 
-        shipment_details['shipment_date'] = CommonUtils.get_datetime_from_request(shipment_details.get('shipment_date'))
-        shipment_details['shop_id'] = shop_id
+            # upsert unique transporters wrt transporter_id
+            with sync_metrics.timer('sync_store_seconds', phase='transporters'):
+                BulkUpsert(Transporter, ['transport_id']).upsert_objs(transporters_map.values())
+
+            # upsert unique customer_details wrt email
+            with sync_metrics.timer('sync_store_seconds', phase='customer_details'):
+                BulkUpsert(Address, ['email', 'type']).upsert_objs(customer_details_map.values())
+
+            # upsert unique billing_details wrt email
+            with sync_metrics.timer('sync_store_seconds', phase='billing_details'):
+                BulkUpsert(Address, ['email', 'type']).upsert_objs(billing_details_map.values())
+
+            # creating a dict of email: id of Address, only for the emails of the batch
+            with sync_metrics.timer('sync_store_seconds', phase='address_lookup'):
+                customer_details_created_objects_map = address_resolver.resolve('Customer',
+                                                                                customer_details_map.keys())
+                billing_details_created_objects_map = address_resolver.resolve('Billing', billing_details_map.keys())
+
+            # upsert Shipments, linked to their transporter and addresses
+            with sync_metrics.timer('sync_store_seconds', phase='shipments'):
+                BulkUpsert(Shipment, ['shipment_id']).upsert_objs(
+                    shipment.to_model(
+                        shop_id=shop_id,
+                        transporter_id=shipment.transport.transport_id,
+                        customer_details_id=customer_details_created_objects_map.get(
+                            shipment.customer_details.email) if shipment.customer_details else None,
+                        billing_details_id=billing_details_created_objects_map.get(
+                            shipment.billing_details.email) if shipment.billing_details else None,
+                    )
+                    for shipment in shipments
+                )
+
+            # upsert ShipmentItems wrt shipment and order_item_id
+            with sync_metrics.timer('sync_store_seconds', phase='shipment_items'):
+                BulkUpsert(ShipmentItem, ['shipment_id', 'order_item_id']).upsert_objs(
+                    shipment_item.to_model(shipment_id=shipment.shipment_id)
+                    for shipment in shipments for shipment_item in shipment.shipment_items or []
+                )
 
-        shipment_items = shipment_details.pop('shipment_items')
+    except Exception as e:
+        logger.exception("storing %s shipments of shop %s failed", len(shipments), shop_id)
 
-        for shipment_item in shipment_items:
-            shipment_item['shipment_id'] = shipment_details['shipment_id']
-            shipment_item['order_date'] = CommonUtils.get_datetime_from_request(shipment_item.get('order_date'))
-            shipment_item['latest_delivery_date'] = CommonUtils.get_datetime_from_request(shipment_item.get('latest_delivery_date'))
+        sync_metrics.inc('sync_store_batches_total', shop=shop_id, status='error')
+        sync_metrics.flush()
 
-            # append to shipment_items_to_save for bulk_create
-            shipment_items_to_save.append(ShipmentItem(**shipment_item))
+        raise e
 
-        shipments_map[shipment_details['shipment_id']] = shipment_details
+    sync_metrics.inc('sync_store_batches_total', shop=shop_id, status='success')
+    sync_metrics.inc('sync_stored_shipments_total', len(shipments), shop=shop_id)
+    sync_metrics.flush()
 
-    try:
+    # cached api responses of the shop are stale now
+    shipments_response_cache.bump_version(shop_id)
 
-        with transaction.atomic():
+    if sync_id:
+        SyncCheckpoint(sync_id).remove_pending(shop_id, [shipment.shipment_id for shipment in shipments])
 
-            # fetch unique transporters wrt transporter_id
-            unique_transports = [Transporter(**v) for v in transporters_map.values()]
+    return "Success"
 
-            # bulk create Transporters
-            Transporter.objects.bulk_create(unique_transports)
 
-            # fetch unique customer_details wrt email
-            unique_customer_details = [Address(**v) for v in customer_details_map.values()]
+def dump_cursors(cursors):
 
-            # bulk create Address (Customer Details)
-            Address.objects.bulk_create(unique_customer_details)
+    """
+    cursors of the sync engine to a json serializable list
+    :param cursors: dict representing (shop_id, fulfilment_method): (last_shipment_date, last_shipment_id)
+    :return: list of [shop_id, fulfilment_method, last_shipment_date <iso str>, last_shipment_id]
+    """
 
-            # fetch unique billing_details wrt email
-            unique_billing_details = [Address(**v) for v in billing_details_map.values()]
+    return [
+        [shop_id, fulfilment_method, last_shipment_date.isoformat() if last_shipment_date else None, last_shipment_id]
+        for (shop_id, fulfilment_method), (last_shipment_date, last_shipment_id) in cursors.items()
+    ]
 
-            # bulk create Address (Billing Details)
-            Address.objects.bulk_create(unique_billing_details)
 
-            # creating a dict of email: id of Address
-            customer_details_created_objects_map = {v['email']: v['id'] for v in Address.objects.filter(type='Customer').values('email', 'id')}
-            billing_details_created_objects_map = {v['email']: v['id'] for v in Address.objects.filter(type='Billing').values('email', 'id')}
+def load_cursors(cursors_list):
 
-            # update customer_details_id of shipments wrt customer_details_created_objects_map
-            for k, v in shipments_to_customer_details_map.items():
-                shipments_map[k] = {**shipments_map[k], **{'customer_details_id': customer_details_created_objects_map.get(v)}}
+    """
+    reverse of dump_cursors
+    """
 
-            # update billing_details_id of shipments wrt shipments_to_billing_details_map
-            for k, v in shipments_to_billing_details_map.items():
-                shipments_map[k] = {**shipments_map[k], **{'billing_details_id': billing_details_created_objects_map.get(v)}}
+    return {
+        (shop_id, fulfilment_method): (parse_datetime(last_shipment_date) if last_shipment_date else None,
+                                       last_shipment_id)
+        for shop_id, fulfilment_method, last_shipment_date, last_shipment_id in cursors_list
+    }
 
-            shipments_to_save = [Shipment(**v) for v in shipments_map.values()]
 
-            # bulk create Shipments
-            Shipment.objects.bulk_create(shipments_to_save)
+@shared_task
+def save_sync_cursors(result, cursors_list, sync_id=None, shop_ids=None):
 
-            # bulk create ShipmentItems
-            ShipmentItem.objects.bulk_create(shipment_items_to_save)
+    """
+    Called once the fetch_shipment_details task of the shops has succeeded (chained to it).
+    Saves the cursors of the shops (newest shipment listed) only if all of their details are known to be stored,
+    the next incremental sync must not skip shipments which might not be stored.
 
-    except Exception as e:
-        print(e)
-        raise e
+    :param result: result of the task, a list of results for the chords queued before the tasks were chained
+    :param cursors_list: cursors of the shops, see dump_cursors
+    :param sync_id: id of the SyncCheckpoint of the run
+    :param shop_ids: shops marked done in the checkpoint, defaults to the shops of the cursors
+    :return:
+    """
 
-    return "Success"
+    results = result if isinstance(result, list) else [result]
 
+    if all(result == "Success" for result in results):
+        ShopSyncCursor.save_cursors(load_cursors(cursors_list))
 
-@shared_task
-def fetch_shipment_details(shop_to_shipments_ids_map):
+        if sync_id:
+            checkpoint = SyncCheckpoint(sync_id)
 
-    # dict representing shop_id <pk>: Shop obj
-    shops_objs_dict = Shop.objects.filter(is_active=True).in_bulk()
+            if shop_ids is None:
+                shop_ids = {shop_id for shop_id, _, _, _ in cursors_list}
 
-    shops_ids = set(shops_objs_dict.keys())
+            for shop_id in shop_ids:
+                checkpoint.set_shop_state(shop_id, SyncCheckpoint.DONE)
 
-    shops_cycle = cycle(shops_ids)
+    return "Success"
 
-    # will be helpful if token is not expired
-    shop_id_to_access_token_details_map = {
 
-    }
+def queue_shipment_details(shop_to_shipments_ids_map, cursors_list, sync_id=None):
 
-    shop_id = next(shops_cycle)
+    """
+    Queues fetch_shipment_details tasks for the shipment ids, a few shops per task (see SyncScheduler), every task
+    saves the cursors of its shops once it has succeeded.
 
-    # dict representing shop_id: shipment_details <list>
-    shop_to_shipment_details_map = defaultdict(list)
+    :param shop_to_shipments_ids_map: dict representing shop_id: shipments_ids <list>
+    :param cursors_list: see dump_cursors
+    :param sync_id: id of the SyncCheckpoint of the run
+    :return:
+    """
 
-    while shops_ids:
+    shop_ids_to_detail = set()
 
-        shop_obj = shops_objs_dict[shop_id]
+    for batch in SyncScheduler.split_shipment_ids(shop_to_shipments_ids_map):
 
-        shipment_id = shop_to_shipments_ids_map[str(shop_id)].pop()
+        shop_ids = list(batch)
+        shop_ids_to_detail.update(shop_ids)
 
-        url = "{}{}{}".format(BASE_URL, SHIPMENT_DETAILS_END_POINT, str(shipment_id))
+        chain(
+            fetch_shipment_details.s(batch, sync_id),
+            save_sync_cursors.s([cursor for cursor in cursors_list if cursor[0] in batch], sync_id, shop_ids)
+        ).delay()
 
-        # check if token is already present, if not call an api to fetch token again
-        if shop_id_to_access_token_details_map.get(shop_id):
-            access_token = shop_id_to_access_token_details_map.get(shop_id)
+    # nothing new to store for the other shops
+    shop_ids = [shop_id for shop_id in shop_to_shipments_ids_map if shop_id not in shop_ids_to_detail]
 
-        else:
-            access_token = APICall.get_access_token(shop_obj.client_id, shop_obj.client_secret)
+    save_sync_cursors("Success", [cursor for cursor in cursors_list if cursor[0] in shop_ids], sync_id, shop_ids)
 
-            shop_id_to_access_token_details_map[shop_id] = access_token
 
-        # making api call, send wait_for_retry flag as true if only one shop is present
-        access_token, response_data, wait_time = APICall.get_request(access_token,
-                                                                     url,
-                                                                     shop_obj.client_id,
-                                                                     shop_obj.client_secret,
-                                                                     len(shops_ids) == 1)
+@shared_task(serializer=SERIALIZER_NAME)
+def fetch_shipment_details(shop_to_shipments_ids_map, sync_id=None):
 
-        # Handling retry-logic
-        if response_data is None and wait_time:
-            # change current_shop with next in cycle
-            shop_id = next(shops_cycle)
-            shop_to_shipments_ids_map[str(shop_id)].append(shipment_id)
+    """
+    Fetches and stores the details of the shipments.
+    :return: "Success" once all the details are stored
+    """
 
-            continue
+    # dict representing shop_id <pk>: Shop obj
+    shops_objs_dict = Shop.objects.filter(is_active=True, id__in=shop_to_shipments_ids_map.keys()).in_bulk()
 
-        shop_to_shipment_details_map[shop_id].append(response_data)
+    # shops deactivated in the meantime are not synced anymore
+    shop_to_shipments_ids_map = {
+        k: v for k, v in shop_to_shipments_ids_map.items() if int(k) in shops_objs_dict
+    }
 
-        # remove shop from shops_ids if all the shipment_details are obtained
-        if not shop_to_shipments_ids_map[str(shop_id)]:
-            shops_ids = shops_ids - {shop_id}
-            if not shops_ids:
-                # breaking here as next(shops_cycle) will raise StopIteration error
-                break
+    if sync_id:
+        checkpoint = SyncCheckpoint(sync_id)
 
-            # update shops_cycle, shop_id
-            shops_cycle = cycle(shops_ids)
-            shop_id = next(shops_cycle)
+        # when the task is run again (dead worker), the shipments stored in the meantime are skipped
+        for k, v in shop_to_shipments_ids_map.items():
+            pending, _ = checkpoint.get_pending(k)
+            shop_to_shipments_ids_map[k] = [shipment_id for shipment_id in v if shipment_id in pending]
 
-    # calling store_data_in_db task for each store
-    for k, v in shop_to_shipment_details_map.items():
-        store_data_in_db.delay(k, v)
+    # batches of fetched shipment details are stored while the remaining ones are still being fetched,
+    # errors of storing fail the task
+    SyncEngine(shops_objs_dict).fetch_shipment_details(shop_to_shipments_ids_map,
+                                                       on_batch=BatchStore(store_data_in_db, sync_id))
 
     return "Success"
 
 
 @shared_task
-def fetch_shipments(shop_ids):
+def fetch_shipments(shop_ids, incremental=False, refresh_stored=False, sync_id=None):
+
+    """
+    Lists the shipments of the shops and queues fetch_shipment_details tasks for them.
+    With incremental, only the shipments newer than the cursors of the shops are listed.
+    The details of the shipments already stored are not fetched again, unless refresh_stored is set.
+    With a sync_id, progress is recorded in the SyncCheckpoint of the run, a run of the task for the same
+    sync_id continues where the previous one stopped.
+    """
 
     # dict representing shop_id <pk>: Shop obj
     shops_objs_dict = Shop.objects.filter(is_active=True, id__in=shop_ids).in_bulk()
 
-    shops_ids = set(shops_objs_dict.keys())
+    checkpoint = SyncCheckpoint(sync_id) if sync_id else None
 
-    shops_cycle = cycle(shops_ids)
+    if checkpoint:
+        # shops deactivated since the run started are not synced, they must not be resumed either
+        for shop_id in set(shop_ids) - set(shops_objs_dict):
+            checkpoint.set_shop_state(shop_id, SyncCheckpoint.DONE)
 
-    # will be helpful if token is not expired
-    shop_id_to_access_token_details_map = {
+    cursors = ShopSyncCursor.get_cursors(shops_objs_dict.keys()) if incremental else None
 
-    }
-
-    # maintaining current page of each_store
-    shop_id_to_current_page_no_map = {
-        i: 1 for i in shops_ids
-    }
+    engine = SyncEngine(shops_objs_dict)
 
     # dict representing shop_id: shipments_ids <list>
-    shop_to_shipments_ids_map = defaultdict(list)
-
-    fulfilment_methods = ("FBR", "FBB")
+    shop_to_shipments_ids_map = engine.fetch_shipment_ids(cursors, checkpoint)
 
-    # current shop_id
-    shop_id = next(shops_cycle)
+    if not refresh_stored:
+        shop_to_shipments_ids_map = remove_stored_shipment_ids(shop_to_shipments_ids_map)
 
-    # current page of current_shop
-    page = shop_id_to_current_page_no_map[shop_id]
+    # shops without new shipments too, to save their cursors / mark them done
+    shop_to_shipments_ids_map = {
+        shop_id: shop_to_shipments_ids_map.get(shop_id, []) for shop_id in shops_objs_dict
+    }
 
-    for fulfilment_method in fulfilment_methods:
+    cursors_list = dump_cursors(engine.newest_shipments_map)
 
-        while shops_ids:
+    if checkpoint:
+        for shop_id in shops_objs_dict:
+            checkpoint.save_pending(shop_id, shop_to_shipments_ids_map.get(shop_id, []),
+                                    [cursor for cursor in cursors_list if cursor[0] == shop_id])
 
-            shop_obj = shops_objs_dict[shop_id]
+    queue_shipment_details(shop_to_shipments_ids_map, cursors_list, sync_id)
 
-            url = "{}{}?page={}&fulfilment-method={}".format(BASE_URL, SHIPMENTS_LIST_END_POINT, str(page), fulfilment_method)
+    return "Success "
 
-            # check if token is already present, if not call an api to fetch token again
-            if shop_id_to_access_token_details_map.get(shop_id):
-                access_token = shop_id_to_access_token_details_map.get(shop_id)
 
-            else:
-                access_token = APICall.get_access_token(shop_obj.client_id, shop_obj.client_secret)
+def resume_sync(sync_id):
 
-                shop_id_to_access_token_details_map[shop_id] = access_token
+    """
+    Continues an interrupted sync run from its checkpoint:
+    shops still being listed are listed again from their last fetched page,
+    for shops being detailed only the shipments not stored yet are fetched.
 
-            # making api call, send wait_for_retry flag as true if only one shop is present
-            access_token, response_data, wait_time = APICall.get_request(access_token, url,
-                                                                         shop_obj.client_id,
-                                                                         shop_obj.client_secret,
-                                                                         len(shops_ids) == 1)
+    :param sync_id:
+    :return: no.of shops resumed
+    """
 
-            # Handling retry-logic
-            if response_data is None and wait_time:
-                # change current_shop with next in cycle
-                shop_id = next(shops_cycle)
-                # set page value to current shop's page
-                page = shop_id_to_current_page_no_map[shop_id]
+    checkpoint = SyncCheckpoint(sync_id)
 
-                continue
+    meta = checkpoint.get_meta()
 
-            # If no response is returned i.e all the shipments are obtained
-            if not response_data:
-                # remove current_shop from shops_ids
-                shops_ids = shops_ids - {shop_id}
-                if not shops_ids:
-                    # breaking here as next(shops_cycle) will raise StopIteration error
-                    break
+    shop_states = checkpoint.get_shop_states()
 
-                # update shops_cycle, shop_id, page
-                shops_cycle = cycle(shops_ids)
-                shop_id = next(shops_cycle)
-                page = shop_id_to_current_page_no_map.get(shop_id, 1)
+    listing_shop_ids = [shop_id for shop_id, state in shop_states.items() if state == SyncCheckpoint.LISTING]
 
-                continue
+    for shop_ids in SyncScheduler.split_shop_ids(listing_shop_ids):
+        fetch_shipments.delay(shop_ids, meta.get("incremental", False), meta.get("refresh_stored", False), sync_id)
 
-            shipment_ids = [shipment['shipment_id'] for shipment in response_data['shipments']]
+    # dict representing shop_id: shipments_ids <list> not stored yet
+    shop_to_shipments_ids_map = {}
+    cursors_list = []
 
-            shop_to_shipments_ids_map[shop_id].extend(shipment_ids)
+    for shop_id, state in shop_states.items():
 
-            # increment page of current_shop
-            shop_id_to_current_page_no_map[shop_id] += 1
+        if state == SyncCheckpoint.DETAILS:
+            pending, shop_cursors_list = checkpoint.get_pending(shop_id)
 
-            # update page value to current_shop's page
-            page = shop_id_to_current_page_no_map[shop_id]
+            shop_to_shipments_ids_map[shop_id] = sorted(pending)
+            cursors_list.extend(shop_cursors_list)
 
-    fetch_shipment_details.delay(shop_to_shipments_ids_map)
+    queue_shipment_details(shop_to_shipments_ids_map, cursors_list, sync_id)
 
-    return "Success "
+    return len(listing_shop_ids) + len(shop_to_shipments_ids_map)
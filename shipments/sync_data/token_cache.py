@@ -0,0 +1,169 @@
+# core imports
+import json
+import threading
+import time
+
+# project imports
+from shipments.utils import APICall, RedisUtils
+from boloo.global_constants import SYNC_TOKEN_REFRESH_MARGIN, SYNC_TOKEN_LOCK_TIMEOUT
+
+
+class AccessTokenCache:
+
+    """
+    Cache of bol.com access tokens, shared by all the sync tasks and workers.
+
+    Tokens are kept in redis together with their expiry and in an in-process dict (L1) in front of it.
+    A token is refreshed `refresh_margin` seconds (at most half of its lifetime) before it expires,
+    so requests never go out with an expired token.
+    Only one worker refreshes the token of a shop at a time (redis lock), the others wait for its result.
+    """
+
+    key_prefix = "access_token"
+
+    def __init__(self, refresh_margin=SYNC_TOKEN_REFRESH_MARGIN, lock_timeout=SYNC_TOKEN_LOCK_TIMEOUT):
+
+        self.refresh_margin = refresh_margin
+        self.lock_timeout = lock_timeout
+
+        # client_id: (access_token, refresh_at)
+        self.local_cache = {}
+
+        # client_id: threading.Lock, the sync engine asks for tokens from many threads
+        self.local_locks = {}
+        self.local_locks_lock = threading.Lock()
+
+    def get_key(self, client_id):
+
+        return '{}:{}'.format(self.key_prefix, client_id)
+
+    def get_lock_key(self, client_id):
+
+        return '{}:{}:lock'.format(self.key_prefix, client_id)
+
+    def is_fresh(self, token_details, stale_token=None):
+
+        """
+        checks if the token can still be used
+        :param token_details: (access_token, refresh_at) or None
+        :param stale_token: token which has been rejected by bol.com, never considered as fresh
+        :return: bool
+        """
+
+        return bool(token_details and token_details[0] != stale_token and token_details[1] > time.time())
+
+    def get_cached(self, client_id):
+
+        """
+        Returns the token from the in-process cache only (never blocks), None if it is missing or about to expire
+        :param client_id:
+        :return: access_token <str> or None
+        """
+
+        token_details = self.local_cache.get(client_id)
+
+        return token_details[0] if self.is_fresh(token_details) else None
+
+    def get_from_redis(self, client_id):
+
+        value = RedisUtils.get_connection().get(self.get_key(client_id))
+
+        if value is None:
+            return None
+
+        value = json.loads(value)
+
+        return value["access_token"], value["refresh_at"]
+
+    def store(self, client_id, access_token_details):
+
+        """
+        saves a new token in redis and in the in-process cache
+        :param client_id:
+        :param access_token_details: response of the token api (access_token, expires_in)
+        :return: (access_token, refresh_at)
+        """
+
+        expires_in = int(access_token_details["expires_in"])
+
+        token_details = access_token_details["access_token"], \
+            time.time() + expires_in - min(self.refresh_margin, expires_in / 2)
+
+        RedisUtils.get_connection().set(
+            self.get_key(client_id),
+            json.dumps({"access_token": token_details[0], "refresh_at": token_details[1]}),
+            ex=max(expires_in, 1)
+        )
+
+        self.local_cache[client_id] = token_details
+
+        return token_details
+
+    def get_access_token(self, client_id, client_secret, stale_token=None):
+
+        """
+        Returns a valid access_token of the shop.
+        Looks into the in-process cache, then into redis and only calls the token api if both are missing or expiring.
+
+        :param client_id:
+        :param client_secret:
+        :param stale_token: token which got a 401, it is refreshed even if it has not expired yet
+        :return: access_token <str>
+        """
+
+        if self.is_fresh(self.local_cache.get(client_id), stale_token):
+            return self.local_cache[client_id][0]
+
+        with self.local_locks_lock:
+            local_lock = self.local_locks.setdefault(client_id, threading.Lock())
+
+        # only one thread of the process goes to redis / bol.com for a shop
+        with local_lock:
+
+            # another thread might have refreshed it in the meantime
+            if self.is_fresh(self.local_cache.get(client_id), stale_token):
+                return self.local_cache[client_id][0]
+
+            return self.get_shared_access_token(client_id, client_secret, stale_token)
+
+    def get_shared_access_token(self, client_id, client_secret, stale_token):
+
+        connection = RedisUtils.get_connection()
+
+        lock = connection.lock(self.get_lock_key(client_id), timeout=self.lock_timeout)
+
+        deadline = time.time() + self.lock_timeout
+
+        while True:
+
+            token_details = self.get_from_redis(client_id)
+
+            if self.is_fresh(token_details, stale_token):
+                self.local_cache[client_id] = token_details
+                return token_details[0]
+
+            # no fresh token, refresh it if no other worker is already doing so
+            if lock.acquire(blocking=False):
+
+                try:
+                    # checking again as the refresh of another worker may have finished just before taking the lock
+                    token_details = self.get_from_redis(client_id)
+
+                    if not self.is_fresh(token_details, stale_token):
+                        token_details = self.store(client_id, APICall.get_access_token_details(client_id, client_secret))
+
+                    self.local_cache[client_id] = token_details
+
+                    return token_details[0]
+
+                finally:
+                    lock.release()
+
+            if time.time() > deadline:
+                # the worker holding the lock seems to be stuck, refreshing it ourselves
+                return self.store(client_id, APICall.get_access_token_details(client_id, client_secret))[0]
+
+            time.sleep(0.1)
+
+
+access_token_cache = AccessTokenCache()
@@ -0,0 +1,126 @@
+# core imports
+from django.db import connections, router
+from django.db.models import AutoField
+
+# project imports
+from shipments.utils import CommonUtils
+from boloo.global_constants import SYNC_UPSERT_BATCH_SIZE
+
+
+class BulkUpsert:
+
+    """
+    Inserts rows of a model, updating the existing ones (matched on `unique_fields`) instead of failing on them.
+
+    On MySQL every batch is a single INSERT ... ON DUPLICATE KEY UPDATE, MySQL itself does not write the rows whose
+    values have not changed. On other databases (sqlite for tests) the existing rows of the batch are read first,
+    new rows are bulk created and only the changed ones are bulk updated.
+    """
+
+    def __init__(self, model, unique_fields, update_fields=None, batch_size=SYNC_UPSERT_BATCH_SIZE):
+
+        """
+        :param model: model class
+        :param unique_fields: names of the fields identifying a row (primary key or unique together)
+        :param update_fields: names of the fields to update on existing rows, defaults to all the other fields
+        :param batch_size: no.of rows per query
+        """
+
+        self.model = model
+        self.batch_size = batch_size
+
+        opts = model._meta
+
+        self.unique_fields = [opts.get_field(name) for name in unique_fields]
+
+        # auto generated primary keys are left to the database
+        self.insert_fields = [f for f in opts.concrete_fields if not isinstance(f, AutoField)]
+
+        if update_fields is None:
+            self.update_fields = [f for f in self.insert_fields if f not in self.unique_fields]
+        else:
+            self.update_fields = [opts.get_field(name) for name in update_fields]
+
+    def get_unique_key(self, obj):
+
+        return tuple(getattr(obj, f.attname) for f in self.unique_fields)
+
+    def upsert_objs(self, objs):
+
+        """
+        :param objs: unsaved model instances
+        :return:
+        """
+
+        # rows with the same unique key are merged (last one wins)
+        objs = list({self.get_unique_key(obj): obj for obj in objs}.values())
+
+        connection = connections[router.db_for_write(self.model)]
+
+        for batch in CommonUtils.chunks(objs, self.batch_size):
+
+            if connection.vendor == 'mysql':
+                self.mysql_upsert(connection, batch)
+
+            else:
+                self.generic_upsert(batch)
+
+    def mysql_upsert(self, connection, objs):
+
+        qn = connection.ops.quote_name
+
+        updates = ', '.join('{0} = VALUES({0})'.format(qn(f.column)) for f in self.update_fields)
+
+        if not updates:
+            # nothing to update, an existing row is left as it is
+            pk_column = qn(self.model._meta.pk.column)
+            updates = '{0} = {0}'.format(pk_column)
+
+        sql = 'INSERT INTO {table} ({columns}) VALUES {values} ON DUPLICATE KEY UPDATE {updates}'.format(
+            table=qn(self.model._meta.db_table),
+            columns=', '.join(qn(f.column) for f in self.insert_fields),
+            values=', '.join(['({})'.format(', '.join(['%s'] * len(self.insert_fields)))] * len(objs)),
+            updates=updates
+        )
+
+        params = [
+            f.get_db_prep_save(f.pre_save(obj, True), connection) for obj in objs for f in self.insert_fields
+        ]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def generic_upsert(self, objs):
+
+        first_unique_field = self.unique_fields[0]
+
+        # narrowing down on the first unique field, the full key is matched below
+        existing_objs = self.model._default_manager.filter(**{
+            '{}__in'.format(first_unique_field.attname): {getattr(obj, first_unique_field.attname) for obj in objs}
+        })
+
+        existing_objs_map = {self.get_unique_key(obj): obj for obj in existing_objs}
+
+        objs_to_create = []
+        objs_to_update = []
+
+        for obj in objs:
+
+            existing_obj = existing_objs_map.get(self.get_unique_key(obj))
+
+            if existing_obj is None:
+                objs_to_create.append(obj)
+                continue
+
+            # skip rows which have not changed
+            if all(f.to_python(getattr(obj, f.attname)) == getattr(existing_obj, f.attname) for f in self.update_fields):
+                continue
+
+            obj.pk = existing_obj.pk
+            objs_to_update.append(obj)
+
+        if objs_to_create:
+            self.model._default_manager.bulk_create(objs_to_create)
+
+        if objs_to_update and self.update_fields:
+            self.model._default_manager.bulk_update(objs_to_update, [f.name for f in self.update_fields])
@@ -1,3 +1,707 @@
-from django.test import TestCase
+# core imports
+import csv
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from django.core.management import call_command
+from djangorestframework_camel_case.util import underscoreize
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 
-# Create your tests here.
+# project imports
+from boloo.celery import app
+from boloo.global_constants import SHIPMENTS_BULK_RETRIEVE_MAX_IDS
+from shipments.management.commands.check_query_plans import Command as CheckQueryPlansCommand
+from shipments.export import ShipmentsExport
+from shipments.models import Address, Shipment, ShipmentItem, Shop, Transporter
+from shipments.pagination import KeysetPagination
+from shipments.response_cache import shipments_response_cache
+from shipments.serializers import ShipmentSerializer
+from shipments.sync_data.checkpoint import SyncCheckpoint
+from shipments.sync_data.date_parser import BolDateParser
+from shipments.sync_data.engine import SyncEngine
+from shipments.sync_data.scheduler import SyncScheduler
+from shipments.sync_data.simulator import BolSimulator
+from shipments.sync_data.tasks import fetch_shipment_details, fetch_shipments, resume_sync, store_data_in_db
+from shipments.sync_data.token_cache import AccessTokenCache
+from shipments.sync_data.upsert import BulkUpsert
+from shipments.utils import APICall
+from shipments.views import ShipmentViewSet
+
+
+def create_shipments(shop, no_of_shipments):
+
+    """
+    Creates shipments of the shop: every 10th one without a date, 3 shipments per date, every 4th one without
+    customer details
+    :return: list of the shipments
+    """
+
+    transporter = Transporter.objects.create(transport_id=shop.id, transporter_code='TNT', track_and_trace='3S')
+    address = Address.objects.create(email='{}@example.com'.format(shop.name), type='Customer', first_name='a',
+                                     city='Utrecht')
+
+    start_date = datetime(2020, 6, 1, tzinfo=timezone.utc)
+
+    shipments = []
+
+    for i in range(1, no_of_shipments + 1):
+
+        shipment = Shipment.objects.create(
+            shipment_id=shop.id * 1000 + i, shop=shop, shipment_reference='ref-{}'.format(i),
+            shipment_date=None if i % 10 == 0 else start_date + timedelta(hours=i // 3),
+            transporter=transporter, customer_details=None if i % 4 == 0 else address, billing_details=address
+        )
+
+        ShipmentItem.objects.create(shipment=shipment, order_item_id=str(i), order_id=str(i), title='item',
+                                    quantity=i, offer_price=Decimal('12.50'), order_date=shipment.shipment_date)
+
+        shipments.append(shipment)
+
+    return shipments
+
+
+class QueryPlansTests(TestCase):
+
+    """
+    The shipments list / retrieve queries use indexes, keyset pages read a range of shipment_date
+    """
+
+    def test_query_plans(self):
+
+        # raises CommandError if a plan is not using indexes
+        call_command('check_query_plans', shops=2, shipments=1000, stdout=StringIO())
+
+    def test_mysql_range_problems(self):
+
+        command = CheckQueryPlansCommand()
+
+        def get_plan(access_type, used_key_parts):
+            return {"query_block": {"select_id": 1, "nested_loop": [
+                {"table": {"table_name": "shipments_shipment", "access_type": access_type,
+                           "key": "shipment_shop_date_idx", "used_key_parts": used_key_parts, "key_length": "14"}},
+                {"table": {"table_name": "shipments_transporter", "access_type": "eq_ref"}},
+            ]}}
+
+        self.assertEqual(command.get_mysql_range_problems(get_plan('range', ['shop_id', 'shipment_date']),
+                                                          'shipment_date'), [])
+
+        # only the shop is used, every shipment of the shop is read
+        self.assertEqual(len(command.get_mysql_range_problems(get_plan('ref', ['shop_id']), 'shipment_date')), 1)
+        self.assertEqual(len(command.get_mysql_range_problems(get_plan('range', ['shop_id']), 'shipment_date')), 1)
+
+    def test_sqlite_range_problems(self):
+
+        plan = "6 0 0 SEARCH shipments_shipment USING INDEX shipment_shop_date_idx (shop_id=? AND shipment_date<?)"
+
+        self.assertEqual(CheckQueryPlansCommand.get_sqlite_range_problems(plan, 'shipment_date'), [])
+
+        plan = "6 0 0 SEARCH shipments_shipment USING INDEX shipment_shop_date_idx (shop_id=?)"
+
+        self.assertEqual(len(CheckQueryPlansCommand.get_sqlite_range_problems(plan, 'shipment_date')), 1)
+
+
+class APICallTests(TestCase):
+
+    """
+    A 401 is answered by sending the request once more with a new token, after taking a token of the rate limiter
+    """
+
+    def get_request(self, status_codes):
+
+        sent_tokens, rate_limited = [], []
+
+        def get(url, headers, timeout):
+            sent_tokens.append(headers['Authorization'])
+            return SimpleNamespace(status_code=status_codes[len(sent_tokens) - 1], content=b'{"shipmentId": 1}',
+                                   headers={})
+
+        with mock.patch.object(APICall, 'get_session', return_value=SimpleNamespace(get=get)), \
+                mock.patch('shipments.sync_data.token_cache.access_token_cache.get_access_token',
+                           return_value='new-token'):
+
+            result = APICall.get_request('old-token', 'https://api.bol.com/retailer/shipments/1', 'client-id',
+                                         'client-secret', rate_limit=lambda: rate_limited.append(True))
+
+        return result, sent_tokens, rate_limited
+
+    def test_retry_with_new_token(self):
+
+        result, sent_tokens, rate_limited = self.get_request([401, 200])
+
+        self.assertEqual(result, ('new-token', {'shipment_id': 1}, 0))
+        self.assertEqual(sent_tokens, ['Bearer old-token', 'Bearer new-token'])
+        self.assertEqual(rate_limited, [True])
+
+    def test_single_retry(self):
+
+        with self.assertRaises(Exception):
+            self.get_request([401, 401, 200])
+
+
+class BulkUpsertTests(TestCase):
+
+    """
+    upsert_objs inserts the new rows and updates the existing ones (on the database of the tests)
+    """
+
+    def test_upsert_on_primary_key(self):
+
+        upsert = BulkUpsert(Transporter, ['transport_id'], batch_size=2)
+
+        upsert.upsert_objs([Transporter(transport_id=i, transporter_code='TNT', track_and_trace=str(i))
+                            for i in range(1, 4)])
+
+        # 2 is updated, 3 is unchanged, 4 is new, the last of the rows with the same key wins
+        upsert.upsert_objs([
+            Transporter(transport_id=2, transporter_code='DHL', track_and_trace='2'),
+            Transporter(transport_id=3, transporter_code='TNT', track_and_trace='3'),
+            Transporter(transport_id=4, transporter_code='TNT', track_and_trace='old'),
+            Transporter(transport_id=4, transporter_code='TNT', track_and_trace='4'),
+        ])
+
+        self.assertEqual(
+            list(Transporter.objects.order_by('transport_id').values_list('transport_id', 'transporter_code',
+                                                                          'track_and_trace')),
+            [(1, 'TNT', '1'), (2, 'DHL', '2'), (3, 'TNT', '3'), (4, 'TNT', '4')]
+        )
+
+    def test_upsert_on_unique_together(self):
+
+        upsert = BulkUpsert(Address, ['email', 'type'])
+
+        upsert.upsert_objs([Address(email='a@example.com', type='Customer', first_name='a'),
+                            Address(email='a@example.com', type='Billing', first_name='a')])
+
+        ids = dict(Address.objects.values_list('type', 'id'))
+
+        upsert.upsert_objs([Address(email='a@example.com', type='Customer', first_name='b', city='Utrecht'),
+                            Address(email='b@example.com', type='Customer', first_name='b')])
+
+        self.assertEqual(Address.objects.count(), 3)
+
+        customer = Address.objects.get(email='a@example.com', type='Customer')
+
+        # updated in place, the id is kept
+        self.assertEqual((customer.id, customer.first_name, customer.city), (ids['Customer'], 'b', 'Utrecht'))
+        self.assertEqual(Address.objects.get(email='a@example.com', type='Billing').first_name, 'a')
+
+
+class CompiledSerializerTests(TestCase):
+
+    """
+    The compiled serializers render the same data as ShipmentSerializer
+    """
+
+    def test_compiled_serializer(self):
+
+        shop = Shop.objects.create(name='compiled', client_id='client-id', client_secret='client-secret')
+
+        create_shipments(shop, 12)
+
+        for action in ('list', 'retrieve'):
+
+            view = ShipmentViewSet(action=action, request=SimpleNamespace(user=shop), format_kwarg=None)
+            shipments = list(view.get_queryset())
+
+            serialize = ShipmentSerializer.compile(action)
+
+            self.assertIsNotNone(serialize)
+            self.assertEqual(json.dumps([serialize(shipment) for shipment in shipments]),
+                             json.dumps(ShipmentSerializer(shipments, many=True, context={'view': view}).data))
+
+
+class KeysetPaginationTests(TestCase):
+
+    """
+    Walking the keyset pages (forwards and backwards) gives the shipments in the order of the page numbers,
+    including the shipments without a date
+    """
+
+    page_size = 4
+
+    def setUp(self):
+
+        shop = Shop.objects.create(name='keyset', client_id='client-id', client_secret='client-secret')
+
+        create_shipments(shop, 25)
+
+        view = ShipmentViewSet(action='list', request=SimpleNamespace(user=shop), format_kwarg=None)
+        self.queryset = view.get_queryset()
+
+    def get_page(self, pagination_class, url):
+
+        paginator = pagination_class()
+        paginator.page_size = self.page_size
+
+        page = paginator.paginate_queryset(self.queryset, Request(APIRequestFactory().get(url)))
+
+        return [shipment.shipment_id for shipment in page], paginator
+
+    def get_page_number_order(self):
+
+        shipment_ids, page_number = [], 1
+
+        while True:
+
+            page, paginator = self.get_page(PageNumberPagination, '/shipments/?page={}'.format(page_number))
+            shipment_ids.extend(page)
+
+            if not paginator.get_next_link():
+                return shipment_ids
+
+            page_number += 1
+
+    def test_keyset_walk(self):
+
+        expected_shipment_ids = self.get_page_number_order()
+
+        # the shipments without a date come last
+        self.assertEqual(len(expected_shipment_ids), 25)
+        self.assertIsNone(Shipment.objects.get(shipment_id=expected_shipment_ids[-1]).shipment_date)
+
+        pages, url = [], '/shipments/?pagination=cursor'
+
+        while url:
+            page, paginator = self.get_page(KeysetPagination, url)
+            pages.append(page)
+            url = paginator.get_next_link()
+
+        self.assertEqual([shipment_id for page in pages for shipment_id in page], expected_shipment_ids)
+
+        # and back, from the last page
+        back_pages = [pages[-1]]
+        url = paginator.get_previous_link()
+
+        while url:
+            page, paginator = self.get_page(KeysetPagination, url)
+            back_pages.insert(0, page)
+            url = paginator.get_previous_link()
+
+        self.assertEqual(back_pages, pages)
+
+
+class BolDateParserTests(TestCase):
+
+    """
+    BolDateParser gives the same datetimes as django's parse_datetime
+    """
+
+    values = [
+        '2020-06-03T16:41:23+02:00',
+        '2020-12-31T23:59:59+01:00',
+        '2020-01-01T00:00:00-05:30',
+        '2020-06-03T14:41:23+00:00',
+        '2020-06-03T14:41:23Z',
+        '2020-06-03T16:41:23+0200',
+    ]
+
+    def assert_same_datetimes(self, parser):
+
+        for value, parsed in zip(self.values, parser.parse_many(self.values)):
+            expected = parse_datetime(value)
+
+            self.assertEqual(parsed, expected, value)
+            self.assertEqual(parsed.utcoffset(), expected.utcoffset(), value)
+
+    def test_parse(self):
+
+        self.assert_same_datetimes(BolDateParser())
+
+    def test_parse_by_slicing(self):
+
+        # the parser of python < 3.7, without datetime.fromisoformat
+        parser = BolDateParser()
+        parser.fromisoformat = None
+
+        self.assert_same_datetimes(parser)
+
+    def test_empty(self):
+
+        self.assertIsNone(BolDateParser().parse(None))
+        self.assertIsNone(BolDateParser().parse(''))
+
+
+class AccessTokenCacheTests(TestCase):
+
+    """
+    Tokens are refreshed `refresh_margin` seconds before they expire, at most half of their lifetime before
+    """
+
+    def store(self, expires_in, refresh_margin):
+
+        token_cache = AccessTokenCache(refresh_margin=refresh_margin)
+
+        with mock.patch('shipments.sync_data.token_cache.RedisUtils.get_connection'), \
+                mock.patch('shipments.sync_data.token_cache.time.time', return_value=1000):
+            token_cache.store('client-id', {'access_token': 'token', 'expires_in': expires_in})
+
+        return token_cache
+
+    def test_refresh_margin(self):
+
+        token_cache = self.store(300, 60)
+
+        self.assertEqual(token_cache.local_cache['client-id'], ('token', 1240))
+
+    def test_token_shorter_lived_than_the_margin(self):
+
+        token_cache = self.store(60, 120)
+
+        self.assertEqual(token_cache.local_cache['client-id'], ('token', 1030))
+
+        # used until half of its lifetime instead of being refreshed on every request
+        with mock.patch('shipments.sync_data.token_cache.time.time', return_value=1029):
+            self.assertEqual(token_cache.get_cached('client-id'), 'token')
+
+
+class SyncSchedulerTests(TestCase):
+
+    """
+    Shops are packed a few per task, all the shipment ids of a shop go to the same task
+    """
+
+    def test_split_shop_ids(self):
+
+        self.assertEqual(SyncScheduler.split_shop_ids(list(range(1, 8)), shops_per_task=3),
+                         [[1, 4, 7], [2, 5], [3, 6]])
+        self.assertEqual(SyncScheduler.split_shop_ids([], shops_per_task=3), [])
+
+    def test_split_shipment_ids(self):
+
+        shop_to_shipments_ids_map = {1: [10, 11], 2: [20, 21, 22], 3: [], 4: [40]}
+
+        self.assertEqual(SyncScheduler.split_shipment_ids(shop_to_shipments_ids_map, shops_per_task=2),
+                         [{2: [20, 21, 22], 4: [40]}, {1: [10, 11]}])
+
+
+class SimulatorTestCase(TransactionTestCase):
+
+    """
+    Runs the sync tasks in the test process (eagerly) against a BolSimulator.
+    The engine stores from its threads, so the data has to be committed (TransactionTestCase).
+    """
+
+    no_of_shipments = 60
+
+    def setUp(self):
+
+        self.simulator = BolSimulator(no_of_shipments=self.no_of_shipments, page_size=20, latency=0).start()
+        self.addCleanup(self.simulator.stop)
+
+        for patcher in (mock.patch.object(APICall, 'access_token_url', self.simulator.access_token_url),
+                        mock.patch.object(SyncEngine, 'base_url', self.simulator.base_url)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        original_always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', original_always_eager)
+
+    def create_shop(self):
+
+        return Shop.objects.create(name='sync-{}'.format(uuid.uuid4().hex[:8]), client_id=str(uuid.uuid4()),
+                                   client_secret=Shop.generate_new_client_secret())
+
+    def get_no_of_detail_calls(self):
+
+        return sum(count for (endpoint, _), count in self.simulator.stats.items() if endpoint == 'detail')
+
+    @staticmethod
+    def start_sync(shops):
+
+        checkpoint = SyncCheckpoint(uuid.uuid4().hex)
+        checkpoint.start([shop.id for shop in shops], False, False)
+
+        return checkpoint
+
+
+class CheckpointedSyncTests(SimulatorTestCase):
+
+    """
+    A checkpointed sync removes the stored shipments from the pending ones, a redelivered detail task skips them
+    """
+
+    def test_checkpointed_sync(self):
+
+        shop = self.create_shop()
+        checkpoint = self.start_sync([shop])
+
+        fetch_shipments([shop.id], False, False, checkpoint.sync_id)
+
+        shipment_ids = list(Shipment.objects.filter(shop=shop).values_list('shipment_id', flat=True))
+
+        self.assertEqual(len(shipment_ids), self.no_of_shipments)
+        self.assertEqual(checkpoint.get_shop_states(), {shop.id: SyncCheckpoint.DONE})
+        self.assertEqual(checkpoint.get_pending(shop.id)[0], set())
+
+        no_of_detail_calls = self.get_no_of_detail_calls()
+
+        # the same batch again, as when celery redelivers it
+        fetch_shipment_details({shop.id: shipment_ids}, checkpoint.sync_id)
+
+        self.assertEqual(self.get_no_of_detail_calls(), no_of_detail_calls)
+
+
+class ResumeSyncTests(SimulatorTestCase):
+
+    """
+    resume_sync continues the shops of a run which are not done, from their checkpoint
+    """
+
+    def test_resume_listing(self):
+
+        shop = self.create_shop()
+        checkpoint = self.start_sync([shop])
+
+        # the task listing the shop has been lost
+        self.assertEqual(resume_sync(checkpoint.sync_id), 1)
+
+        self.assertEqual(Shipment.objects.filter(shop=shop).count(), self.no_of_shipments)
+        self.assertEqual(checkpoint.get_shop_states(), {shop.id: SyncCheckpoint.DONE})
+
+        self.assertEqual(resume_sync(checkpoint.sync_id), 0)
+
+    def test_resume_details(self):
+
+        shop = self.create_shop()
+        checkpoint = self.start_sync([shop])
+
+        fetch_shipments([shop.id], False, False, checkpoint.sync_id)
+
+        # a detail task died before storing 5 of the shipments
+        shipment_ids = sorted(Shipment.objects.filter(shop=shop).values_list('shipment_id', flat=True))[:5]
+
+        ShipmentItem.objects.filter(shipment_id__in=shipment_ids).delete()
+        Shipment.objects.filter(shipment_id__in=shipment_ids).delete()
+
+        checkpoint.save_pending(shop.id, shipment_ids, checkpoint.get_pending(shop.id)[1])
+
+        no_of_detail_calls = self.get_no_of_detail_calls()
+
+        self.assertEqual(resume_sync(checkpoint.sync_id), 1)
+
+        # only the pending shipments are fetched again
+        self.assertEqual(self.get_no_of_detail_calls() - no_of_detail_calls, 5)
+        self.assertEqual(Shipment.objects.filter(shop=shop).count(), self.no_of_shipments)
+        self.assertEqual(checkpoint.get_pending(shop.id)[0], set())
+        self.assertEqual(checkpoint.get_shop_states(), {shop.id: SyncCheckpoint.DONE})
+
+    def test_deactivated_shop(self):
+
+        shop, deactivated_shop = self.create_shop(), self.create_shop()
+        checkpoint = self.start_sync([shop, deactivated_shop])
+
+        Shop.objects.filter(id=deactivated_shop.id).update(is_active=False)
+
+        fetch_shipments([shop.id, deactivated_shop.id], False, False, checkpoint.sync_id)
+
+        self.assertEqual(checkpoint.get_shop_states(),
+                         {shop.id: SyncCheckpoint.DONE, deactivated_shop.id: SyncCheckpoint.DONE})
+        self.assertFalse(Shipment.objects.filter(shop=deactivated_shop).exists())
+
+        self.assertEqual(resume_sync(checkpoint.sync_id), 0)
+
+
+@override_settings(SHIPMENTS_RESPONSE_CACHE='locmem')
+class ShipmentsApiTestCase(TestCase):
+
+    """
+    Calls the shipments api as a shop with seeded shipments, the responses are cached in the test process
+    """
+
+    no_of_shipments = 12
+
+    def setUp(self):
+
+        # a new cache backend per test, the versions of the shop ids reused by the tests start over
+        patcher = mock.patch.object(shipments_response_cache, 'backend', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.shop = Shop.objects.create(name='api', client_id='client-id', client_secret='client-secret')
+        self.shipments = create_shipments(self.shop, self.no_of_shipments)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.shop.generate_jwt_token())
+
+
+class ResponseCacheTests(ShipmentsApiTestCase):
+
+    """
+    Responses carry the ETag of the version of the shop's shipments, If-None-Match answers 304 until it changes
+    """
+
+    def test_not_modified(self):
+
+        for url in ('/main/shipments/', '/main/shipments/?pagination=cursor',
+                    '/main/shipments/{}/'.format(self.shipments[0].shipment_id)):
+
+            response = self.client.get(url)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+            not_modified_response = self.client.get(url, HTTP_IF_NONE_MATCH='"other", ' + response['ETag'])
+
+            self.assertEqual(not_modified_response.status_code, 304)
+            self.assertEqual(not_modified_response['ETag'], response['ETag'])
+            self.assertEqual(not_modified_response.content, b'')
+
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_any_etag(self):
+
+        url = '/main/shipments/{}/'.format(self.shipments[0].shipment_id)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 304)
+
+        # only an existing shipment matches
+        self.assertEqual(self.client.get('/main/shipments/1/', HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+    def test_stored_shipments_make_responses_stale(self):
+
+        response = self.client.get('/main/shipments/')
+
+        simulator = BolSimulator()
+        self.addCleanup(simulator.server.server_close)
+
+        store_data_in_db(self.shop.id, [underscoreize(simulator.get_shipment_details(self.shop.client_id, 1))])
+
+        # a new version: the old ETag does not match anymore and the response is not taken from the cache
+        new_response = self.client.get('/main/shipments/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(new_response.status_code, 200)
+        self.assertNotEqual(new_response['ETag'], response['ETag'])
+        self.assertEqual(new_response.data['count'], response.data['count'] + 1)
+
+
+class BulkRetrieveTests(ShipmentsApiTestCase):
+
+    """
+    bulk retrieve returns the shipments in the order of the ids given, once each, and the ids it did not find
+    """
+
+    def test_bulk_retrieve(self):
+
+        shipment_ids = [self.shipments[2].shipment_id, self.shipments[0].shipment_id, 1,
+                        self.shipments[2].shipment_id]
+
+        for response in (self.client.post('/main/shipments/bulk/', {'shipmentIds': shipment_ids}, format='json'),
+                         self.client.get('/main/shipments/bulk/?ids={}'.format(','.join(map(str, shipment_ids))))):
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([shipment['shipmentId'] for shipment in response.json()['results']],
+                             [self.shipments[2].shipment_id, self.shipments[0].shipment_id])
+            self.assertEqual(response.json()['notFound'], [1])
+
+            # same details as retrieve
+            self.assertEqual(
+                response.json()['results'][0],
+                self.client.get('/main/shipments/{}/'.format(self.shipments[2].shipment_id)).json()
+            )
+
+    def test_invalid_shipment_ids(self):
+
+        for body in ([1, 2], {}, {'shipmentIds': []}, {'shipmentIds': 1}, {'shipmentIds': ['a']},
+                     {'shipmentIds': list(range(1, SHIPMENTS_BULK_RETRIEVE_MAX_IDS + 2))}):
+
+            response = self.client.post('/main/shipments/bulk/', body, format='json')
+
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('shipmentIds', response.json())
+
+        max_ids = list(range(1, SHIPMENTS_BULK_RETRIEVE_MAX_IDS + 1))
+
+        self.assertEqual(
+            self.client.post('/main/shipments/bulk/', {'shipmentIds': max_ids}, format='json').json()['notFound'],
+            max_ids
+        )
+
+
+class ExportTests(ShipmentsApiTestCase):
+
+    """
+    The exports have the details of retrieve: a json object per shipment (NDJSON), a line per item (CSV)
+    """
+
+    def setUp(self):
+
+        super().setUp()
+
+        # a shipment without items and one with two
+        ShipmentItem.objects.filter(shipment=self.shipments[0]).delete()
+        ShipmentItem.objects.create(shipment=self.shipments[1], order_item_id='second', order_id='2', title='item',
+                                    quantity=1, offer_price=Decimal('1.00'))
+
+        self.shipments_data = [self.client.get('/main/shipments/{}/'.format(shipment.shipment_id)).json()
+                               for shipment in self.shipments]
+
+    def export(self, output):
+
+        response = self.client.get('/main/shipments/export/?output={}'.format(output))
+
+        self.assertEqual(response.status_code, 200)
+
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+
+        ndjson = self.export('ndjson')
+
+        self.assertEqual([json.loads(line) for line in ndjson.splitlines()], self.shipments_data)
+
+        # read in several keyset batches, same lines
+        view = ShipmentViewSet(action='export', request=SimpleNamespace(user=self.shop), format_kwarg=None)
+        export = ShipmentsExport(view.get_queryset(), ShipmentSerializer, 'retrieve', batch_size=5)
+
+        self.assertEqual(''.join(export.stream('ndjson')), ndjson)
+
+    def test_csv(self):
+
+        rows = list(csv.DictReader(StringIO(self.export('csv'))))
+
+        expected_rows = []
+
+        for shipment_data in self.shipments_data:
+
+            row = {}
+
+            for field_name, value in shipment_data.items():
+
+                if field_name in ('transport', 'customerDetails', 'billingDetails'):
+                    row.update(('{}.{}'.format(field_name, name), nested_value)
+                               for name, nested_value in (value or {}).items())
+
+                elif field_name != 'shipmentItems':
+                    row[field_name] = value
+
+            # a line per item, a line without item values for a shipment without items
+            for item in shipment_data['shipmentItems'] or [{}]:
+                expected_rows.append(dict(row, **{'shipmentItems.{}'.format(name): value
+                                                  for name, value in item.items()}))
+
+        self.assertEqual(len(rows), len(expected_rows))
+        self.assertEqual(len(rows), self.no_of_shipments + 1)
+
+        for row, expected_row in zip(rows, expected_rows):
+
+            self.assertLessEqual(set(expected_row), set(row))
+
+            # csv has no types, None is an empty value
+            self.assertEqual(row, {column: '' if expected_row.get(column) is None else str(expected_row[column])
+                                   for column in row})
+
+        # customer details of every 4th shipment are null, their columns are empty
+        self.assertIsNone(self.shipments_data[3]['customerDetails'])
+        self.assertEqual(rows[4]['customerDetails.email'], '')
+        self.assertEqual(rows[4]['billingDetails.email'], '{}@example.com'.format(self.shop.name))
+        self.assertEqual(rows[0]['transport.transportId'], str(self.shop.id))
+        self.assertEqual(rows[0]['shipmentItems.orderItemId'], '')
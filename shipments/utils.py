@@ -1,19 +1,109 @@
+import logging
+import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-from datetime import datetime
-from djangorestframework_camel_case.util import underscoreize
+from django.conf import settings
+import redis
 import string
 import random
 
-from boloo.global_constants import ACCESS_TOKEN_URL
+from boloo.global_constants import ACCESS_TOKEN_URL, HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_TIMEOUT, \
+    HTTP_MAX_RETRIES, HTTP_RETRY_BACKOFF_FACTOR, HTTP_RETRY_STATUS_CODES
+from shipments.sync_data.date_parser import parse_bol_datetime
+from shipments.sync_data.decoder import default_decoder
+from shipments.sync_data.metrics import sync_metrics
+
+logger = logging.getLogger(__name__)
 
 
 class APICall:
 
     """
     Utils class used for making API calls
+
+    All the calls go through one requests.Session per process, so the connections to bol.com are kept alive and reused.
     """
 
+    # can be changed for running against a simulator
+    access_token_url = ACCESS_TOKEN_URL
+
+    session = None
+
+    # pid of the process which created the session, a forked worker must not share the sockets of its parent
+    session_pid = None
+
+    @staticmethod
+    def create_session():
+
+        """
+        Creates a session with a connection pool of HTTP_POOL_MAXSIZE connections per host and
+        retries on connection errors and 5xx responses.
+        :return: requests.Session
+        """
+
+        retry = Retry(
+            total=HTTP_MAX_RETRIES,
+            backoff_factor=HTTP_RETRY_BACKOFF_FACTOR,
+            status_forcelist=HTTP_RETRY_STATUS_CODES,
+            method_whitelist=frozenset(["GET", "POST"]),
+            raise_on_status=False
+        )
+
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        return session
+
+    @staticmethod
+    def get_session():
+
+        """
+        Returns the session of the current process, creates it on first use.
+        :return: requests.Session
+        """
+
+        if APICall.session is None or APICall.session_pid != os.getpid():
+            APICall.session = APICall.create_session()
+            APICall.session_pid = os.getpid()
+
+        return APICall.session
+
+    @staticmethod
+    def get_connection_pool_stats():
+
+        """
+        Connection reuse metrics of the session of the current process
+
+        :return: dict with no.of requests sent, connections opened and requests which reused a connection
+        """
+
+        stats = {"requests": 0, "connections": 0}
+
+        if APICall.session is None or APICall.session_pid != os.getpid():
+            stats["reused"] = 0
+            return stats
+
+        for adapter in set(APICall.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+
+            for key in pools.keys():
+                pool = pools.get(key)
+
+                if pool is None:
+                    continue
+
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+
+        stats["reused"] = stats["requests"] - stats["connections"]
+
+        return stats
+
     @staticmethod
     def get_headers(access_token):
 
@@ -41,74 +131,151 @@ class APICall:
         :return: access_token <str>
         """
 
-        r = requests.post(ACCESS_TOKEN_URL, data={"client_id": client_id,
-                                                  "client_secret": client_secret,
-                                                  "grant_type": "client_credentials"})
+        return APICall.get_access_token_details(client_id, client_secret)["access_token"]
 
-        response_data = r.json()
+    @staticmethod
+    def get_access_token_details(client_id, client_secret):
+
+        """
+        Fetches access_token and its lifetime from client_id and client_secret
+
+        :param client_id:
+        :param client_secret:
+        :return: response_data <dict> with access_token and expires_in (seconds)
+        """
+
+        with sync_metrics.timer('sync_token_fetch_seconds', status='error') as metric_labels:
+
+            r = APICall.get_session().post(APICall.access_token_url, data={"client_id": client_id,
+                                                                           "client_secret": client_secret,
+                                                                           "grant_type": "client_credentials"},
+                                           timeout=HTTP_TIMEOUT)
 
-        return response_data["access_token"]
+            metric_labels['status'] = r.status_code
+
+        return r.json()
 
     @staticmethod
-    def get_request(access_token, url, client_id, client_secret, wait_for_retry=False):
+    def get_request(access_token, url, client_id, client_secret, wait_for_retry=False, decoder=None,
+                    metric_labels=None, rate_limit=None, retry_unauthorized=True):
 
         """
         To make an API call
-        Handles if the token is expired.
+        Handles if the token is expired: the request is sent once more with a new token, a 401 on it raises.
         :param access_token:
         :param url:
         :param client_id:
         :param client_secret:
         :param wait_for_retry:
+        :param decoder: sync_data.decoder.ResponseDecoder for the response, defaults to converting all the keys
+        :param metric_labels: dict representing shop and endpoint (list / detail) of the request, for sync_metrics
+        :param rate_limit: callable blocking until another request may be sent (e.g TokenBucketRateLimiter.wait),
+                           called before a request is sent again
+        :param retry_unauthorized: False for the request already sent again after a 401
         :return:
         """
 
-        r = requests.get(url, headers=APICall.get_headers(access_token))
+        shop = (metric_labels or {}).get('shop', '')
+        endpoint = (metric_labels or {}).get('endpoint', '')
+
+        with sync_metrics.timer('sync_http_request_seconds', endpoint=endpoint, status='error') as labels:
+
+            r = APICall.get_session().get(url, headers=APICall.get_headers(access_token), timeout=HTTP_TIMEOUT)
+
+            labels['status'] = r.status_code
+
+        # per shop only the count, the latencies of all the shops share a histogram
+        sync_metrics.inc('sync_http_requests_total', shop=shop, endpoint=endpoint, status=r.status_code)
 
         if r.status_code == 200:
 
-            # Camel to snake case converter
-            response_data = underscoreize(r.json())
+            # json to dict with camel to snake case keys
+            with sync_metrics.timer('sync_parse_seconds', endpoint=endpoint):
+                response_data = (decoder or default_decoder).decode(r.content)
 
             return access_token, response_data, 0
 
         elif r.status_code == 401:
+
+            if not retry_unauthorized:
+                # the new token is refused too, trying again would not help
+                logger.error("%s returned %s with a new access token", url, r.status_code)
+                raise Exception
+
             # Token is expired
-            # Get a new access_token and try again
-            new_access_token = APICall.get_access_token(client_id, client_secret)
+            # Get a new access_token (shared with the other workers) and try again
+            # imported here as the token cache itself depends on APICall
+            from shipments.sync_data.token_cache import access_token_cache
+
+            new_access_token = access_token_cache.get_access_token(client_id, client_secret, stale_token=access_token)
 
-            return APICall.get_request(new_access_token, url, client_id, client_secret)
+            if rate_limit is not None:
+                rate_limit()
+
+            return APICall.get_request(new_access_token, url, client_id, client_secret, wait_for_retry, decoder,
+                                       metric_labels, rate_limit, False)
 
         elif r.status_code == 429:
 
             if wait_for_retry:
 
                 # sleep if wait_for_retry is explicitly specified
-                time.sleep(int(r.headers['retry-after']))
+                retry_after = int(r.headers['retry-after'])
+
+                sync_metrics.inc('sync_retry_after_sleeps_total', shop=shop, endpoint=endpoint)
+                sync_metrics.inc('sync_retry_after_seconds_total', retry_after, shop=shop, endpoint=endpoint)
+
+                time.sleep(retry_after)
 
-                return APICall.get_request(access_token, url, client_id, client_secret)
+                if rate_limit is not None:
+                    rate_limit()
+
+                return APICall.get_request(access_token, url, client_id, client_secret, wait_for_retry, decoder,
+                                           metric_labels, rate_limit, retry_unauthorized)
 
             return access_token, None, int(r.headers['retry-after'])
 
         else:
             # unknown status_code, raise exception
-            print(r.status_code)
+            logger.error("%s returned %s", url, r.status_code)
             raise Exception
 
 
+class RedisUtils:
+
+    """
+    Utils class for sharing a redis connection (pool) within a process
+    """
+
+    connection = None
+
+    @staticmethod
+    def get_connection():
+
+        """
+        Returns the redis client of this process, created on first use.
+        The underlying connection pool resets itself after a fork, so it is safe to use from celery workers.
+        :return: redis.Redis
+        """
+
+        if RedisUtils.connection is None:
+            RedisUtils.connection = redis.Redis.from_url(settings.REDIS_URL)
+
+        return RedisUtils.connection
+
+
 class CommonUtils:
 
     @staticmethod
     def get_datetime_from_request(request_date):
 
-        # TODO: check for better alternative
         """
-        string to datetime converter
+        string to datetime converter, see sync_data.date_parser.BolDateParser
         :param request_date:
         :return:
         """
 
-        return datetime.strptime(request_date[:19] + request_date[19:22] + request_date[23:26], '%Y-%m-%dT%H:%M:%S%z') if request_date else None
+        return parse_bol_datetime(request_date)
 
     @staticmethod
     def random_alpha_numeric_lower(length):
@@ -1,12 +1,19 @@
 # core imports
-from rest_framework import viewsets
-from django.db.models import Prefetch
+from collections import OrderedDict
+from django.http import StreamingHttpResponse
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 
 # project imports
-from shipments.models import Shipment, ShipmentItem, Shop
+from boloo.authentication import shop_auth_cache
+from boloo.global_constants import SHIPMENTS_BULK_RETRIEVE_MAX_IDS
+from shipments.export import ShipmentsExport
+from shipments.models import Shipment, Shop
+from shipments.pagination import KeysetPagination
+from shipments.response_cache import shipments_response_cache
 from shipments.serializers import ShipmentSerializer, ShopSerializer
 
 
@@ -19,29 +26,42 @@ class ShipmentViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Shipment.objects.all()
     serializer_class = ShipmentSerializer
 
-    @staticmethod
-    def prefetch_shipment_items(query):
+    # ?pagination=cursor (or a cursor) selects keyset pagination, page numbers stay the default
+    keyset_pagination_class = KeysetPagination
 
-        # Pre-fetching shipment_items to avoid multiple DB calls
-        shipment_items_q = ShipmentItem.objects.all()
+    @property
+    def paginator(self):
 
-        prefetch_obj = Prefetch('shipment_items', queryset=shipment_items_q)
+        """
+        Overriding the default paginator to let the client choose between page number and keyset pagination.
 
-        query = query.prefetch_related(
-            prefetch_obj
-        )
+        :return: paginator instance
+        """
+
+        if not hasattr(self, '_paginator'):
+            query_params = self.request.query_params
+
+            if query_params.get('pagination') == 'cursor' or \
+                    self.keyset_pagination_class.cursor_query_param in query_params:
+                self._paginator = self.keyset_pagination_class()
 
-        return query
+            else:
+                self._paginator = super().paginator
+
+        return self._paginator
 
     def get_queryset(self):
 
         """
         Overriding the default get_queryset to reduce unnecessary data fetches.
+        Only the columns rendered by the serializer for the action are loaded
+        (see ModelReadSerializerBase.get_projection):
+        transporter and addresses are joined, shipment_items are prefetched.
 
         :return: queryset
         """
 
-        queryset = Shipment.objects.filter(shop_id=self.request.user.id).select_related('transporter')
+        queryset = Shipment.objects.filter(shop_id=self.request.user.id)
 
         if self.action == 'list':
 
@@ -49,23 +69,183 @@ class ShipmentViewSet(viewsets.ReadOnlyModelViewSet):
             If the action is list
             """
 
-            query = self.prefetch_shipment_items(queryset)
+            # shipment_date is needed by the keyset pagination cursors
+            query = self.get_serializer_class().project_queryset(queryset, self.action,
+                                                                 required_fields=('shipment_date',))
 
-            return query.order_by('-shipment_date')
+            # shipment_id keeps the order of shipments with the same date stable between pages
+            return query.order_by('-shipment_date', '-shipment_id')
 
-        elif self.action == 'retrieve':
+        elif self.action in ('retrieve', 'bulk_retrieve', 'export'):
 
             """
-            If the action is retrieve
+            If the action is retrieve (of one or many shipments) or export
             """
 
-            query = self.prefetch_shipment_items(queryset)
+            return self.get_serializer_class().project_queryset(queryset, 'retrieve')
 
-            query = query.select_related('customer_details', 'billing_details')
+        return
 
-            return query
+    def get_cached_response(self, request, get_response):
 
-        return
+        """
+        Returns the response of the action from shipments_response_cache, builds and caches it if it is not there.
+        Answers 304 Not Modified if the client already has it (If-None-Match with the ETag of the response).
+
+        :param request:
+        :param get_response: callable building the response
+        :return: Response
+        """
+
+        shop_id = request.user.id
+
+        # same url (page / cursor / shipment_id) and media type of the same version of the shop's shipments
+        key = shipments_response_cache.get_key(
+            shop_id, shipments_response_cache.get_version(shop_id), self.action,
+            '{} {}'.format(request.accepted_media_type, request.build_absolute_uri())
+        )
+
+        headers = {'ETag': shipments_response_cache.get_etag(key), 'Cache-Control': 'private, no-cache'}
+
+        if_none_match = [etag.strip() for etag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+
+        # the ETag is only handed out with a response, a client having it has the response
+        if headers['ETag'] in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        data = shipments_response_cache.get(key)
+
+        if data is None:
+            data = get_response().data
+            shipments_response_cache.set(key, data)
+
+        # any representation, only once there is one (get_response raises for a shipment which does not exist)
+        if '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+
+        return self.get_cached_response(request, lambda: self.get_list_response(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+
+        return self.get_cached_response(request, lambda: self.get_retrieve_response(request, *args, **kwargs))
+
+    def get_list_response(self, request, *args, **kwargs):
+
+        """
+        Same as ListModelMixin.list, with the compiled serializer of the action (see ModelReadSerializerBase.compile)
+        """
+
+        serialize = self.get_serializer_class().compile(self.action)
+
+        if serialize is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+
+        if page is not None:
+            return self.get_paginated_response([serialize(instance) for instance in page])
+
+        return Response([serialize(instance) for instance in queryset])
+
+    def get_retrieve_response(self, request, *args, **kwargs):
+
+        """
+        Same as RetrieveModelMixin.retrieve, with the compiled serializer of the action
+        """
+
+        serialize = self.get_serializer_class().compile(self.action)
+
+        if serialize is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        return Response(serialize(self.get_object()))
+
+    @action(detail=False, methods=["get", "post"], url_path="bulk")
+    def bulk_retrieve(self, request):
+
+        """
+        Details (same as retrieve) of many shipments in one response.
+        Shipment ids are given as ?ids=1,2,3 or as shipmentIds in the body of a POST, at most
+        SHIPMENTS_BULK_RETRIEVE_MAX_IDS of them. They are fetched with one query (plus the prefetch of the items).
+
+        :param request:
+        :return: Response with results (in the order of the ids given) and notFound (ids of no shipment of the shop)
+        """
+
+        shipment_ids = self.get_bulk_shipment_ids(request)
+
+        shipments = {shipment.shipment_id: shipment
+                     for shipment in self.get_queryset().filter(shipment_id__in=shipment_ids)}
+
+        serialize = self.get_serializer_class().compile('retrieve')
+
+        if serialize is None:
+            serializer = self.get_serializer_class()(context={'action': 'retrieve', 'request': request})
+            serialize = serializer.to_representation
+
+        return Response(OrderedDict([
+            ('results', [serialize(shipments[shipment_id]) for shipment_id in shipment_ids
+                         if shipment_id in shipments]),
+            ('not_found', [shipment_id for shipment_id in shipment_ids if shipment_id not in shipments]),
+        ]))
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request):
+
+        """
+        Streams all the shipments of the shop with their details (same as retrieve), as NDJSON (?output=ndjson, default)
+        or CSV (?output=csv, a line per shipment item), see ShipmentsExport.
+
+        :param request:
+        :return: StreamingHttpResponse
+        """
+
+        output = request.query_params.get('output', 'ndjson')
+
+        if output not in ShipmentsExport.content_types:
+            raise ValidationError({'output': 'one of {}'.format(', '.join(ShipmentsExport.content_types))})
+
+        export = ShipmentsExport(self.get_queryset(), self.get_serializer_class(), 'retrieve')
+
+        response = StreamingHttpResponse(export.stream(output), content_type=ShipmentsExport.content_types[output])
+        response['Content-Disposition'] = 'attachment; filename="shipments.{}"'.format(output)
+
+        return response
+
+    @staticmethod
+    def get_bulk_shipment_ids(request):
+
+        """
+        :param request:
+        :return: list of the shipment ids asked for, without duplicates
+        """
+
+        if request.method == 'POST':
+            # the body may be any json (e.g a list), only an object can have shipmentIds
+            shipment_ids = request.data.get('shipment_ids') if isinstance(request.data, dict) else None
+
+        else:
+            shipment_ids = [shipment_id for shipment_id in request.query_params.get('ids', '').split(',')
+                            if shipment_id.strip()]
+
+        if not isinstance(shipment_ids, list) or not shipment_ids:
+            raise ValidationError({'shipment_ids': 'a list of shipment ids is required'})
+
+        if len(shipment_ids) > SHIPMENTS_BULK_RETRIEVE_MAX_IDS:
+            raise ValidationError({'shipment_ids': 'at most {} shipment ids are allowed'.format(
+                SHIPMENTS_BULK_RETRIEVE_MAX_IDS)})
+
+        try:
+            return list(OrderedDict.fromkeys(int(shipment_id) for shipment_id in shipment_ids))
+
+        except (TypeError, ValueError):
+            raise ValidationError({'shipment_ids': 'shipment ids have to be integers'})
 
 
 class ShopViewSet(viewsets.ModelViewSet):
@@ -80,6 +260,13 @@ class ShopViewSet(viewsets.ModelViewSet):
     queryset = Shop.objects.filter(is_active=True)
     serializer_class = ShopSerializer
 
+    def perform_update(self, serializer):
+
+        super().perform_update(serializer)
+
+        # tokens of the shop have to be checked against its new details
+        shop_auth_cache.invalidate(serializer.instance.id)
+
     def perform_destroy(self, instance):
 
         """
@@ -91,6 +278,8 @@ class ShopViewSet(viewsets.ModelViewSet):
         instance.is_active = False
         instance.save(update_fields=['is_active'])
 
+        shop_auth_cache.invalidate(instance.id)
+
 
 class LoginViewSet(viewsets.ViewSet):
 